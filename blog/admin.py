@@ -2,7 +2,7 @@ from django.contrib import admin
 '''здесь мы регистрируем модели для добавления их в систему
 администрирования Django (использование сайта администрирования
 Django не является обязательным!)'''
-from .models import Post, Comment
+from .models import Post, Comment, OutboxMessage
 
 # admin.site.register(Post) # обычная регистрация модели
 
@@ -26,4 +26,23 @@ class PostAdmin(admin.ModelAdmin): # создали пользовательск
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'post', 'created', 'active')
     list_filter = ('active', 'created', 'updated')
+    list_editable = ('active',) # изменения сохраняются через Comment.save(), который поправляет счетчик статьи
     search_fields = ('name', 'email', 'body')
+    actions = ('activate_comments', 'deactivate_comments')
+
+    def activate_comments(self, request, queryset):
+        '''массовые действия обновляют и денормализованные счетчики active_comment_count'''
+        queryset.set_active(True)
+    activate_comments.short_description = 'Показать выбранные комментарии'
+
+    def deactivate_comments(self, request, queryset):
+        queryset.set_active(False)
+    deactivate_comments.short_description = 'Скрыть выбранные комментарии'
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'created', 'attempts', 'next_attempt', 'sent_at')
+    list_filter = ('sent_at', 'created')
+    search_fields = ('subject', 'recipients')
+    readonly_fields = ('created', 'last_error')
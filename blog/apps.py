@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BlogConfig(AppConfig):
     name = 'blog'
+
+    def ready(self):
+        from . import signals # регистрируем обработчики сигналов моделей (см. signals.py)
@@ -0,0 +1,85 @@
+'''Архив статей по годам, месяцам и дням.
+Условия publish__year/__month/__day компилируются в SQL-выражения извлечения части даты
+(EXTRACT, django_datetime_extract), которые не используют индекс по publish. Вместо них
+период задается полуоткрытым диапазоном [начало, начало следующего периода) в текущей
+временной зоне: такое условие – это поиск по индексу (slug, publish) или (publish).
+
+Количество опубликованных статей за каждый день хранится в ArchiveDay и пересчитывается
+для затронутых дней при изменении статуса и даты публикации (signals.py); после массовых
+операций в обход сигналов и после смены TIME_ZONE таблица перестраивается командой build_archive.'''
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import ArchiveDay, Post
+
+
+def period_range(year, month=None, day=None):
+    '''границы периода (начало включительно, конец – нет) в текущей временной зоне;
+    ValueError – если такой даты нет (в том числе если период выходит за пределы дат Python,
+    например год 99999999999999999999 или день 9999/12/31, конец которого уже не дата)'''
+    try:
+        if day is not None:
+            start = date(year, month, day)
+            end = start + timedelta(days=1)
+        elif month is not None:
+            start = date(year, month, 1)
+            end = date(year + month // 12, month % 12 + 1, 1)
+        else:
+            start = date(year, 1, 1)
+            end = date(year + 1, 1, 1)
+        return day_start(start), day_start(end)
+    except OverflowError as error:
+        raise ValueError(str(error)) from error
+
+
+def day_start(day):
+    return timezone.make_aware(datetime(day.year, day.month, day.day))
+
+
+def day_counts(start=None, end=None):
+    '''[(день, количество статей)] за период [start, end) в порядке убывания дней'''
+    days = ArchiveDay.objects.filter(post_count__gt=0)
+    if start is not None:
+        days = days.filter(day__gte=timezone.localdate(start), day__lt=timezone.localdate(end))
+    return list(days.values_list('day', 'post_count'))
+
+
+def period_counts(counts, period):
+    '''суммирует количества по дням в количества по периодам: year, month или day;
+    возвращает [(первый день периода, количество)] в порядке убывания'''
+    totals = OrderedDict()
+    for day, count in counts:
+        if period == 'year':
+            key = date(day.year, 1, 1)
+        elif period == 'month':
+            key = date(day.year, day.month, 1)
+        else:
+            key = day
+        totals[key] = totals.get(key, 0) + count
+    return list(totals.items())
+
+
+def recount_days(days):
+    '''пересчитывает количество опубликованных статей за дни days (по частичному индексу publish)'''
+    for day in set(days):
+        count = Post.published.filter(publish__gte=day_start(day),
+                                      publish__lt=day_start(day + timedelta(days=1))).count()
+        ArchiveDay.objects.update_or_create(day=day, defaults={'post_count': count})
+
+
+def rebuild_archive(batch_size=5000):
+    '''полная перестройка ArchiveDay; статьи читаются диапазонами id'''
+    last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+    counts = {}
+    for start in range(0, last_id, batch_size):
+        for publish in Post.published.filter(id__gt=start, id__lte=start + batch_size)\
+                                     .values_list('publish', flat=True):
+            day = timezone.localdate(publish)
+            counts[day] = counts.get(day, 0) + 1
+    with transaction.atomic():
+        ArchiveDay.objects.all().delete()
+        ArchiveDay.objects.bulk_create([ArchiveDay(day=day, post_count=count) for day, count in counts.items()],
+                                       batch_size=batch_size)
+    return len(counts)
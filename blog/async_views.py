@@ -0,0 +1,41 @@
+'''Асинхронные версии обработчиков чтения для работы под ASGI (mysite/asgi.py).
+Синхронные обработчики Django 3.1 под ASGI выполняет через sync_to_async(thread_sensitive=True),
+то есть в одном общем потоке: запросы читателей обрабатываются строго по очереди.
+Здесь вся работа обработчика (проверка условного запроса, чтения из базы и кеша, рендеринг)
+выполняется одним вызовом в пуле потоков (thread_sensitive=False), поэтому несколько
+запросов обрабатываются одновременно, а цикл событий не блокируется.
+
+Работа не дробится на отдельные вызовы для каждого запроса к базе: у потока из пула
+нет постоянного соединения, и после каждого вызова соединения закрываются так же,
+как в конце обычного запроса (с учетом CONN_MAX_AGE), так что каждый вызов открывал бы
+новое соединение. Промежуточные слои блога тоже асинхронные (см. MIDDLEWARE),
+иначе Django выполнял бы всю цепочку в общем потоке и запросы снова шли бы по очереди.
+Обработчики подключаются настройкой BLOG_ASYNC_VIEWS (см. urls.py).'''
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from . import views
+
+async def run(func, *args, **kwargs):
+    '''выполняет синхронную функцию в пуле потоков, не блокируя цикл событий'''
+    return await sync_to_async(partial(call, func, *args, **kwargs), thread_sensitive=False)()
+
+
+def call(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def post_list(request, tag_slug=None):
+    return await run(views.post_list, request, tag_slug)
+
+
+async def post_detail(request, year, month, day, post):
+    # POST комментария – тот же синхронный обработчик, в транзакции одного потока
+    return await run(views.post_detail, request, year, month, day, post)
+
+
+async def post_search(request):
+    return await run(views.post_search, request)
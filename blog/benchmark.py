@@ -0,0 +1,207 @@
+'''Нагрузочные замеры обработчиков блога на синтетических данных.
+seed_blog() наполняет базу статьями с Markdown-текстом, тегами (популярность тегов
+и комментируемость статей распределены неравномерно, как на живом сайте) и комментариями.
+run_benchmark() для нескольких размеров базы замеряет время ответа (перцентили) и
+количество SQL-запросов основных страниц через тестовый клиент Django, compare()
+сравнивает два таких замера. Команды: seed_blog и bench_views.'''
+import random
+from itertools import accumulate
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+from .archive import rebuild_archive
+from .cache import bump_content_version
+from .models import Post, Comment
+from .rendering import render_post
+from .search import get_search_backend
+from .similar import rebuild_similar_posts
+from .feeds import invalidate_all_feeds
+from .sitemaps import invalidate_section, section_size
+from .tagindex import rebuild_tag_index
+
+WORDS = ('django', 'python', 'запрос', 'индекс', 'кеш', 'шаблон', 'модель', 'представление', 'статья',
+         'комментарий', 'база', 'данных', 'сервер', 'страница', 'поиск', 'тег', 'производительность',
+         'миграция', 'форма', 'сигнал', 'транзакция', 'курсор', 'очередь', 'процесс', 'поток', 'профилирование',
+         'оптимизация', 'нагрузка', 'задержка', 'пагинация', 'лента', 'карта', 'сайта', 'разметка')
+TOPICS = ('python', 'django', 'postgresql', 'cache', 'search', 'testing', 'deploy', 'nginx', 'asyncio', 'orm')
+PERCENTILES = (50, 90, 99)
+MIN_REGRESSION = 0.5 # рост медианы меньше чем на 0,5 мс считается шумом измерений
+
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(words // 2, words)))
+    return text.capitalize() + '.'
+
+
+def markdown_body(rng, paragraphs):
+    '''Markdown-текст со всеми основными элементами разметки'''
+    blocks = []
+    for number in range(paragraphs):
+        if number and number % 4 == 0:
+            blocks.append(f'## {sentence(rng, 5)[:-1]}')
+        kind = rng.random()
+        if kind < 0.15:
+            blocks.append('\n'.join(f'* {sentence(rng, 6)}' for _ in range(rng.randint(2, 5))))
+        elif kind < 0.25:
+            blocks.append('    ' + '\n    '.join(f'{rng.choice(WORDS)} = {rng.randint(0, 99)}'
+                                               for _ in range(rng.randint(2, 6))))
+        else:
+            words = sentence(rng, 40).split()
+            position = rng.randrange(len(words))
+            words[position] = f'**{words[position]}**'
+            blocks.append(' '.join(words) + f' [Подробнее](https://example.com/{rng.randint(1, 999)}).')
+    return '\n\n'.join(blocks)
+
+
+def zipf_weights(count):
+    '''накопленные веса для выбора номеров из range(count) с вероятностью,
+    убывающей с номером (закон Ципфа): первые теги и статьи самые популярные'''
+    return list(accumulate(1 / (rank + 1) for rank in range(count)))
+
+
+def weighted(rng, weights, k):
+    '''k различных номеров с накопленными весами weights'''
+    chosen = set()
+    while len(chosen) < min(k, len(weights)):
+        chosen.update(rng.choices(range(len(weights)), cum_weights=weights, k=k - len(chosen)))
+    return list(chosen)
+
+
+def seed_blog(posts, comments, tags, seed=0, batch_size=1000, author=None):
+    '''добавляет posts статей (10% – черновики), comments комментариев и создает недостающие
+    теги до общего количества tags. Данные вставляются через bulk_create в обход сигналов,
+    поэтому затем пересчитываются счетчики, похожие статьи, индекс тегов, архив, поисковый индекс и версия кеша'''
+    rng = random.Random(seed)
+    author = author or User.objects.get_or_create(username='bench')[0]
+    existing = Tag.objects.count()
+    Tag.objects.bulk_create([Tag(name=f'{TOPICS[number % len(TOPICS)]} {number}',
+                                 slug=f'{TOPICS[number % len(TOPICS)]}-{number}')
+                             for number in range(existing, tags)])
+    tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+    tag_weights = zipf_weights(len(tag_ids))
+    content_type = ContentType.objects.get_for_model(Post)
+    start = Post.objects.count()
+    now = timezone.now()
+    post_ids = []
+    for offset in range(0, posts, batch_size):
+        batch = []
+        for number in range(start + offset, start + min(offset + batch_size, posts)):
+            post = Post(title=sentence(rng, 6)[:-1], slug=f'bench-post-{number}', author=author,
+                        body=markdown_body(rng, rng.randint(3, 20)),
+                        publish=now - timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60)),
+                        status='published' if rng.random() < 0.9 else 'draft')
+            batch.append(render_post(post))
+        with transaction.atomic():
+            Post.objects.bulk_create(batch)
+            # не все базы возвращают первичные ключи из bulk_create, поэтому получаем их по слагам
+            ids = dict(Post.objects.filter(slug__in=[post.slug for post in batch]).values_list('slug', 'id'))
+            TaggedItem.objects.bulk_create([
+                TaggedItem(content_type=content_type, object_id=ids[post.slug], tag_id=tag_ids[index])
+                for post in batch for index in weighted(rng, tag_weights, rng.randint(1, 5))])
+        post_ids.extend(ids[post.slug] for post in batch)
+
+    targets = post_ids or list(Post.objects.values_list('id', flat=True))
+    post_weights = zipf_weights(len(targets))
+    for offset in range(0, comments if targets else 0, batch_size):
+        Comment.objects.bulk_create([
+            Comment(post_id=targets[weighted(rng, post_weights, 1)[0]], name=f'Читатель {rng.randint(1, 500)}',
+                    email='reader@example.com', body=sentence(rng, 30), active=rng.random() < 0.95)
+            for _ in range(min(batch_size, comments - offset))])
+
+    Post.objects.recount_comments()
+    rebuild_similar_posts()
+    rebuild_tag_index()
+    rebuild_archive()
+    get_search_backend().rebuild()
+    for section in {post_id // section_size() for post_id in post_ids}:
+        invalidate_section(section * section_size())
+    invalidate_all_feeds()
+    bump_content_version()
+    return len(post_ids)
+
+
+def percentile(values, percent):
+    '''перцентиль методом ближайшего ранга'''
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, round(percent / 100 * len(values) + 0.5) - 1))]
+
+
+def measure(client, url, repeat):
+    '''время ответа (мс) и количество запросов к базе для repeat запросов после одного прогревочного'''
+    client.get(url)
+    timings, queries = [], []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise AssertionError(f'{url}: код ответа {response.status_code}')
+        queries.append(len(captured.captured_queries))
+    result = {f'p{percent}': round(percentile(timings, percent), 3) for percent in PERCENTILES}
+    result.update(mean=round(sum(timings) / len(timings), 3), queries=max(queries), bytes=len(response.content))
+    return result
+
+
+def benchmark_urls():
+    '''адреса замеряемых страниц: статья из середины архива, самый популярный тег,
+    поиск по слову из заголовка этой статьи'''
+    published = Post.published.order_by('-publish')
+    post = published[published.count() // 2]
+    tag = Tag.objects.annotate(total=Count('taggit_taggeditem_items')).order_by('-total', 'id').first()
+    urls = {'post_list': reverse('blog:post_list'),
+            'post_detail': post.get_absolute_url(),
+            'post_search': f"{reverse('blog:post_search')}?query={post.title.split()[0]}",
+            'post_feed': reverse('blog:post_feed'),
+            'sitemap_index': reverse('blog_sitemap_index'),
+            'sitemap_section': reverse('blog_sitemap_section', args=[post.id // section_size()])}
+    if tag is not None:
+        urls['post_list_by_tag'] = reverse('blog:post_list_by_tag', args=[tag.slug])
+    return urls
+
+
+def run_benchmark(sizes, comments_per_post=5, tags=50, repeat=20, page_cache=False, seed=0):
+    '''замеры для каждого размера базы (количества статей); база наполняется по возрастанию размеров'''
+    results = {'created': timezone.now().isoformat(), 'database': connection.vendor,
+               'settings': {'pagination': getattr(settings, 'BLOG_PAGINATION', 'offset'),
+                            'search_backend': getattr(settings, 'BLOG_SEARCH_BACKEND', ''),
+                            'page_cache': page_cache},
+               'runs': []}
+    client = Client()
+    for size in sorted(sizes):
+        missing = size - Post.objects.count()
+        if missing > 0:
+            seed_blog(missing, missing * comments_per_post, tags, seed=seed + size)
+        timeout = getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 600) if page_cache else 0
+        with override_settings(BLOG_PAGE_CACHE_TIMEOUT=timeout):
+            views = {name: measure(client, url, repeat) for name, url in benchmark_urls().items()}
+        results['runs'].append({'posts': Post.objects.count(), 'comments': Comment.objects.count(),
+                                'tags': Tag.objects.count(), 'views': views})
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    '''сравнение двух замеров по медиане времени и количеству запросов;
+    возвращает строки (статей, страница, было мс, стало мс, изменение, было запросов, стало запросов, регрессия)'''
+    previous = {(run['posts'], name): result for run in baseline['runs'] for name, result in run['views'].items()}
+    rows = []
+    for run in current['runs']:
+        for name, result in run['views'].items():
+            old = previous.get((run['posts'], name))
+            if old is None:
+                continue
+            change = (result['p50'] - old['p50']) / old['p50'] if old['p50'] else 0
+            regressed = (change > threshold and result['p50'] - old['p50'] > MIN_REGRESSION) \
+                or result['queries'] > old['queries']
+            rows.append((run['posts'], name, old['p50'], result['p50'], change,
+                         old['queries'], result['queries'], regressed))
+    return rows
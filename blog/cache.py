@@ -0,0 +1,125 @@
+'''Кеширование данных блога.
+Все ключи содержат "версию контента" – число, которое увеличивается сигналами
+при любом изменении статей и комментариев (см. signals.py). Старые записи при этом
+не удаляются явно: они становятся недостижимыми и со временем вытесняются из кеша.
+
+get_or_build() защищает от "набега" (cache stampede): при промахе значение строит
+только один процесс, получивший блокировку, а остальные ждут его результат;
+устаревшее значение отдается, пока блокировку держит тот, кто его обновляет
+(stale-while-revalidate).
+
+Версия контента и другие записи, которые удаляются или перестают использоваться явно,
+хранятся бессрочно только в общем для всех процессов кеше (Memcached, Redis, база).
+В кеше в памяти процесса (LocMemCache) изменение, сделанное одним процессом, не видно
+остальным, поэтому там такие записи живут не дольше BLOG_LOCAL_CACHE_TIMEOUT секунд
+(см. invalidation_timeout): после этого другие процессы перестают отдавать устаревшие данные.'''
+import time
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+from .metrics import record_cache
+from .routers import pin_seconds, reading_from_replica
+
+VERSION_KEY = 'blog:version'
+LAST_MODIFIED_KEY = 'blog:last_modified' # время последнего изменения контента (для условных GET-запросов)
+LOCK_TIMEOUT = 10   # сколько секунд живет блокировка на построение значения
+STALE_TIMEOUT = 60  # сколько секунд после устаревания значение еще можно отдавать
+WAIT_TIMEOUT = 2    # сколько секунд ждать чужого построения значения при холодном кеше
+WAIT_INTERVAL = 0.05
+
+
+def cache_timeout():
+    return getattr(settings, 'BLOG_CACHE_TIMEOUT', 300)
+
+
+def shared_cache():
+    '''кеш по умолчанию общий для всех процессов приложения'''
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def invalidation_timeout():
+    '''срок жизни записей, которые удаляются или перестают использоваться явно:
+    бессрочно в общем кеше, не дольше BLOG_LOCAL_CACHE_TIMEOUT секунд в кеше процесса'''
+    return None if shared_cache() else getattr(settings, 'BLOG_LOCAL_CACHE_TIMEOUT', 60)
+
+
+def content_version():
+    '''текущая версия контента блога'''
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # начальное значение берем из времени, чтобы после вытеснения ключа
+        # не вернуться к версии, для которой в кеше еще лежат старые данные
+        cache.add(VERSION_KEY, int(time.time() * 1000), invalidation_timeout())
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_content_version():
+    '''делает недостижимыми все закешированные данные блога
+    и запоминает время изменения контента (по нему отвечают на условные запросы, см. conditional.py)'''
+    cache.set(LAST_MODIFIED_KEY, timezone.now(), invalidation_timeout())
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError: # ключа нет в кеше
+        version = int(time.time() * 1000)
+        cache.set(VERSION_KEY, version, invalidation_timeout())
+        return version
+
+
+def versioned_key(*parts):
+    '''ключ кеша, привязанный к текущей версии контента'''
+    return ':'.join(['blog', str(content_version())] + [str(part) for part in parts])
+
+
+def get_or_build(key, builder, timeout=None):
+    '''возвращает значение из кеша или строит его вызовом builder() с защитой от набега'''
+    timeout = timeout or cache_timeout()
+    lock_key = key + ':lock'
+    name = key.split(':', 2)[-1] # имя для метрик – ключ без версии контента
+    entry = cache.get(key) # в кеше хранится пара (время устаревания, значение)
+    if entry is not None:
+        fresh_until, value = entry
+        if fresh_until > time.time():
+            record_cache(name, 'hit')
+            return value
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            record_cache(name, 'stale')
+            return value # значение уже обновляет другой процесс – отдаем устаревшее
+        locked = True
+    else:
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        if not locked:
+            entry = wait_for(key)
+            if entry is not None:
+                record_cache(name, 'hit')
+                return entry[1]
+    record_cache(name, 'miss')
+    try:
+        value = builder()
+        if not may_be_stale():
+            cache.set(key, (time.time() + timeout, value), timeout + STALE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+def may_be_stale():
+    '''данные прочитаны с реплики вскоре после изменения контента: реплика могла еще
+    не получить изменения, и такое значение нельзя сохранять в кеш под новой версией'''
+    if not reading_from_replica():
+        return False
+    changed = cache.get(LAST_MODIFIED_KEY)
+    return changed is not None and (timezone.now() - changed).total_seconds() < pin_seconds()
+
+
+def wait_for(key):
+    '''ожидает, пока другой процесс положит значение в кеш; None – если не дождались'''
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
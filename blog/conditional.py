@@ -0,0 +1,47 @@
+'''Условные GET-запросы (ETag / Last-Modified).
+Страницы блога зависят не только от своей статьи: боковая панель показывает последние
+и самые комментируемые статьи. Поэтому валидатор общий для всего блога – время последнего
+изменения статей, тегов или комментариев. Оно записывается в кеш при каждом изменении
+(см. cache.bump_content_version), а при его отсутствии заменяется текущим временем.
+Проверка не требует рендеринга страницы и при теплом кеше не обращается к базе;
+если клиент прислал совпадающий валидатор, возвращается 304 Not Modified.'''
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.views.decorators.http import condition
+from .cache import LAST_MODIFIED_KEY, invalidation_timeout
+
+
+def content_last_modified(request=None, *args, **kwargs):
+    '''время последнего изменения контента блога (сигнатура подходит для декоратора condition)'''
+    last_modified = cache.get(LAST_MODIFIED_KEY)
+    if last_modified is None:
+        # ключ вытеснен из кеша: время нельзя восстановить по полям updated – после удаления
+        # последней статьи или комментария оно уменьшится, а изменения без updated
+        # (скрытие комментариев, теги, перерендеринг) в нем не видны. Поэтому валидатором
+        # становится текущее время: оно не раньше любого выданного ранее, и клиенты
+        # однажды получают полный ответ вместо устаревшего 304
+        # (в кеше процесса ключ живет ограниченное время, чтобы изменения других процессов
+        # не оставались незамеченными, см. cache.invalidation_timeout)
+        cache.add(LAST_MODIFIED_KEY, timezone.now(), invalidation_timeout())
+        last_modified = cache.get(LAST_MODIFIED_KEY)
+    return last_modified
+
+
+def content_etag(request, *args, **kwargs):
+    '''ETag учитывает время изменения с точностью до микросекунд (Last-Modified – до секунд),
+    пользователя и CSRF-cookie: в формах страницы – CSRF-токен, который меняется при входе, выходе
+    и смене cookie, поэтому закешированная браузером копия со старым токеном должна стать недействительной'''
+    last_modified = content_last_modified(request)
+    if last_modified is None:
+        return None
+    user = request.user.pk if hasattr(request, 'user') and request.user.is_authenticated else ''
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    key = f'{last_modified.isoformat()}|{user}|{csrf_cookie}'
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+# декоратор для обработчиков блога, ленты и карты сайта
+conditional_content = condition(etag_func=content_etag, last_modified_func=content_last_modified)
+
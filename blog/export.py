@@ -0,0 +1,100 @@
+'''Потоковая выгрузка статей с тегами и комментариями в формате JSONL (NDJSON).
+В отличие от dumpdata, выгрузка не собирает данные в памяти: статьи читаются курсором
+(iterator(chunk_size) – в PostgreSQL это серверный курсор), теги и комментарии загружаются
+отдельными запросами на каждую пачку статей, а строки сразу отдаются потребителю –
+в файл (команда export_blog) или клиенту (обработчик post_export через StreamingHttpResponse).
+Поэтому объем памяти не зависит от размера таблиц.
+
+Каждая строка – одна статья:
+    {"id": 1, "title": "...", "slug": "...", "author": "admin", "body": "...", "status": "published",
+     "publish": "...", "created": "...", "updated": "...", "tags": ["django"],
+     "comments": [{"id": 1, "name": "...", "email": "...", "body": "...", "active": true,
+                   "created": "...", "updated": "..."}]}
+Формат совместим с командой import_posts (лишние поля она пропускает).
+
+При инкрементальной выгрузке (since) выгружаются статьи, измененные после since,
+и статьи, у которых после since изменились комментарии (со всеми их комментариями).'''
+import json
+import zlib
+from datetime import datetime
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from taggit.models import TaggedItem
+from .models import Post, Comment
+
+CHUNK_SIZE = 1000 # сколько статей читается из курсора за раз
+POST_FIELDS = ('id', 'title', 'slug', 'author__username', 'body', 'status', 'publish', 'created', 'updated')
+COMMENT_FIELDS = ('id', 'post_id', 'name', 'email', 'body', 'active', 'created', 'updated')
+
+
+def parse_since(value):
+    '''момент времени для инкрементальной выгрузки: дата или дата и время в формате ISO 8601'''
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f'неверный момент времени: {value}')
+        since = datetime(date.year, date.month, date.day)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def export_posts(since=None):
+    '''статьи для выгрузки в порядке id (значения полей, без создания объектов модели)'''
+    posts = Post.objects.all()
+    if since is not None:
+        changed_comments = Comment.objects.filter(updated__gt=since).values('post_id')
+        posts = posts.filter(Q(updated__gt=since) | Q(id__in=changed_comments))
+    return posts.order_by('id').values_list(*POST_FIELDS)
+
+
+def export_records(since=None, chunk_size=CHUNK_SIZE):
+    '''генератор словарей статей с тегами и комментариями'''
+    chunk = []
+    for values in export_posts(since).iterator(chunk_size=chunk_size):
+        chunk.append(values)
+        if len(chunk) == chunk_size:
+            yield from with_relations(chunk)
+            chunk = []
+    if chunk:
+        yield from with_relations(chunk)
+
+
+def with_relations(chunk):
+    '''дополняет пачку статей тегами и комментариями – по одному запросу на пачку'''
+    ids = [values[0] for values in chunk]
+    tags = {}
+    for post_id, name in TaggedItem.objects.filter(content_type__app_label='blog', content_type__model='post',
+                                                   object_id__in=ids)\
+                                           .order_by('tag__name').values_list('object_id', 'tag__name'):
+        tags.setdefault(post_id, []).append(name)
+    comments = {}
+    for values in Comment.objects.filter(post_id__in=ids).order_by('created', 'id').values_list(*COMMENT_FIELDS):
+        comment = dict(zip(COMMENT_FIELDS, values))
+        comments.setdefault(comment.pop('post_id'), []).append(comment)
+    for values in chunk:
+        record = dict(zip(POST_FIELDS, values))
+        record['author'] = record.pop('author__username')
+        record['tags'] = tags.get(record['id'], [])
+        record['comments'] = comments.get(record['id'], [])
+        yield record
+
+
+def export_lines(since=None, chunk_size=CHUNK_SIZE):
+    '''строки JSONL в байтах'''
+    for record in export_records(since, chunk_size):
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False).encode() + b'\n'
+
+
+def gzip_stream(chunks, level=6):
+    '''сжимает поток байтов в формат gzip по мере чтения; сжатые данные отдаются
+    блоками, когда их накапливается достаточно, чтобы не дробить ответ на мелкие части'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # 31 – заголовок и контрольная сумма gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -1,28 +1,141 @@
 '''Фид (feed) – это форма данных (чаще всего XML), которая пре-
 доставляет пользователям часто обновляемый контент. Пользователи смогут
 подписаться на обновление записей, используя агрегаторы – программное
-обеспечение для чтения новостей и получения уведомлений о новых фидах.'''
+обеспечение для чтения новостей и получения уведомлений о новых фидах.
+
+Кроме общей ленты есть ленты по тегам; каждая – в форматах RSS и Atom.
+Агрегаторы опрашивают ленты постоянно, поэтому готовый XML каждой ленты хранится в кеше
+и удаляется при изменении опубликованной статьи, которая может в нее попасть, а лента тега –
+и при переименовании или удалении тега (см. signals.py): опрос ленты – это чтение из кеша
+без обработки текста (для ленты тега – с одной проверкой, что тег существует).
+В кеше процесса ленты живут не дольше BLOG_LOCAL_CACHE_TIMEOUT секунд, так как другие
+процессы их не удаляют (см. cache.invalidation_timeout).
+Описание статьи – готовый анонс excerpt_html или, при BLOG_FEED_FULL_CONTENT = True,
+весь HTML статьи body_html (см. rendering.py).'''
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
 from django.contrib.syndication.views import Feed
-from django.template.defaultfilters import truncatewords
-from .models import Post
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from taggit.models import Tag
+from .cache import invalidation_timeout, may_be_stale
+from .metrics import record_cache
+from .models import Post, PostTag
+from .tagindex import post_tags
+
+FEED_ITEMS = 5 # количество статей в ленте
+FEED_KEY = 'blog:feed:%s'
+FEED_FORMATS = ('rss', 'atom')
+
+
+def full_content():
+    return getattr(settings, 'BLOG_FEED_FULL_CONTENT', False)
+
+
+def feed_key(feed_format, tag_slug=None):
+    return FEED_KEY % (f'tag:{tag_slug}:{feed_format}' if tag_slug else f'latest:{feed_format}')
+
+
+def invalidate_feeds(tag_slugs=(), latest=True):
+    '''удаляет из кеша общую ленту и ленты тегов tag_slugs во всех форматах'''
+    keys = [feed_key(feed_format, slug) for slug in tag_slugs for feed_format in FEED_FORMATS]
+    if latest:
+        keys += [feed_key(feed_format) for feed_format in FEED_FORMATS]
+    cache.delete_many(keys)
+
+
+def invalidate_post_feeds(post, tag_ids=()):
+    '''удаляет ленты, в которые может попасть статья: общую и ленты ее текущих тегов,
+    а также тегов tag_ids (например, только что снятых со статьи)'''
+    tag_ids = set(tag_ids) | set(post_tags().filter(object_id=post.pk).values_list('tag_id', flat=True))
+    invalidate_feeds(Tag.objects.filter(id__in=tag_ids).values_list('slug', flat=True) if tag_ids else ())
+
+
+def invalidate_all_feeds():
+    '''удаляет из кеша все ленты; для массовых операций в обход сигналов (импорт, заполнение базы)'''
+    invalidate_feeds(Tag.objects.values_list('slug', flat=True).iterator())
+
 
 class LatestPostsFeed(Feed): # унаследовали класс от Feed – класса подсистемы фидов Django
-    # Атрибуты title, link и description будут представлены в RSS 
+    # Атрибуты title, link и description будут представлены в RSS
     # элементами <title>, <link> и <description> соответственно
     title = 'Мой блог'
     link = '/blog/'
     description = 'Новый пост на моем блоге'
+    feed_format = 'rss' # часть ключа кеша
+
+    def __call__(self, request, *args, **kwargs):
+        '''готовый XML ленты берется из кеша; при промахе лента строится обычным образом.
+        Вместе с XML хранятся адрес сайта и режим описаний: при их изменении лента перестраивается'''
+        tag_slug = kwargs.get('tag_slug')
+        if tag_slug is not None and not Tag.objects.filter(slug=tag_slug).exists():
+            raise Http404('Тег не найден') # лента удаленного тега не отдается из кеша
+        key = feed_key(self.feed_format, tag_slug)
+        variant = (f'{request.scheme}://{get_current_site(request).domain}', full_content())
+        entry = cache.get(key)
+        record_cache('feed', 'miss' if entry is None or entry[0] != variant else 'hit')
+        if entry is None or entry[0] != variant:
+            response = super().__call__(request, *args, **kwargs) # Http404 для несуществующего тега не кешируется
+            entry = (variant, response['Content-Type'], response.content)
+            if not may_be_stale():
+                cache.set(key, entry, invalidation_timeout()) # хранится до изменения статей ленты
+        return HttpResponse(entry[2], content_type=entry[1])
 
     def items(self):
         '''объекты, которые будут включены в рассылку;
-        берем только последние 5 опубликованных статей для этого фида'''
-        return Post.published.all()[:5]
+        берем только последние FEED_ITEMS опубликованных статей для этого фида'''
+        return Post.published.select_related('author')[:FEED_ITEMS]
 
     def item_title(self, item):
         '''заголовок для объекта'''
         return item.title
 
     def item_description(self, item):
-        '''описание для объекта'''
-        return truncatewords(item.body, 30) # используем встроенный шаблонный фильтр truncatewords, 
-                                            # чтобы ограничить описание статей тридцатью словами
+        '''описание для объекта – HTML, подготовленный при сохранении статьи'''
+        return item.body_html if full_content() else item.excerpt_html
+
+    def item_author_name(self, item):
+        return item.author.username
+
+    def item_pubdate(self, item):
+        return item.publish
+
+    def item_updateddate(self, item):
+        return item.updated
+
+
+class AtomLatestPostsFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description # в Atom описанию ленты соответствует элемент <subtitle>
+    feed_format = 'atom'
+
+
+class TagPostsFeed(LatestPostsFeed):
+    '''последние статьи с тегом; статьи берутся из индекса тегов PostTag'''
+
+    def get_object(self, request, tag_slug):
+        return get_object_or_404(Tag, slug=tag_slug)
+
+    def title(self, tag):
+        return f'Мой блог: {tag.name}'
+
+    def link(self, tag):
+        return reverse('blog:post_list_by_tag', args=[tag.slug])
+
+    def description(self, tag):
+        return f'Новые статьи с тегом "{tag.name}"'
+
+    def items(self, tag):
+        return [row.post for row in PostTag.objects.filter(tag=tag).select_related('post__author')
+                                                   .order_by('-publish', '-post_id')[:FEED_ITEMS]]
+
+
+class AtomTagPostsFeed(TagPostsFeed):
+    feed_type = Atom1Feed
+    feed_format = 'atom'
+
+    def subtitle(self, tag):
+        return self.description(tag)
@@ -0,0 +1,293 @@
+'''Массовый импорт статей из файлов Markdown с заголовком (front matter) или из JSONL.
+Post.save() и TaggableManager выполняют по несколько запросов на каждую статью и тег,
+поэтому здесь статьи читаются потоком и сохраняются пачками: bulk_create для статей,
+недостающих тегов и связей статья–тег, каждая пачка – в своей транзакции.
+В памяти находится не больше одной пачки, так что объем импорта не ограничен.
+
+Формат JSONL – по одному объекту на строку:
+    {"title": "...", "body": "...", "slug": "...", "publish": "2021-03-01T10:00:00",
+     "status": "published", "tags": ["django", "python"], "author": "admin"}
+Формат Markdown – текст статьи после заголовка:
+    ---
+    title: Заголовок
+    publish: 2021-03-01 10:00
+    tags: [django, python]
+    ---
+Обязательны только title и body; слаг по умолчанию строится из заголовка
+и делается уникальным в пределах дня публикации (unique_for_date='publish').
+
+Индекс тегов обновляется вместе с каждой пачкой; после импорта пересчитываются
+остальные производные данные, которые при bulk_create не обновляются сигналами:
+похожие статьи, счетчики архива, поисковый индекс, карта сайта и версия кеша.'''
+import json
+import os
+import re
+from datetime import datetime, time, timedelta
+from functools import reduce
+from itertools import islice
+from operator import or_
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+from .archive import rebuild_archive
+from .cache import bump_content_version
+from .models import Post
+from .rendering import render_post
+from .search import get_search_backend
+from .similar import rebuild_similar_posts
+from .feeds import invalidate_all_feeds
+from .sitemaps import invalidate_section, section_size
+from .tagindex import refresh_tag_index
+
+SLUG_LENGTH = Post._meta.get_field('slug').max_length
+TRANSLIT = dict(zip('абвгдеёжзийклмнопрстуфхцчшщъыьэюя',
+                    ['a', 'b', 'v', 'g', 'd', 'e', 'e', 'zh', 'z', 'i', 'y', 'k', 'l', 'm', 'n', 'o', 'p',
+                     'r', 's', 't', 'u', 'f', 'h', 'ts', 'ch', 'sh', 'sch', '', 'y', '', 'e', 'yu', 'ya']))
+SUFFIX_RE = re.compile(r'-(\d+)$')
+STATUSES = dict(Post.STATUS_CHOICES)
+
+
+def make_slug(text):
+    '''латинский слаг: кириллица транслитерируется, так как шаблоны URL принимают только ASCII'''
+    text = ''.join(TRANSLIT.get(char, char) for char in text.lower())
+    return slugify(text)[:SLUG_LENGTH - 8].strip('-') or 'post' # место для суффикса -N
+
+
+def read_jsonl(path):
+    '''строки файла JSONL; разбираются в import_posts(), чтобы ошибка в одной строке
+    пропускала только эту запись'''
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def parse_record(record):
+    '''запись статьи в виде словаря; строка разбирается как JSON'''
+    if isinstance(record, str):
+        record = json.loads(record)
+    if not isinstance(record, dict):
+        raise ValueError(f'запись должна быть объектом, а не {type(record).__name__}')
+    return record
+
+
+def read_markdown(path):
+    '''статья из файла Markdown; заголовок между строками --- содержит пары "ключ: значение",
+    списки записываются как [a, b] или строками "- a" под ключом'''
+    with open(path, encoding='utf-8') as file:
+        text = file.read()
+    record = {}
+    lines = text.split('\n')
+    if lines and lines[0].strip() == '---':
+        end = next((number for number, line in enumerate(lines[1:], 1) if line.strip() == '---'), None)
+        if end is not None:
+            key = None
+            for line in lines[1:end]:
+                if key and line.lstrip().startswith('- '):
+                    record[key].append(line.lstrip()[2:].strip())
+                elif ':' in line:
+                    key, value = (part.strip() for part in line.split(':', 1))
+                    if value.startswith('[') and value.endswith(']'):
+                        value = [item.strip().strip('"\'') for item in value[1:-1].split(',') if item.strip()]
+                    elif not value:
+                        value = []
+                    else:
+                        value = value.strip('"\'')
+                    record[key] = value
+            lines = lines[end + 1:]
+    record.setdefault('body', '\n'.join(lines).strip())
+    record.setdefault('slug', os.path.splitext(os.path.basename(path))[0])
+    return record
+
+
+def read_records(paths):
+    '''статьи из файлов и каталогов (в каталогах – все *.md и *.jsonl)'''
+    for path in paths:
+        if os.path.isdir(path):
+            for root, directories, files in os.walk(path):
+                directories.sort()
+                yield from read_records(os.path.join(root, name) for name in sorted(files)
+                                        if name.endswith(('.md', '.jsonl')))
+        elif path.endswith('.jsonl'):
+            yield from read_jsonl(path)
+        else:
+            yield read_markdown(path)
+
+
+def parse_publish(value):
+    if not value:
+        return timezone.now()
+    if not isinstance(value, str):
+        value = str(value)
+    publish = parse_datetime(value.replace(' ', 'T', 1)) if len(value) > 10 else None
+    if publish is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f'неверная дата публикации: {value}')
+        publish = datetime(date.year, date.month, date.day)
+    if timezone.is_naive(publish):
+        publish = timezone.make_aware(publish)
+    return publish
+
+
+def build_post(record, authors, default_author, status):
+    '''несохраненная статья с отрендеренным HTML; теги – во временном атрибуте import_tags'''
+    title = str(record.get('title') or '').strip()
+    body = str(record.get('body') or '')
+    if not title or not body:
+        raise ValueError('у статьи должны быть title и body')
+    tags = record.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    post_status = record.get('status') or status
+    if post_status not in STATUSES:
+        raise ValueError(f'неверный статус: {post_status}')
+    post = Post(title=title[:250], body=body, publish=parse_publish(record.get('publish')),
+                slug=make_slug(str(record.get('slug') or title)),
+                status=post_status,
+                author=authors.get(record.get('author'), default_author))
+    post.import_tags = sorted({str(tag).strip()[:100] for tag in tags if str(tag).strip()})
+    return render_post(post)
+
+
+def in_days(dates):
+    '''условие "опубликована между первым и последним из дней dates" в виде полуоткрытого интервала
+    [начало первого дня, начало дня после последнего): в отличие от publish__date__in, оно использует
+    индекс по publish и не растет с числом дней; строки других дней отбрасываются вызывающим кодом'''
+    def start(date):
+        return timezone.make_aware(datetime.combine(date, time.min))
+    return Q(publish__gte=start(min(dates)), publish__lt=start(max(dates) + timedelta(days=1)))
+
+
+def assign_unique_slugs(posts):
+    '''делает слаги уникальными в пределах дня публикации: среди статей пачки
+    и уже сохраненных статей (повторы получают суффиксы -2, -3, ...)'''
+    if not posts:
+        return
+    groups = {}
+    for post in posts:
+        groups.setdefault((timezone.localdate(post.publish), post.slug), []).append(post)
+    dates = {date for date, _ in groups}
+    taken = {(timezone.localdate(publish), slug) for slug, publish in
+             Post.objects.filter(in_days(dates), slug__in={slug for _, slug in groups})
+                         .values_list('slug', 'publish')} & set(groups)
+    colliding = {key: group for key, group in groups.items() if len(group) > 1 or key in taken}
+    suffixes = used_suffixes(colliding)
+    occupied = taken | set(groups) # слаги с суффиксом, заданные в самой пачке (например, foo-2), тоже заняты
+    for (date, slug), group in colliding.items():
+        number = suffixes.get((date, slug), 1)
+        for index, post in enumerate(group):
+            if index == 0 and (date, slug) not in taken:
+                continue
+            number += 1
+            while (date, f'{slug}-{number}') in occupied:
+                number += 1
+            post.slug = f'{slug}-{number}'
+            occupied.add((date, post.slug))
+
+
+def used_suffixes(keys, chunk_size=500):
+    '''наибольшие занятые суффиксы -N для пар (день, слаг): один запрос на chunk_size слагов
+    с условиями slug LIKE 'слаг-%' (в PostgreSQL – по индексу слага)'''
+    result = {}
+    slugs = sorted({slug for _, slug in keys})
+    dates = {date for date, _ in keys}
+    for start in range(0, len(slugs), chunk_size):
+        condition = reduce(or_, (Q(slug__startswith=slug + '-') for slug in slugs[start:start + chunk_size]))
+        for slug, publish in Post.objects.filter(condition, in_days(dates)).values_list('slug', 'publish'):
+            match = SUFFIX_RE.search(slug)
+            key = (timezone.localdate(publish), slug[:match.start()]) if match else None
+            if key in keys:
+                result[key] = max(result.get(key, 1), int(match.group(1)))
+    return result
+
+
+def tag_ids(names):
+    '''id тегов по названиям; недостающие теги создаются одним bulk_create'''
+    ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        slugs = {name: make_slug(name) for name in missing}
+        taken = set(Tag.objects.filter(slug__in=slugs.values()).values_list('slug', flat=True))
+        tags = []
+        for name in missing:
+            slug, number = slugs[name], 1
+            while slug in taken:
+                number += 1
+                slug = f'{slugs[name]}-{number}'
+            taken.add(slug)
+            tags.append(Tag(name=name, slug=slug))
+        Tag.objects.bulk_create(tags, ignore_conflicts=True) # тег мог появиться в параллельном импорте
+        ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+def save_batch(posts, content_type):
+    '''сохраняет пачку статей с тегами; возвращает id созданных статей'''
+    assign_unique_slugs(posts)
+    Post.objects.bulk_create(posts)
+    if any(post.pk is None for post in posts):
+        # первичные ключи после bulk_create возвращает только PostgreSQL;
+        # для остальных баз находим статьи по паре (слаг, дата публикации)
+        ids = {(slug, publish): pk for slug, publish, pk in
+               Post.objects.filter(slug__in={post.slug for post in posts})
+                           .values_list('slug', 'publish', 'id')}
+        for post in posts:
+            post.pk = post.id = ids[(post.slug, post.publish)]
+    names = tag_ids({name for post in posts for name in post.import_tags})
+    TaggedItem.objects.bulk_create([TaggedItem(content_type=content_type, object_id=post.pk, tag_id=names[name])
+                                    for post in posts for name in post.import_tags])
+    return [post.pk for post in posts]
+
+
+def import_posts(records, default_author, batch_size=1000, status='published', on_error=None):
+    '''импортирует статьи из итератора словарей (или строк JSON); возвращает (создано, пропущено).
+    on_error(номер записи, исключение) вызывается для пропущенных записей'''
+    content_type = ContentType.objects.get_for_model(Post)
+    records = iter(records)
+    created = skipped = 0
+    number = 0
+    sections = set()
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            break
+        parsed, rejected = [], []
+        for record in chunk:
+            number += 1
+            try:
+                parsed.append((number, parse_record(record)))
+            except ValueError as error: # json.JSONDecodeError – тоже ValueError
+                rejected.append((number, error))
+        authors = {user.username: user for user in
+                   User.objects.filter(username__in={record.get('author') for _, record in parsed if record.get('author')})}
+        posts = []
+        for record_number, record in parsed:
+            try:
+                posts.append(build_post(record, authors, default_author, status))
+            except (ValueError, TypeError) as error:
+                rejected.append((record_number, error))
+        skipped += len(rejected)
+        if on_error:
+            for record_number, error in sorted(rejected, key=lambda item: item[0]):
+                on_error(record_number, error)
+        with transaction.atomic():
+            ids = save_batch(posts, content_type)
+            refresh_tag_index(ids)
+        created += len(ids)
+        sections.update(post_id // section_size() for post_id in ids)
+
+    if created:
+        rebuild_similar_posts()
+        rebuild_archive()
+        get_search_backend().rebuild()
+        for section in sections:
+            invalidate_section(section * section_size())
+        invalidate_all_feeds()
+        bump_content_version()
+    return created, skipped
@@ -0,0 +1,401 @@
+'''Нагрузочное тестирование блога: много посетителей одновременно.
+В отличие от benchmark.py (запросы по одному через тестовый клиент), здесь concurrency посетителей
+одновременно отправляют запросы в заданной пропорции (mix): список статей, статья, статьи с тегом,
+поиск, комментарий и «поделиться» (POST-запросы с CSRF-токеном из cookie, как у браузера).
+Так видно поведение приложения при конкуренции: соединения с базой, блокировки
+(в SQLite – "database is locked", т. е. ответы 500), набег на кеш при его устаревании.
+
+Запросы отправляются:
+  - wsgi – в WSGI-приложение проекта (mysite.wsgi.application) в том же процессе, посетители – потоки;
+  - asgi – в ASGI-приложение (mysite.asgi.application) в том же процессе, посетители – задачи asyncio;
+  - по адресу (http://127.0.0.1:8000) – в запущенный сервер, посетители – потоки
+    со своими keep-alive соединениями.
+Отчет: пропускная способность, перцентили времени ответа (общие и по видам запросов), коды ответов,
+количество SQL-запросов в секунду и на запрос каждой страницы и обращения к кешу. Последние
+считаются по разнице метрик (metrics.py) до и после прогона; у сервера они читаются с адреса /metrics.
+Запросы идут в настроенную базу (наполняется командой seed_blog): комментарии и письма
+из прогона в ней остаются. Команда: load_test.'''
+import asyncio
+import http.client
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.cookies import SimpleCookie
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.urls import reverse
+from .benchmark import PERCENTILES, WORDS, percentile, sentence, zipf_weights
+from .metrics import registry
+from .models import Post, TagStat, post_url
+
+DEFAULT_MIX = {'list': 30, 'detail': 30, 'tag': 15, 'search': 10, 'comment': 10, 'share': 5}
+POST_KINDS = ('comment', 'share')
+SAMPLE_POSTS = 500 # из скольких последних статей выбираются страницы статей (популярность – по закону Ципфа)
+SAMPLE_TAGS = 50
+METRIC_RE = re.compile(r'^(blog_db_queries_total|blog_request_duration_seconds_count|blog_cache_requests_total)'
+                       r'\{(.*)\} (\S+)$')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_mix(value):
+    '''пропорции запросов из строки вида "list=30,detail=30,comment=5"'''
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f'неизвестный вид запроса: {kind} (допустимы {", ".join(DEFAULT_MIX)})')
+        mix[kind] = float(weight)
+    return mix
+
+
+class LoadPlan:
+    '''случайный выбор запросов в пропорции mix по данным из базы'''
+
+    def __init__(self, mix=None):
+        self.mix = dict(mix or DEFAULT_MIX)
+        self.kinds = [kind for kind, weight in self.mix.items() if weight > 0]
+        if not self.kinds:
+            raise ValueError('не задано ни одного вида запросов')
+        self.weights = [self.mix[kind] for kind in self.kinds]
+        self.posts = list(Post.published.order_by('-publish', '-id').values_list('id', 'publish', 'slug')
+                                        [:SAMPLE_POSTS])
+        if not self.posts:
+            raise ValueError('в базе нет опубликованных статей – наполните ее командой seed_blog')
+        self.post_weights = zipf_weights(len(self.posts))
+        self.tags = list(TagStat.objects.filter(post_count__gt=0).order_by('-post_count')
+                                        .values_list('tag__slug', flat=True)[:SAMPLE_TAGS])
+        if 'tag' in self.kinds and not self.tags:
+            raise ValueError('в базе нет тегов с опубликованными статьями')
+
+    @property
+    def has_posts(self):
+        '''в смеси есть POST-запросы, для которых посетителю нужен CSRF-токен'''
+        return any(kind in POST_KINDS for kind in self.kinds)
+
+    def next_request(self, rng):
+        '''(вид, метод, адрес, данные формы или None)'''
+        kind = rng.choices(self.kinds, self.weights)[0]
+        post_id, publish, slug = rng.choices(self.posts, cum_weights=self.post_weights)[0]
+        if kind == 'list':
+            return kind, 'GET', reverse('blog:post_list'), None
+        if kind == 'detail':
+            return kind, 'GET', post_url(publish, slug), None
+        if kind == 'tag':
+            return kind, 'GET', reverse('blog:post_list_by_tag', args=[rng.choice(self.tags)]), None
+        if kind == 'search':
+            return kind, 'GET', f"{reverse('blog:post_search')}?{urlencode({'query': rng.choice(WORDS)})}", None
+        if kind == 'comment':
+            return kind, 'POST', post_url(publish, slug), {'name': 'Нагрузка', 'email': 'load@example.com',
+                                                            'body': sentence(rng)}
+        return kind, 'POST', reverse('blog:post_share', args=[post_id]), {
+            'name': 'Нагрузка', 'email': 'load@example.com', 'to': 'reader@example.com', 'comments': sentence(rng)}
+
+    def warmup_path(self):
+        '''страница с формой комментария: ее загрузка дает посетителю CSRF-cookie'''
+        _, publish, slug = self.posts[0]
+        return post_url(publish, slug)
+
+
+class Visitor:
+    '''посетитель со своими cookie (CSRF-токен, закрепление за основной базой) и генератором случайных чисел'''
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.cookies = {}
+
+    def prepare(self, form):
+        '''тело запроса и заголовки (без Host – его добавляет цель)'''
+        headers = []
+        if self.cookies:
+            headers.append(('Cookie', '; '.join(f'{name}={value}' for name, value in self.cookies.items())))
+        if form is None:
+            return b'', headers
+        form = dict(form, csrfmiddlewaretoken=self.cookies.get(settings.CSRF_COOKIE_NAME, ''))
+        body = urlencode(form).encode()
+        headers += [('Content-Type', 'application/x-www-form-urlencoded'), ('Content-Length', str(len(body)))]
+        return body, headers
+
+    def remember(self, headers):
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value).values():
+                    if morsel['max-age'] in ('0', 0) or not morsel.value:
+                        self.cookies.pop(morsel.key, None)
+                    else:
+                        self.cookies[morsel.key] = morsel.value
+
+
+class WSGITarget:
+    '''WSGI-приложение проекта (WSGI_APPLICATION) в том же процессе'''
+    name = 'wsgi'
+
+    def __init__(self, host='localhost'):
+        self.application = get_internal_wsgi_application()
+        self.host = host
+
+    def request(self, method, path, body, headers):
+        '''(код ответа, заголовки [(имя, значение)], размер тела ответа)'''
+        path, _, query = path.partition('?')
+        environ = {'REQUEST_METHOD': method, 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+                   'SERVER_NAME': self.host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                   'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': self.host,
+                   'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(body),
+                   'wsgi.errors': BytesIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+        for name, value in headers:
+            name = name.upper().replace('-', '_')
+            environ[name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name] = value
+        started = []
+
+        def start_response(status, response_headers, exc_info=None):
+            started[:] = [int(status.split()[0]), response_headers]
+
+        result = self.application(environ, start_response)
+        try:
+            size = sum(len(chunk) for chunk in result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close() # сигнал request_finished: Django закрывает соединения с базой
+        return started[0], started[1], size
+
+    def metrics(self):
+        return registry_snapshot()
+
+
+class ASGITarget:
+    '''ASGI-приложение в том же процессе; синхронные обработчики Django выполняет
+    в одном потоке (thread_sensitive), как и под настоящим ASGI-сервером'''
+    name = 'asgi'
+
+    def __init__(self, host='localhost'):
+        self.application = get_asgi_application()
+        self.host = host
+
+    async def request(self, method, path, body, headers):
+        path, _, query = path.partition('?')
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                 'root_path': '', 'client': ('127.0.0.1', 0), 'server': (self.host, 80),
+                 'headers': [(b'host', self.host.encode())] + [(name.lower().encode('latin-1'),
+                                                                 value.encode('latin-1')) for name, value in headers]}
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        finished = asyncio.Event()
+        response = {'size': 0}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = [(name.decode('latin-1'), value.decode('latin-1'))
+                                       for name, value in message.get('headers', [])]
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+                if not message.get('more_body'):
+                    finished.set()
+
+        try:
+            await self.application(scope, receive, send)
+        finally:
+            finished.set()
+        return response['status'], response['headers'], response['size']
+
+    def metrics(self):
+        return registry_snapshot()
+
+
+class HTTPTarget:
+    '''запущенный сервер; у каждого потока-посетителя свое keep-alive соединение'''
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.name = url
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' \
+            else http.client.HTTPConnection
+        self.local = threading.local()
+
+    def request(self, method, path, body, headers):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.connection_class(self.netloc, timeout=30)
+        try:
+            connection.request(method, self.prefix + path, body or None, dict(headers))
+            response = connection.getresponse()
+            size = len(response.read())
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+        return response.status, response.getheaders(), size
+
+    def metrics(self):
+        '''метрики сервера с адреса /metrics; None – если они недоступны
+        (адрес нагрузочного клиента должен входить в BLOG_METRICS_ALLOWED_IPS)'''
+        connection = self.connection_class(self.netloc, timeout=30)
+        try:
+            connection.request('GET', self.prefix + reverse('blog_metrics'))
+            response = connection.getresponse()
+            text = response.read().decode()
+        except (OSError, http.client.HTTPException):
+            return None
+        finally:
+            connection.close()
+        return parse_metrics(text) if response.status == 200 else None
+
+
+def registry_snapshot():
+    '''счетчики метрик текущего процесса: SQL-запросы и запросы по страницам, обращения к кешу'''
+    with registry.lock:
+        return {'queries': dict(registry.db_queries.values),
+                'requests': {labels: sum(counts) for labels, counts in registry.request_duration.counts.items()},
+                'cache': dict(registry.cache_requests.values)}
+
+
+def parse_metrics(text):
+    '''те же счетчики из текстового формата Prometheus (см. Registry.export)'''
+    names = {'blog_db_queries_total': 'queries', 'blog_request_duration_seconds_count': 'requests',
+             'blog_cache_requests_total': 'cache'}
+    snapshot = {'queries': {}, 'requests': {}, 'cache': {}}
+    for line in text.splitlines():
+        match = METRIC_RE.match(line)
+        if match:
+            labels = tuple(value.replace('\\"', '"').replace('\\\\', '\\')
+                           for _, value in LABEL_RE.findall(match.group(2)))
+            snapshot[names[match.group(1)]][labels] = float(match.group(3))
+    return snapshot
+
+
+class Budget:
+    '''ограничение прогона количеством запросов и (или) временем'''
+
+    def __init__(self, requests=None, duration=None):
+        self.left = requests
+        self.deadline = time.perf_counter() + duration if duration else None
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return False
+        if self.left is None:
+            return True
+        with self.lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+def visit(target, plan, visitor, budget, samples):
+    '''цикл запросов одного посетителя (поток)'''
+    while budget.take():
+        kind, method, path, form = plan.next_request(visitor.rng)
+        body, headers = visitor.prepare(form)
+        started = time.perf_counter()
+        try:
+            status, response_headers, _ = target.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException): # сервер недоступен или разорвал соединение
+            status, response_headers = 0, []
+        samples.append((kind, time.perf_counter() - started, status))
+        visitor.remember(response_headers)
+
+
+async def visit_async(target, plan, visitor, budget, samples):
+    '''цикл запросов одного посетителя (задача asyncio)'''
+    while budget.take():
+        kind, method, path, form = plan.next_request(visitor.rng)
+        body, headers = visitor.prepare(form)
+        started = time.perf_counter()
+        status, response_headers, _ = await target.request(method, path, body, headers)
+        samples.append((kind, time.perf_counter() - started, status))
+        visitor.remember(response_headers)
+
+
+def run_load(target, plan, concurrency=10, requests=1000, duration=None, seed=0):
+    '''прогон нагрузки: concurrency посетителей отправляют запросы, пока не исчерпан
+    бюджет – requests запросов и (или) duration секунд; возвращает отчет (словарь)'''
+    visitors = [Visitor(seed + number) for number in range(concurrency)]
+    if plan.has_posts: # CSRF-cookie получаем до замеров
+        for visitor in visitors:
+            warmup(target, plan, visitor)
+    samples = [] # (вид запроса, секунды, код ответа); list.append потокобезопасен
+    before = target.metrics()
+    budget = Budget(requests, duration)
+    started = time.perf_counter()
+    if isinstance(target, ASGITarget):
+        async def run():
+            await asyncio.gather(*[visit_async(target, plan, visitor, budget, samples) for visitor in visitors])
+        asyncio.run(run())
+    else:
+        threads = [threading.Thread(target=visit, args=(target, plan, visitor, budget, samples))
+                   for visitor in visitors]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    return build_report(target, plan, concurrency, samples, elapsed, before, target.metrics())
+
+
+def warmup(target, plan, visitor):
+    body, headers = visitor.prepare(None)
+    if isinstance(target, ASGITarget):
+        status, response_headers, _ = asyncio.run(target.request('GET', plan.warmup_path(), body, headers))
+    else:
+        status, response_headers, _ = target.request('GET', plan.warmup_path(), body, headers)
+    visitor.remember(response_headers)
+
+
+def summarize(latencies):
+    '''перцентили, среднее и максимум времени ответа (мс)'''
+    if not latencies:
+        return {}
+    result = {f'p{percent}': round(percentile(latencies, percent), 3) for percent in PERCENTILES}
+    result.update(mean=round(sum(latencies) / len(latencies), 3), max=round(max(latencies), 3))
+    return result
+
+
+def is_error(status):
+    '''ошибка клиента или сервера; 0 – ответ не получен'''
+    return status == 0 or status >= 400
+
+
+def build_report(target, plan, concurrency, samples, elapsed, before, after):
+    report = {'target': target.name, 'concurrency': concurrency, 'mix': plan.mix,
+              'requests': len(samples), 'seconds': round(elapsed, 3),
+              'throughput': round(len(samples) / elapsed, 1) if elapsed else 0,
+              'errors': sum(is_error(status) for _, _, status in samples),
+              'statuses': dict(sorted(Counter(status for _, _, status in samples).items())),
+              'latency': summarize([seconds * 1000 for _, seconds, _ in samples]), 'kinds': {}}
+    for kind in plan.kinds:
+        rows = [(seconds, status) for name, seconds, status in samples if name == kind]
+        report['kinds'][kind] = {'requests': len(rows), 'errors': sum(is_error(status) for _, status in rows),
+                                 **summarize([seconds * 1000 for seconds, _ in rows])}
+    if before is not None and after is not None:
+        # опрос /metrics сервера – тоже запрос, его в отчет не включаем
+        queries = {labels[0]: value - before['queries'].get(labels, 0)
+                   for labels, value in after['queries'].items() if labels[0] != 'blog_metrics'}
+        requests = {labels[0]: value - before['requests'].get(labels, 0)
+                    for labels, value in after['requests'].items() if labels[0] != 'blog_metrics'}
+        total = sum(queries.values())
+        report['db'] = {'queries': int(total), 'queries_per_second': round(total / elapsed, 1) if elapsed else 0,
+                        'queries_per_request': {view: round(queries.get(view, 0) / count, 2)
+                                                for view, count in sorted(requests.items()) if count}}
+        cache = {}
+        for (name, result), value in sorted(after['cache'].items()):
+            change = value - before['cache'].get((name, result), 0)
+            if change:
+                cache.setdefault(name, {})[result] = int(change)
+        report['cache'] = cache
+    return report
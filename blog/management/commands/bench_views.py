@@ -0,0 +1,56 @@
+'''Команда для замера производительности страниц блога:
+    python manage.py bench_views --sizes 100 1000 10000 --output after.json --compare before.json
+Замеры выполняются в отдельной тестовой базе (как при запуске тестов), рабочие данные не затрагиваются.'''
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from blog.benchmark import compare, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время ответа и количество запросов основных страниц на базах разного размера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000], help='количества статей')
+        parser.add_argument('--comments-per-post', type=int, default=5)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20, help='количество запросов к каждой странице')
+        parser.add_argument('--page-cache', action='store_true',
+                            help='замерять с кешем страниц для анонимных посетителей')
+        parser.add_argument('--output', help='файл для сохранения результатов в формате JSON')
+        parser.add_argument('--compare', help='файл с предыдущими результатами для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='допустимый рост медианы времени ответа (0.1 – 10%%)')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmark(options['sizes'], options['comments_per_post'], options['tags'],
+                                    options['repeat'], options['page_cache'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for run in results['runs']:
+            self.stdout.write(f"статей: {run['posts']}, комментариев: {run['comments']}, тегов: {run['tags']}")
+            for name, result in run['views'].items():
+                self.stdout.write(f"  {name:<18} p50 {result['p50']:8.2f} мс  p90 {result['p90']:8.2f} мс  "
+                                  f"p99 {result['p99']:8.2f} мс  запросов: {result['queries']}")
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2, ensure_ascii=False)
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+            regressions = 0
+            for posts, name, old, new, change, old_queries, new_queries, regressed in \
+                    compare(baseline, results, options['threshold']):
+                regressions += regressed
+                self.stdout.write(f"{'!' if regressed else ' '} {posts:>7} {name:<18} {old:8.2f} -> {new:8.2f} мс "
+                                  f"({change:+.0%}), запросов: {old_queries} -> {new_queries}")
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'Обнаружено регрессий: {regressions}')
@@ -0,0 +1,19 @@
+'''Команда для перестройки счетчиков архива: python manage.py build_archive
+Количество статей по дням поддерживается сигналами, но после массовых операций
+в обход ORM или смены TIME_ZONE (дни считаются по местному времени) его нужно пересчитать.'''
+from django.core.management.base import BaseCommand
+from blog.archive import rebuild_archive
+from blog.cache import bump_content_version
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает количество опубликованных статей по дням для страниц архива'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='количество статей, читаемых за раз')
+
+    def handle(self, *args, **options):
+        total = rebuild_archive(options['batch_size'])
+        bump_content_version()
+        self.stdout.write(self.style.SUCCESS(f'Дней с публикациями: {total}'))
@@ -0,0 +1,21 @@
+'''Команда для построения снимка поискового индекса: python manage.py build_search_index
+Снимок позволяет процессам с бэкендом InvertedIndexSearchBackend стартовать без
+полного чтения таблицы статей: загружается снимок и только статьи, измененные после него.'''
+from django.core.management.base import BaseCommand, CommandError
+from blog.search.memory import InvertedIndexSearchBackend
+
+
+class Command(BaseCommand):
+    help = 'Строит инвертированный индекс статей и сохраняет его снимок на диск'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='файл снимка (по умолчанию BLOG_SEARCH_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        backend = InvertedIndexSearchBackend()
+        path = options['path'] or backend.snapshot_path()
+        if not path:
+            raise CommandError('Укажите --path или настройку BLOG_SEARCH_INDEX_PATH')
+        index = backend.rebuild()
+        backend.save_snapshot(path)
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано статей: {len(index)}, снимок: {path}'))
@@ -0,0 +1,26 @@
+'''Команда для расчета похожих статей: python manage.py build_similar_posts
+Без аргументов пересчитывает таблицу SimilarPost целиком; с --posts – только указанные
+статьи и статьи, связанные с ними общими тегами; с --queued – статьи из очереди SimilarRefresh,
+которые не были пересчитаны сразу после изменения (запускается периодически, например по cron).'''
+from django.core.management.base import BaseCommand
+from blog.similar import rebuild_similar_posts, refresh_queued_posts, refresh_similar_posts
+
+
+class Command(BaseCommand):
+    help = 'Рассчитывает похожие статьи по количеству общих тегов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, nargs='+', metavar='ID',
+                            help='пересчитать только эти статьи и связанные с ними')
+        parser.add_argument('--queued', action='store_true', help='разобрать очередь отложенных пересчетов')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='количество статей в одной пачке умножения матриц')
+
+    def handle(self, *args, **options):
+        if options['queued']:
+            total = refresh_queued_posts(options['batch_size'])
+        elif options['posts']:
+            total = refresh_similar_posts(options['posts'], options['batch_size'])
+        else:
+            total = rebuild_similar_posts(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано статей: {total}'))
@@ -0,0 +1,19 @@
+'''Команда для перестройки индекса тегов: python manage.py build_tag_index
+Индекс PostTag и счетчики TagStat поддерживаются сигналами, но после массовых операций
+в обход ORM (bulk_create, QuerySet.update, правки в базе) их нужно перестроить.'''
+from django.core.management.base import BaseCommand
+from blog.cache import bump_content_version
+from blog.tagindex import rebuild_tag_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает индекс "тег → опубликованные статьи" и количество статей тегов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='количество статей, обрабатываемых за раз')
+
+    def handle(self, *args, **options):
+        total = rebuild_tag_index(options['batch_size'])
+        bump_content_version()
+        self.stdout.write(self.style.SUCCESS(f'Строк индекса: {total}'))
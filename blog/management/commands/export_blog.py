@@ -0,0 +1,51 @@
+'''Команда для выгрузки статей с тегами и комментариями:
+python manage.py export_blog --output backup.jsonl.gz --gzip [--since 2021-03-01T00:00]
+Формат описан в blog/export.py; выгрузка потоковая и не зависит от объема базы по памяти.'''
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from blog.export import CHUNK_SIZE, export_lines, gzip_stream, parse_since
+
+
+class Command(BaseCommand):
+    help = 'Выгружает статьи с тегами и комментариями в JSONL (с необязательным сжатием gzip)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help='файл для выгрузки ("-" – стандартный вывод)')
+        parser.add_argument('--since', help='выгрузить только статьи и комментарии, измененные после этого момента')
+        parser.add_argument('--gzip', action='store_true', help='сжимать выгрузку gzip')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='сколько статей читается из базы за раз')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = parse_since(options['since'])
+            except ValueError as error:
+                raise CommandError(error)
+        started = timezone.now() # следующая инкрементальная выгрузка начнется с этого момента
+        lines = export_lines(since, options['chunk_size'])
+        count = 0
+
+        def counted(lines):
+            nonlocal count
+            for line in lines:
+                count += 1
+                yield line
+
+        chunks = counted(lines)
+        if options['gzip']:
+            chunks = gzip_stream(chunks)
+        if options['output'] == '-':
+            self.write(sys.stdout.buffer, chunks)
+        else:
+            with open(options['output'], 'wb') as file:
+                self.write(file, chunks)
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено статей: {count}; для следующей выгрузки: --since {started.isoformat()}'))
+
+    def write(self, file, chunks):
+        for chunk in chunks:
+            file.write(chunk)
+        file.flush()
@@ -0,0 +1,31 @@
+'''Команда для массового импорта статей: python manage.py import_posts posts.jsonl articles/ --author admin
+Форматы входных файлов описаны в blog/importer.py.'''
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from blog.importer import import_posts, read_records
+
+
+class Command(BaseCommand):
+    help = 'Импортирует статьи из файлов Markdown (с заголовком front matter) и JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='файлы .md/.jsonl или каталоги с ними')
+        parser.add_argument('--author', required=True,
+                            help='имя пользователя – автора статей, для которых автор не указан')
+        parser.add_argument('--status', choices=['draft', 'published'], default='published',
+                            help='статус статей, для которых он не указан')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='количество статей, сохраняемых в одной транзакции')
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(username=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["author"]} не найден')
+
+        def report(number, error):
+            self.stderr.write(f'Запись {number} пропущена: {error}')
+
+        created, skipped = import_posts(read_records(options['paths']), author, options['batch_size'],
+                                        options['status'], on_error=report)
+        self.stdout.write(self.style.SUCCESS(f'Импортировано статей: {created}, пропущено: {skipped}'))
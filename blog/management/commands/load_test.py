@@ -0,0 +1,70 @@
+'''Команда нагрузочного тестирования (см. loadtest.py):
+    python manage.py load_test --target wsgi --concurrency 20 --requests 5000
+    python manage.py load_test --target asgi --mix list=40,detail=40,search=20 --duration 30
+    python manage.py load_test --target http://127.0.0.1:8000 --concurrency 50 --output run.json
+Запросы идут в настроенную базу, поэтому ее нужно заранее наполнить командой seed_blog;
+комментарии и письма (share) из прогона остаются в базе – для рабочей базы уберите их из --mix.'''
+import json
+from django.core.management.base import BaseCommand, CommandError
+from blog.loadtest import ASGITarget, HTTPTarget, LoadPlan, WSGITarget, parse_mix, run_load
+
+
+class Command(BaseCommand):
+    help = 'Нагружает блог одновременными запросами и выводит пропускную способность, ' \
+           'перцентили времени ответа и количество SQL-запросов в секунду'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', default='wsgi',
+                            help='wsgi, asgi (приложение в этом процессе) или адрес запущенного сервера')
+        parser.add_argument('--host', default='localhost', help='заголовок Host для wsgi и asgi')
+        parser.add_argument('--concurrency', type=int, default=10, help='количество одновременных посетителей')
+        parser.add_argument('--requests', type=int, default=1000, help='общее количество запросов')
+        parser.add_argument('--duration', type=float,
+                            help='длительность прогона в секундах (вместо количества запросов)')
+        parser.add_argument('--mix', help='пропорции запросов, например list=30,detail=30,tag=15,search=10,'
+                                          'comment=10,share=5 (это значение по умолчанию)')
+        parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора случайных чисел')
+        parser.add_argument('--output', help='файл для сохранения отчета в формате JSON')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должен быть не меньше 1')
+        target = options['target']
+        if target == 'wsgi':
+            target = WSGITarget(options['host'])
+        elif target == 'asgi':
+            target = ASGITarget(options['host'])
+        elif target.startswith(('http://', 'https://')):
+            target = HTTPTarget(target)
+        else:
+            raise CommandError(f'неизвестная цель: {target}')
+        try:
+            plan = LoadPlan(parse_mix(options['mix']) if options['mix'] else None)
+        except ValueError as error:
+            raise CommandError(error)
+        report = run_load(target, plan, options['concurrency'],
+                          None if options['duration'] else options['requests'], options['duration'], options['seed'])
+
+        latency = report['latency']
+        self.stdout.write(f"{report['target']}: посетителей {report['concurrency']}, запросов {report['requests']} "
+                          f"за {report['seconds']:.1f} с – {report['throughput']} запросов/с, "
+                          f"ошибок: {report['errors']}, коды ответов: {report['statuses']}")
+        if latency:
+            self.stdout.write(f"  {'все':<8} p50 {latency['p50']:8.2f} мс  p90 {latency['p90']:8.2f} мс  "
+                              f"p99 {latency['p99']:8.2f} мс  макс. {latency['max']:8.2f} мс")
+        for kind, result in report['kinds'].items():
+            if result['requests']:
+                self.stdout.write(f"  {kind:<8} p50 {result['p50']:8.2f} мс  p90 {result['p90']:8.2f} мс  "
+                                  f"p99 {result['p99']:8.2f} мс  запросов: {result['requests']}, "
+                                  f"ошибок: {result['errors']}")
+        if 'db' in report:
+            self.stdout.write(f"SQL-запросов: {report['db']['queries']} ({report['db']['queries_per_second']} в секунду)")
+            for view, queries in report['db']['queries_per_request'].items():
+                self.stdout.write(f'  {view:<28} {queries:6.2f} на запрос')
+            for name, results in report['cache'].items():
+                self.stdout.write(f'кеш {name}: ' + ', '.join(f'{result} {count}' for result, count in results.items()))
+        else:
+            self.stdout.write(self.style.WARNING('метрики сервера недоступны: количество SQL-запросов не посчитано'))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
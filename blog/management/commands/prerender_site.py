@@ -0,0 +1,28 @@
+'''Команда для сборки статической копии блога: python manage.py prerender_site <каталог>
+Повторный запуск перерендеривает только изменившиеся страницы (см. blog/prerender.py).'''
+import os
+import time
+from django.core.management.base import BaseCommand
+from blog.prerender import prerender
+
+
+class Command(BaseCommand):
+    help = 'Рендерит страницы блога, RSS-ленту и карту сайта в каталог для раздачи статическим сервером'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='каталог сборки')
+        parser.add_argument('--host', default='localhost', help='имя хоста для абсолютных ссылок')
+        parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='количество процессов')
+        parser.add_argument('--force', action='store_true', help='перерендерить все страницы')
+        parser.add_argument('--chunk-size', type=int, default=50,
+                            help='количество страниц в одном задании для процесса')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rendered, removed, total, failed = prerender(options['output'], options['host'], options['jobs'],
+                                                     options['force'], options['chunk_size'])
+        for url in failed:
+            self.stderr.write(f'Не удалось отрендерить {url}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Страниц: {total}, перерендерено: {rendered}, удалено: {removed} '
+            f'за {time.monotonic() - started:.1f} с'))
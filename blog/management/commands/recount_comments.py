@@ -0,0 +1,27 @@
+'''Команда для восстановления денормализованных счетчиков: python manage.py recount_comments
+Счетчики active_comment_count поддерживаются при каждом изменении комментариев,
+но после ручных правок в базе или массовых операций в обход ORM их можно пересчитать.'''
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from blog.models import Post
+from blog.cache import bump_content_version
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает количество активных комментариев у всех статей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='количество статей, обновляемых одним запросом')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+        total = 0
+        # обновляем диапазонами первичного ключа, чтобы не блокировать всю таблицу одной транзакцией
+        for start in range(0, last_id, batch_size):
+            with transaction.atomic():
+                total += Post.objects.filter(id__gt=start, id__lte=start + batch_size).recount_comments()
+        bump_content_version()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано статей: {total}'))
@@ -0,0 +1,44 @@
+'''Команда для массового перерендеринга статей: python manage.py render_posts
+Нужна после изменения BLOG_MARKDOWN_EXTENSIONS или версии пакета Markdown,
+так как сохраненные body_html и excerpt_html сформированы со старыми настройками.
+bulk_update не отправляет сигналы, поэтому после перерендеринга кеши блога сбрасываются явно.'''
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.cache import bump_content_version
+from blog.feeds import invalidate_all_feeds
+from blog.models import Post
+from blog.rendering import render_post
+from blog.sitemaps import invalidate_all_sections
+
+
+class Command(BaseCommand):
+    help = 'Перерендеривает Markdown всех статей в поля body_html и excerpt_html'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='количество статей, обновляемых одним запросом')
+
+    def handle(self, *args, **options):
+        total = rerender_posts(Post.objects.all(), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Перерендерено статей: {total}'))
+
+
+def rerender_posts(queryset, batch_size=500):
+    '''перерендеривает статьи пачками по первичному ключу: в памяти находится
+    не больше batch_size статей, каждая пачка сохраняется одним bulk_update'''
+    queryset = queryset.only('id', 'body').order_by('id')
+    last_id = 0
+    total = 0
+    while True:
+        batch = [render_post(post) for post in queryset.filter(id__gt=last_id)[:batch_size]]
+        if not batch:
+            break
+        with transaction.atomic():
+            queryset.model.objects.bulk_update(batch, ['body_html', 'excerpt_html'])
+        last_id = batch[-1].id
+        total += len(batch)
+    if total:
+        bump_content_version() # страницы из кеша страниц и фрагменты
+        invalidate_all_feeds() # ленты и карта сайта хранятся без срока жизни
+        invalidate_all_sections()
+    return total
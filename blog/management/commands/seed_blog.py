@@ -0,0 +1,18 @@
+'''Команда для наполнения базы синтетическими данными: python manage.py seed_blog --posts 10000
+Предназначена для разработки и нагрузочных замеров, а не для рабочей базы.'''
+from django.core.management.base import BaseCommand
+from blog.benchmark import seed_blog
+
+
+class Command(BaseCommand):
+    help = 'Добавляет статьи, теги и комментарии со случайным (воспроизводимым) содержимым'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--tags', type=int, default=50, help='общее количество тегов')
+        parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        created = seed_blog(options['posts'], options['comments'], options['tags'], seed=options['seed'])
+        self.stdout.write(self.style.SUCCESS(f'Добавлено статей: {created}, комментариев: {options["comments"]}'))
@@ -0,0 +1,25 @@
+'''Команда для отправки писем из очереди: python manage.py send_outbox
+Запускается периодически (cron) или постоянно с ключом --loop.'''
+import time
+from django.core.management.base import BaseCommand
+from blog.outbox import send_outbox
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма, накопленные в таблице OutboxMessage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='количество писем, выбираемых из базы за один раз')
+        parser.add_argument('--loop', action='store_true',
+                            help='не завершаться, а проверять очередь каждые --interval секунд')
+        parser.add_argument('--interval', type=float, default=5)
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_outbox(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Отправлено писем: {sent}, отложено: {failed}'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,229 @@
+'''Метрики производительности блога в формате Prometheus.
+MetricsMiddleware для каждого запроса записывает (с меткой – именем URL-шаблона):
+время ответа (гистограмма), количество и время SQL-запросов, время фильтра markdown
+и каждого шаблонного тега blog_tags. Попадания и промахи кеша считаются в cache.get_or_build,
+кеше страниц и карте сайта. Метрики отдаются обработчиком metrics_view (адрес /metrics),
+а при BLOG_SERVER_TIMING = True разбивка времени запроса добавляется в заголовок Server-Timing
+(видна в инструментах разработчика браузера).
+
+Метрики хранятся в памяти процесса, поэтому Prometheus должен опрашивать каждый процесс.
+Накладные расходы – несколько вызовов perf_counter() и одна блокировка на запрос:
+время SQL-запросов и фрагментов накапливается в объекте текущего запроса (contextvar,
+который переходит и в потоки sync_to_async), а в общий реестр записывается в конце запроса.'''
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # границы гистограммы (секунды)
+
+current_request = ContextVar('blog_metrics_request', default=None)
+
+
+class Counter:
+    def __init__(self, name, description, labels):
+        self.name, self.description, self.labels = name, description, labels
+        self.values = defaultdict(float)
+
+    def inc(self, labels, amount=1):
+        self.values[labels] += amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, self.labels, labels, value
+
+
+class Histogram:
+    def __init__(self, name, description, labels, buckets=DURATION_BUCKETS):
+        self.name, self.description, self.labels, self.buckets = name, description, labels, buckets
+        self.counts = {}  # метки -> количество наблюдений в каждом интервале (последний – больше всех границ)
+        self.sums = defaultdict(float)
+
+    def observe(self, labels, value):
+        if labels not in self.counts:
+            self.counts[labels] = [0] * (len(self.buckets) + 1)
+        self.counts[labels][bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def samples(self):
+        for labels, counts in sorted(self.counts.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                yield f'{self.name}_bucket', self.labels + ('le',), labels + (str(bound),), total
+            yield f'{self.name}_sum', self.labels, labels, self.sums[labels]
+            yield f'{self.name}_count', self.labels, labels, total
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_duration = Histogram('blog_request_duration_seconds', 'Время обработки запроса', ('view',))
+        self.db_queries = Counter('blog_db_queries_total', 'Количество SQL-запросов', ('view',))
+        self.db_seconds = Counter('blog_db_query_seconds_total', 'Время выполнения SQL-запросов', ('view',))
+        self.section_calls = Counter('blog_section_calls_total', 'Вызовы фильтров и шаблонных тегов',
+                                     ('view', 'section'))
+        self.section_seconds = Counter('blog_section_seconds_total', 'Время фильтров и шаблонных тегов',
+                                       ('view', 'section'))
+        self.cache_requests = Counter('blog_cache_requests_total', 'Обращения к кешу блога', ('cache', 'result'))
+        self.metrics = (self.request_duration, self.db_queries, self.db_seconds,
+                        self.section_calls, self.section_seconds, self.cache_requests)
+
+    def record_request(self, state, duration):
+        labels = (state.view,)
+        with self.lock:
+            self.request_duration.observe(labels, duration)
+            self.db_queries.inc(labels, state.queries)
+            self.db_seconds.inc(labels, state.db_time)
+            for section, (seconds, calls) in state.sections.items():
+                self.section_calls.inc((state.view, section), calls)
+                self.section_seconds.inc((state.view, section), seconds)
+
+    def record_cache(self, name, result):
+        with self.lock:
+            self.cache_requests.inc((name, result))
+
+    def export(self):
+        '''текстовый формат Prometheus (exposition format 0.0.4)'''
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+                lines.append(f'# HELP {metric.name} {metric.description}')
+                lines.append(f'# TYPE {metric.name} {kind}')
+                for name, label_names, label_values, value in metric.samples():
+                    labels = ','.join(f'{label}="{escape_label(value)}"'
+                                      for label, value in zip(label_names, label_values))
+                    lines.append(f'{name}{{{labels}}} {value:g}' if labels else f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    '''показатели текущего запроса; накапливаются без блокировок'''
+    __slots__ = ('view', 'queries', 'db_time', 'sections')
+
+    def __init__(self):
+        self.view = 'unresolved'
+        self.queries = 0
+        self.db_time = 0.0
+        self.sections = {} # название -> [секунды, вызовы]
+
+    def add_section(self, name, seconds):
+        entry = self.sections.get(name)
+        if entry is None:
+            self.sections[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+def query_timer(execute, sql, params, many, context):
+    '''обертка выполнения SQL (connection.execute_wrapper), подключается к каждому
+    соединению сигналом connection_created (см. signals.py)'''
+    state = current_request.get()
+    if state is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        state.queries += 1
+        state.db_time += time.perf_counter() - started
+
+
+def install_query_timer(connection):
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def timed(section):
+    '''декоратор для фильтров и шаблонных тегов: время вызова записывается в метрики запроса'''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            state = current_request.get()
+            if state is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                state.add_section(section, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def record_cache(name, result):
+    '''обращение к кешу: result – hit (свежее значение), stale (устаревшее) или miss'''
+    registry.record_cache(name, result)
+
+
+class MetricsMiddleware:
+    '''должен стоять первым в MIDDLEWARE, чтобы учитывать время остальных промежуточных слоев.
+    Под ASGI слой работает асинхронно, как и остальные слои блога: один синхронный слой
+    заставил бы Django выполнять всю цепочку в одном общем потоке, друг за другом'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine # так Django узнает асинхронный слой
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RequestMetrics()
+        token = current_request.set(state)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, state, started)
+
+    async def __acall__(self, request):
+        state = RequestMetrics()
+        token = current_request.set(state)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, state, started)
+
+    def finish(self, request, response, state, started):
+        duration = time.perf_counter() - started
+        if request.resolver_match is not None:
+            state.view = request.resolver_match.view_name
+        registry.record_request(state, duration)
+        if getattr(settings, 'BLOG_SERVER_TIMING', False):
+            response['Server-Timing'] = server_timing(state, duration)
+        return response
+
+
+def server_timing(state, duration):
+    entries = [f'db;dur={state.db_time * 1000:.1f};desc="{state.queries} queries"']
+    entries += [f'{name};dur={seconds * 1000:.1f}' for name, (seconds, calls) in state.sections.items()]
+    entries.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def metrics_view(request):
+    '''метрики для Prometheus; доступны только с адресов из BLOG_METRICS_ALLOWED_IPS (None – с любых)'''
+    allowed = getattr(settings, 'BLOG_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,120 @@
+'''Промежуточные слои (middleware) блога.'''
+import asyncio
+import hashlib
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.html import escape
+from django.utils.http import parse_http_date_safe, quote_etag
+from .cache import may_be_stale, versioned_key
+from .conditional import content_etag
+from .metrics import record_cache
+
+CSRF_INPUT_RE = re.compile(rb'(<input type="hidden" name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b'__blog_csrf_token__'
+CACHED_HEADERS = ('Content-Type', 'Content-Language', 'ETag', 'Last-Modified', 'X-Frame-Options')
+
+
+class AnonymousPageCacheMiddleware:
+    '''кеширует целые страницы блога для анонимных GET-запросов.
+    Ключ содержит версию контента, которая увеличивается при изменении статей,
+    комментариев и тегов, поэтому устаревшие страницы не отдаются (при кеше в памяти процесса
+    другие процессы узнают о новой версии не позже чем через BLOG_LOCAL_CACHE_TIMEOUT секунд).
+    При попадании в кеш не выполняются ни обработчик, ни шаблонные теги, ни запросы к базе.
+
+    В страницах с формами (комментарий на странице статьи) CSRF-токен перед сохранением
+    заменяется меткой, а при выдаче из кеша подставляется токен текущего посетителя.
+    Слой должен стоять после CsrfViewMiddleware и AuthenticationMiddleware.
+    Под ASGI работает асинхронно: обращения к кешу и сессии выполняются через sync_to_async,
+    а обработчик не переводится в общий поток синхронного кода'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        key, entry = self.lookup(request)
+        if key is None:
+            return self.get_response(request)
+        if entry is not None:
+            return self.from_cache(request, entry)
+        response = self.get_response(request)
+        self.store(request, key, response)
+        return response
+
+    async def __acall__(self, request):
+        key, entry = await sync_to_async(self.lookup)(request)
+        if key is None:
+            return await self.get_response(request)
+        if entry is not None:
+            return await sync_to_async(self.from_cache)(request, entry)
+        response = await self.get_response(request)
+        await sync_to_async(self.store)(request, key, response)
+        return response
+
+    def timeout(self):
+        return getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 600)
+
+    def lookup(self, request):
+        '''(ключ, страница из кеша или None); ключ None – запрос не кешируется'''
+        if not self.timeout() or not self.is_cacheable_request(request):
+            return None, None
+        key = versioned_key('page', hashlib.md5(
+            f'{request.get_host()}{request.get_full_path()}'.encode()).hexdigest())
+        entry = cache.get(key)
+        record_cache('page', 'miss' if entry is None else 'hit')
+        return key, entry
+
+    def store(self, request, key, response):
+        if request.method == 'GET' and self.is_cacheable_response(response) and not may_be_stale():
+            cache.set(key, self.to_cache(response), self.timeout())
+
+    def is_cacheable_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        if match.namespace != 'blog':
+            return False
+        request.resolver_match = match # при попадании в кеш обработчик не вызывается, а имя страницы нужно метрикам
+        # без cookie сессии пользователь заведомо анонимный, и сессию не нужно загружать из базы
+        if settings.SESSION_COOKIE_NAME in request.COOKIES and request.user.is_authenticated:
+            return False
+        return True
+
+    def is_cacheable_response(self, response):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return False
+        cache_control = response.get('Cache-Control', '')
+        return 'private' not in cache_control and 'no-store' not in cache_control
+
+    def to_cache(self, response):
+        content, csrf_tokens = CSRF_INPUT_RE.subn(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+        headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+        return content, headers, bool(csrf_tokens)
+
+    def from_cache(self, request, entry):
+        content, headers, has_csrf = entry
+        if has_csrf:
+            # get_token() отмечает, что токен использован, и CsrfViewMiddleware установит cookie
+            content = content.replace(CSRF_PLACEHOLDER, escape(get_token(request)).encode())
+        response = HttpResponse(content)
+        for name, value in headers.items():
+            response[name] = value
+        if 'ETag' in headers: # ETag зависит от CSRF-cookie посетителя (см. conditional.py), а страница – общая
+            response['ETag'] = quote_etag(content_etag(request))
+        return get_conditional_response(request, etag=response.get('ETag'),
+                                        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+                                        response=response)
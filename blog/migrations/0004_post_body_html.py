@@ -0,0 +1,49 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:03
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.text import Truncator
+import markdown
+
+# рендеринг зафиксирован на момент миграции: последующие изменения blog/rendering.py
+# не должны менять результат исторической миграции
+EXCERPT_WORDS = 30
+
+
+def render_existing_posts(apps, schema_editor):
+    '''заполняет body_html и excerpt_html у уже существующих статей;
+    статьи читаются пачками по первичному ключу, как в команде render_posts'''
+    Post = apps.get_model('blog', 'Post')
+    extensions = list(getattr(settings, 'BLOG_MARKDOWN_EXTENSIONS', []))
+    posts = Post.objects.only('id', 'body').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(posts.filter(id__gt=last_id)[:500])
+        if not batch:
+            break
+        for post in batch:
+            post.body_html = markdown.markdown(post.body, extensions=extensions)
+            post.excerpt_html = Truncator(post.body_html).words(EXCERPT_WORDS, html=True, truncate=' …')
+        Post.objects.bulk_update(batch, ['body_html', 'excerpt_html'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_post_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(render_existing_posts, migrations.RunPython.noop),
+    ]
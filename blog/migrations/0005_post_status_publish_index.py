@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_post_body_html'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-publish', '-id'], name='blog_post_status_publish_idx'),
+        ),
+    ]
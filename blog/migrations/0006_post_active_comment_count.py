@@ -0,0 +1,34 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_active_comments(apps, schema_editor):
+    '''заполняет счетчики у существующих статей'''
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    active_comments = Comment.objects.filter(post=OuterRef('pk'), active=True).order_by()\
+                                     .values('post').annotate(total=Count('id')).values('total')
+    Post.objects.update(active_comment_count=Coalesce(Subquery(active_comments), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_post_status_publish_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='active_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-active_comment_count', '-publish'], name='blog_post_most_commented_idx'),
+        ),
+        migrations.RunPython(count_active_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_active_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_entries', to='blog.post')),
+                ('similar_post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+            options={
+                'ordering': ('post', 'rank'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarpost',
+            constraint=models.UniqueConstraint(fields=('post', 'rank'), name='blog_similarpost_post_rank'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+class AddPostgresIndex(migrations.AddIndex):
+    '''индексы GIN есть только в PostgreSQL; на других СУБД (например, SQLite
+    на тестовых стендах) операция изменяет только состояние моделей'''
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+def fill_search_vectors(apps, schema_editor):
+    '''вычисляет поисковые векторы существующих статей'''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Post = apps.get_model('blog', 'Post')
+    Post.objects.using(schema_editor.connection.alias)\
+                .update(search_vector=SearchVector('title', weight='A') + SearchVector('body', weight='B'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_similarpost'),
+    ]
+
+    operations = [
+        TrigramExtension(), # расширение pg_trgm для триграммного индекса и оператора %
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        AddPostgresIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='blog_post_search_vector_idx'),
+        ),
+        AddPostgresIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='blog_post_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'active', 'created', 'id'], name='blog_comment_post_page_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_tag_index(apps, schema_editor):
+    '''заполняет индекс тегов и счетчики для уже существующих статей'''
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Post = apps.get_model('blog', 'Post')
+    PostTag = apps.get_model('blog', 'PostTag')
+    TagStat = apps.get_model('blog', 'TagStat')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:
+        return
+    publish = dict(Post.objects.filter(status='published').values_list('id', 'publish'))
+    rows = [PostTag(tag_id=tag_id, post_id=post_id, publish=publish[post_id]) for post_id, tag_id in
+            TaggedItem.objects.filter(content_type=content_type).values_list('object_id', 'tag_id').iterator()
+            if post_id in publish]
+    PostTag.objects.bulk_create(rows, batch_size=5000)
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id, post_count=total) for tag_id, total in
+                                 PostTag.objects.order_by().values('tag').annotate(total=models.Count('post'))
+                                                .values_list('tag', 'total')], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('blog', '0011_comment_page_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('publish', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagStat',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='blog_stat', serialize=False, to='taggit.tag')),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagstat',
+            index=models.Index(fields=['-post_count'], name='blog_tagstat_count_idx'),
+        ),
+        migrations.AddField(
+            model_name='posttag',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_index', to='blog.post'),
+        ),
+        migrations.AddField(
+            model_name='posttag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='taggit.tag'),
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['tag', '-publish', '-post'], name='blog_posttag_tag_publish_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='posttag',
+            constraint=models.UniqueConstraint(fields=('post', 'tag'), name='blog_posttag_post_tag'),
+        ),
+        migrations.RunPython(fill_tag_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.7 on 2026-10-18 05:45
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_archive(apps, schema_editor):
+    '''количество опубликованных статей по дням для уже существующих статей'''
+    Post = apps.get_model('blog', 'Post')
+    ArchiveDay = apps.get_model('blog', 'ArchiveDay')
+    counts = {}
+    for publish in Post.objects.filter(status='published').values_list('publish', flat=True).iterator():
+        day = timezone.localdate(publish)
+        counts[day] = counts.get(day, 0) + 1
+    ArchiveDay.objects.bulk_create([ArchiveDay(day=day, post_count=count) for day, count in counts.items()],
+                                   batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_tag_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveDay',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-day',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['slug', 'publish'], name='blog_post_slug_publish_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(status='published'), fields=['publish'], name='blog_post_published_idx'),
+        ),
+        migrations.RunPython(fill_archive, migrations.RunPython.noop),
+    ]
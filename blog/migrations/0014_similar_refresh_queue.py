@@ -0,0 +1,23 @@
+# Generated by Django 3.1.7 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarRefresh',
+            fields=[
+                ('post_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('queued', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('queued',),
+            },
+        ),
+    ]
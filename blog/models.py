@@ -1,13 +1,48 @@
 '''модели данных приложения. В любом Django-приложении
 должен быть этот файл, но он может оставаться пустым'''
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.urls import reverse
 from taggit.managers import TaggableManager
+from taggit.models import Tag
+from .rendering import render_post
+from .cache import bump_content_version
 
 
-class PublishedManager(models.Manager):
+def post_url(publish, slug):
+    '''канонический URL статьи по дате публикации и слагу; позволяет строить ссылки
+    без создания объектов Post (например, в карте сайта)'''
+    # функцию reverse() дает возможность получать URL, указав имя URL-шаблона и его параметры (определены в urls.py);
+    # дата берется в текущей временной зоне – в той же, в которой post_detail ищет статью по диапазону дня
+    publish = timezone.localtime(publish)
+    return reverse('blog:post_detail', args=[publish.year, publish.month, publish.day, slug])
+
+
+class PostQuerySet(models.QuerySet):
+    def recount_comments(self):
+        '''пересчитывает active_comment_count выбранных статей одним UPDATE с подзапросом'''
+        active_comments = Comment.objects.filter(post=OuterRef('pk'), active=True).order_by()\
+                                         .values('post').annotate(total=Count('id')).values('total')
+        return self.update(active_comment_count=Coalesce(Subquery(active_comments), 0))
+
+    def for_list(self):
+        '''статьи для списков: автор загружается в том же запросе (JOIN), теги – одним
+        дополнительным запросом на всю страницу, поэтому число запросов не зависит от числа статей'''
+        return self.select_related('author').prefetch_related('tags')
+
+    def for_detail(self):
+        '''статья для страницы просмотра; комментарии загружаются постранично
+        отдельным запросом (см. comment_page в views.py), чтобы размер страницы и время ответа
+        не зависели от количества комментариев'''
+        return self.for_list()
+
+
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     '''Собственный менеджер модели; альтернатива objects'''
     def get_queryset(self):
         '''Метод get_queryset() менеджера по умолчанию возвращает QuerySet, 
@@ -33,15 +68,22 @@ class Post(models.Model):
                                                                 # Параметр on_delete определяет поведение при удалении связанного объекта.
                                                                 # Используя CASCADE при удалении связанного пользователя из базы данных удаляются написанные им статьи.
     body = models.TextField() # содержание статьи
+    body_html = models.TextField(blank=True, editable=False)    # тело статьи, заранее преобразованное из Markdown в HTML при сохранении
+    excerpt_html = models.TextField(blank=True, editable=False) # анонс статьи для списка - первые 30 слов body_html
     publish = models.DateTimeField(default=timezone.now)    # дата публикации статьи;
                                                             # для установки значения по умолчанию используеся функция Django now (возвращает текущие дату и время),
                                                             # можно рассматривать ее как стандартную функцию datetime.now из Python, но с учетом временной зоны ?
     created = models.DateTimeField(auto_now_add=True)   # время сосздания статьи; используем параметр auto_now_add, поэтому дата будет сохраняться автоматически при создании объекта
-    updated = models.DateTimeField(auto_now=True)       # дата и время, указывающие на период, когда статья была отредактирована.
+    updated = models.DateTimeField(auto_now=True, db_index=True) # дата и время, указывающие на период, когда статья была отредактирована.
                                                         # Так как мы используем параметр auto_now, то дата будет сохраняться автоматически при сохранении объекта
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')   # статус статьи;
                                                                                         # параметр CHOICES используется, чтобы ограничить возможные значения из указанного списка
-    objects = models.Manager()      # Менеджер по умолчанию
+    search_vector = SearchVectorField(null=True, editable=False) # сохраненный поисковый вектор (title – вес A, body – вес B);
+                                                                 # обновляется при сохранении статьи (PostgreSQL), см. search.py
+    active_comment_count = models.PositiveIntegerField(default=0, editable=False) # денормализованное количество активных комментариев;
+                                                                                 # поддерживается атомарными UPDATE с F()-выражениями (см. Comment.save),
+                                                                                 # восстанавливается командой recount_comments
+    objects = PostQuerySet.as_manager() # Менеджер по умолчанию
     published = PublishedManager()  # Собственный менеджер
     tags = TaggableManager()        # менеджер тегов из класса TaggableManager; 
                                     # позволит добавлять, получать список и удалять теги для объектов статей
@@ -50,17 +92,67 @@ class Post(models.Model):
         ordering = ('-publish',)    # указали Django порядок сортировки статей (поле publish) по умолчанию – по убыванию даты публикации;
                                     # О том, что порядок убывающий, говорит префикс «-».
                                     # только что опубликованные статьи будут первыми в списке
+        indexes = [                 # индекс для курсорной навигации по опубликованным статьям в порядке (publish, id)
+            models.Index(fields=['status', '-publish', '-id'], name='blog_post_status_publish_idx'),
+            # индекс для выборки наиболее комментируемых статей без агрегации по таблице комментариев
+            models.Index(fields=['status', '-active_comment_count', '-publish'], name='blog_post_most_commented_idx'),
+            # статья по адресу /год/месяц/день/слаг/ находится одним поиском по индексу:
+            # slug = ... AND publish >= начало дня AND publish < начало следующего дня
+            models.Index(fields=['slug', 'publish'], name='blog_post_slug_publish_idx'),
+            # частичный индекс только по опубликованным статьям – для выборок архива по диапазону дат
+            models.Index(fields=['publish'], name='blog_post_published_idx', condition=models.Q(status='published')),
+            # индексы для поиска (только PostgreSQL): полнотекстовый по search_vector и триграммный по заголовку
+            GinIndex(fields=['search_vector'], name='blog_post_search_vector_idx'),
+            GinIndex(fields=['title'], name='blog_post_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
        # db_table - этот атрибут позволяет изменить название таблицы в БД
     def __str__(self):      # возвращаем строковое отображение объекта; использует его во многих случаях, например на сайте администрирования
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''запоминаем загруженные из базы значения, чтобы обработчики сигналов
+        могли узнать, изменились ли статус или дата публикации'''
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        '''перед сохранением рендерим Markdown, чтобы шаблоны выводили готовый HTML'''
+        render_post(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'body' in update_fields: # при частичном сохранении тела обновляем и HTML
+            kwargs['update_fields'] = set(update_fields) | {'body_html', 'excerpt_html'}
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         '''используется URL post_detail для построения канонического URL’а для объектов Post. 
         В Django есть соглашение о том, что метод модели get_absolute_url() должен возвращать 
         канонический URL объекта (имя этого метода применяется в HTML-шаблоне, чтобы получать ссылку на статью)'''
-        # функцию reverse() дает возможность получать URL, указав имя URL-шаблона и его параметры (определены в urls.py)
-        return reverse('blog:post_detail', 
-                        args=[self.publish.year, self.publish.month, self.publish.day, self.slug])
+        return post_url(self.publish, self.slug)
+
+    def get_similar_posts(self, count=4):
+        '''похожие статьи из заранее рассчитанной таблицы SimilarPost (см. similar.py);
+        один запрос по индексу (post, rank) вместо агрегации по тегам'''
+        entries = SimilarPost.objects.filter(post=self).order_by('rank').select_related('similar_post')\
+                                     .only('similar_post__id', 'similar_post__title',
+                                           'similar_post__slug', 'similar_post__publish')[:count]
+        return [entry.similar_post for entry in entries]
+
+
+class CommentQuerySet(models.QuerySet):
+    def set_active(self, active):
+        '''массово включает или скрывает комментарии, обновляя счетчики статей;
+        queryset.update() не вызывает save() и сигналы, поэтому счетчики меняем здесь же'''
+        with transaction.atomic():
+            changed = self.filter(active=not active)
+            deltas = changed.order_by().values('post').annotate(total=Count('id')) # сколько комментариев меняется у каждой статьи
+            for row in deltas:
+                change = row['total'] if active else -row['total']
+                Post.objects.filter(pk=row['post']).update(active_comment_count=F('active_comment_count') + change)
+            updated = changed.update(active=active)
+        bump_content_version()
+        return updated
 
 
 class Comment(models.Model):
@@ -79,11 +171,162 @@ class Comment(models.Model):
     email = models.EmailField()
     body = models.TextField()
     created = models.DateTimeField(auto_now_add=True) # поле created для сортировки комментариев в хронологическом порядке
-    updated = models.DateTimeField(auto_now=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True) # индекс для быстрого MAX(updated) в условных запросах
     active = models.BooleanField(default=True) # булевое поле active, для того чтобы была возможность скрыть некоторые комментарии (например, содержащие оскорбления)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ('created',)
+        indexes = [ # страница комментариев статьи выбирается по индексу без сортировки: WHERE post_id = ... AND active
+                    # AND (created, id) > (...) ORDER BY created, id (id различает комментарии с одинаковым временем)
+            models.Index(fields=['post', 'active', 'created', 'id'], name='blog_comment_post_page_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''запоминаем значения, загруженные из базы, чтобы при сохранении знать,
+        изменилась ли активность комментария или статья, к которой он относится'''
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        '''сохраняет комментарий и в той же транзакции поправляет счетчик активных комментариев статьи'''
+        loaded = getattr(self, '_loaded_values', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if loaded is None: # новый комментарий
+                self.change_counter(self.post_id, 1 if self.active else 0)
+            elif 'active' in loaded and 'post_id' in loaded:
+                self.change_counter(loaded['post_id'], -1 if loaded['active'] else 0)
+                self.change_counter(self.post_id, 1 if self.active else 0)
+            else: # поля были отложены (defer/only) – пересчитываем точно
+                Post.objects.filter(pk=self.post_id).recount_comments()
+        self._loaded_values = {'post_id': self.post_id, 'active': self.active}
+
+    def change_counter(self, post_id, change):
+        if not change:
+            return
+        Post.objects.filter(pk=post_id).update(active_comment_count=F('active_comment_count') + change)
+        if Comment.post.is_cached(self) and self.post.pk == post_id: # держим в актуальном состоянии и загруженную статью
+            self.post.active_comment_count += change
 
     def __str__(self):
         return f'Комментарий {self.name} на статью {self.post}'
+
+
+class SimilarPost(models.Model):
+    '''заранее рассчитанные похожие статьи: для каждой статьи хранятся лучшие
+    по количеству общих тегов статьи в порядке rank (0 – самая похожая).
+    Таблица заполняется командой build_similar_posts и обновляется при изменении тегов'''
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='similar_entries')
+    similar_post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField() # количество общих тегов
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ('post', 'rank')
+        constraints = [ # уникальный индекс (post, rank) используется и для выборки первых N похожих статей
+            models.UniqueConstraint(fields=['post', 'rank'], name='blog_similarpost_post_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.similar_post_id} похожа на {self.post_id} ({self.score})'
+
+
+class SimilarRefresh(models.Model):
+    '''очередь статей, похожие статьи которых нужно пересчитать вне запроса (см. similar.py);
+    разбирается командой build_similar_posts --queued. Хранится id, а не внешний ключ:
+    удаленная статья просто пропускается при разборе'''
+    post_id = models.PositiveIntegerField(primary_key=True)
+    queued = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('queued',)
+
+    def __str__(self):
+        return f'{self.post_id} ({self.queued})'
+
+
+class PostTag(models.Model):
+    '''денормализованный индекс "тег → опубликованные статьи". Список статей тега через taggit
+    требует JOIN с обобщенной таблицей TaggedItem (с фильтром по типу содержимого) и сортировки;
+    здесь строки опубликованных статей тега лежат в индексе (tag, publish, post) уже в нужном порядке.
+    Поддерживается сигналами при изменении тегов, статуса и даты публикации (см. tagindex.py)'''
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='tag_index')
+    publish = models.DateTimeField() # копия Post.publish: сортировка без обращения к таблице статей
+
+    class Meta:
+        constraints = [ # уникальный индекс используется и для удаления строк статьи
+            models.UniqueConstraint(fields=['post', 'tag'], name='blog_posttag_post_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', '-publish', '-post'], name='blog_posttag_tag_publish_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag_id}: {self.post_id}'
+
+
+class TagStat(models.Model):
+    '''материализованное количество опубликованных статей тега (для облака тегов и номеров страниц
+    без COUNT(*)); пересчитывается вместе с PostTag'''
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='blog_stat')
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-post_count'], name='blog_tagstat_count_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag_id}: {self.post_count}'
+
+
+class ArchiveDay(models.Model):
+    '''количество опубликованных статей за день (по местному времени TIME_ZONE) для страниц архива:
+    количество за месяц и год – сумма не более чем 366 строк вместо подсчета статей.
+    Поддерживается сигналами при изменении статуса и даты публикации (см. archive.py)'''
+    day = models.DateField(primary_key=True)
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('-day',)
+
+    def __str__(self):
+        return f'{self.day}: {self.post_count}'
+
+
+class OutboxQuerySet(models.QuerySet):
+    def due(self):
+        '''неотправленные письма, время очередной попытки которых наступило'''
+        return self.filter(sent_at__isnull=True, next_attempt__lte=timezone.now())
+
+
+class OutboxMessage(models.Model):
+    '''исходящее письмо. Обработчик только сохраняет письмо в таблицу (одна вставка вместо
+    соединения с SMTP-сервером), а команда send_outbox отправляет накопившиеся письма пачками
+    через одно соединение и повторяет неудачные попытки с увеличивающейся задержкой'''
+    subject = models.CharField(max_length=250)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField() # список адресов получателей
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0) # количество неудачных попыток
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboxQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created',)
+        indexes = [ # частичный индекс содержит только неотправленные письма, поэтому не растет вместе с таблицей
+            models.Index(fields=['next_attempt'], name='blog_outbox_pending_idx',
+                         condition=models.Q(sent_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} ({", ".join(self.recipients)})'
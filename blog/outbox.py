@@ -0,0 +1,66 @@
+'''Отправка писем из таблицы OutboxMessage.
+Письма выбираются пачками с блокировкой строк SELECT ... FOR UPDATE SKIP LOCKED
+(на PostgreSQL), поэтому несколько обработчиков могут работать одновременно,
+не отправляя одно письмо дважды. Все письма отправляются через одно соединение
+с SMTP-сервером; неудачная попытка откладывает письмо с экспоненциально
+растущей задержкой, после BLOG_OUTBOX_MAX_ATTEMPTS попыток письмо больше не отправляется.'''
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboxMessage
+
+
+def retry_delay(attempts):
+    '''задержка перед следующей попыткой: 1, 2, 4, 8... минут, но не больше часа'''
+    base = getattr(settings, 'BLOG_OUTBOX_RETRY_DELAY', 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 3600))
+
+
+def max_attempts():
+    return getattr(settings, 'BLOG_OUTBOX_MAX_ATTEMPTS', 8)
+
+
+def send_outbox(batch_size=100, connection=None):
+    '''отправляет все письма, время которых наступило; возвращает (отправлено, отложено)'''
+    connection = connection or get_connection()
+    sent = failed = 0
+    try: # соединение открывается в deliver() при первой отправке и закрывается один раз в конце
+        while True:
+            with transaction.atomic():
+                batch = list(OutboxMessage.objects.due().filter(attempts__lt=max_attempts())
+                                          .select_for_update(skip_locked=True)
+                                          .order_by('next_attempt', 'id')[:batch_size])
+                if not batch:
+                    break
+                for message in batch:
+                    if deliver(connection, message):
+                        sent += 1
+                    else:
+                        failed += 1
+                OutboxMessage.objects.bulk_update(batch, ['sent_at', 'attempts', 'next_attempt', 'last_error'])
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def deliver(connection, message):
+    '''отправляет одно письмо и отмечает результат в message. Соединение открывается заранее:
+    send_messages() сам открывает соединение, только если оно закрыто, и тогда же закрывает его
+    после отправки, то есть без open() каждое письмо отправлялось бы через новое соединение'''
+    email = EmailMessage(message.subject, message.body, message.from_email, message.recipients,
+                         connection=connection)
+    now = timezone.now()
+    try:
+        connection.open() # открывает соединение, если оно еще не открыто (или закрыто после ошибки)
+        connection.send_messages([email])
+    except Exception as error:
+        connection.close() # после ошибки соединение может быть в неопределенном состоянии; следующее письмо откроет новое
+        message.attempts += 1
+        message.next_attempt = now + retry_delay(message.attempts)
+        message.last_error = f'{type(error).__name__}: {error}'
+        return False
+    message.sent_at = now
+    message.last_error = ''
+    return True
@@ -0,0 +1,144 @@
+'''Постраничная навигация по ключу (keyset/cursor pagination).
+Стандартный Paginator выполняет COUNT(*) и запрос с OFFSET, который тем медленнее,
+чем дальше страница от начала. Здесь следующая страница выбирается условием
+"строки после последней показанной" по упорядоченному набору полей, например (publish, id),
+поэтому любая страница стоит столько же, сколько первая (при наличии индекса по этим полям).
+
+Курсор – непрозрачная подписанная строка с ключом граничной строки, направлением
+и номером страницы; подделанный или устаревший курсор просто открывает первую страницу.'''
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+SALT = 'blog.pagination'
+
+
+class KeysetPaginator:
+    keyset = True # признак для шаблона pagination.html: ссылки строятся по курсорам, а не по номерам
+
+    def __init__(self, object_list, per_page, ordering=('-publish', '-id')):
+        '''ordering – поля сортировки; последнее поле должно быть уникальным (обычно id),
+        префикс «-» означает сортировку по убыванию'''
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.model = object_list.model
+
+    def page(self, cursor=None):
+        '''возвращает страницу после (или перед) строкой, закодированной в курсоре'''
+        state = self.decode(cursor)
+        if state is None:
+            rows = list(self.object_list.order_by(*self.ordering)[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, 1,
+                              has_next=len(rows) > self.per_page, has_previous=False)
+
+        values, forward, number = state
+        if forward:
+            queryset = self.object_list.filter(self.after(values)).order_by(*self.ordering)
+        else:
+            queryset = self.object_list.filter(self.after(values, reverse=True))\
+                                       .order_by(*self.reversed_ordering())
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            return KeysetPage(rows, self, number, has_next=more, has_previous=True)
+        rows.reverse() # страница выбиралась в обратном порядке
+        return KeysetPage(rows, self, number, has_next=True, has_previous=more)
+
+    def after(self, values, reverse=False):
+        '''условие "строка идет после values" в порядке ordering (или перед ней при reverse=True):
+        (a, b, c) > (x, y, z)  <=>  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)'''
+        condition = Q()
+        for index, name in enumerate(self.ordering):
+            descending = name.startswith('-') != reverse
+            lookup = '%s__%s' % (self.fields[index], 'lt' if descending else 'gt')
+            equal = {self.fields[i]: values[i] for i in range(index)}
+            condition |= Q(**equal, **{lookup: values[index]})
+        return condition
+
+    def reversed_ordering(self):
+        return tuple(name[1:] if name.startswith('-') else '-' + name for name in self.ordering)
+
+    def key(self, obj):
+        return [getattr(obj, name) for name in self.fields]
+
+    def encode(self, obj, forward, number):
+        '''формирует курсор для строки obj; значения приводятся к строкам средствами полей модели'''
+        values = [self.model._meta.get_field(name).value_to_string(obj) for name in self.fields]
+        return signing.dumps([values, forward, number], salt=SALT, compress=True)
+
+    def decode(self, cursor):
+        '''разбирает курсор; возвращает (значения, направление, номер страницы) или None'''
+        if not cursor:
+            return None
+        try:
+            values, forward, number = signing.loads(cursor, salt=SALT)
+            values = [self.model._meta.get_field(name).to_python(value)
+                      for name, value in zip(self.fields, values)]
+        except (signing.BadSignature, ValueError, TypeError):
+            return None
+        if len(values) != len(self.fields):
+            return None
+        return values, bool(forward), max(int(number), 1)
+
+
+class KeysetPage:
+    '''страница результатов; повторяет интерфейс django.core.paginator.Page,
+    насколько это возможно без подсчета общего количества строк'''
+
+    def __init__(self, object_list, paginator, number, has_next, has_previous):
+        self.object_list = object_list
+        self.rows = object_list # строки, по которым строятся курсоры; object_list можно заменить,
+                                # например статьями, загруженными по строкам индекса
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __repr__(self):
+        return '<Keyset page %s>' % self.number
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def start_index(self):
+        '''порядковый номер первой строки страницы (страницы, кроме последней, заполнены целиком)'''
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.encode(self.rows[-1], True, self.number + 1)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.encode(self.rows[0], False, self.number - 1)
+
+
+class CountedPaginator(Paginator):
+    '''Paginator с заранее известным количеством строк (например, материализованным счетчиком):
+    номера страниц строятся без запроса COUNT(*)'''
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count # заменяет cached_property Paginator.count
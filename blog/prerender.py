@@ -0,0 +1,169 @@
+'''Статическая копия блога для раздачи через nginx или CDN.
+Страницы статей, списков, тегов, RSS-лента и карта сайта рендерятся обычными
+обработчиками (через тестовый клиент Django) и записываются в каталог:
+
+    blog/index.html, blog/page/2/index.html        список статей (/blog/, /blog/?page=2)
+    blog/tag/<тег>/index.html, .../page/2/...      статьи с тегом
+    blog/<год>/<месяц>/<день>/<слаг>/index.html    статья
+    blog/feed/index.xml, blog/feed/atom/index.xml  ленты RSS и Atom
+    blog/tag/<тег>/feed/index.xml, .../atom/...    ленты статей с тегом
+    sitemap.xml, sitemap-posts-<раздел>.xml        карта сайта
+
+Номер страницы списка передается параметром ?page=N, поэтому nginx нужно правило вида
+    if ($arg_page) { rewrite ^(.*)/$ $1/page/$arg_page/ last; }
+Формы (комментарии, «поделиться») и подгрузка комментариев по-прежнему обрабатываются приложением.
+CSRF-токен сборки в файлы не записывается (значение поля csrfmiddlewaretoken пустое): скрипт страницы
+запрашивает токен посетителя по адресу /blog/csrf/, поэтому nginx должен передавать его приложению.
+
+Сборка инкрементальная: для каждой страницы вычисляется отпечаток данных, от которых она
+зависит (Post.updated, теги, активные комментарии, похожие статьи, боковая панель),
+и перерендериваются только страницы, отпечаток которых изменился с прошлой сборки
+(манифест хранится в файле .manifest.json в каталоге сборки). Все отпечатки считаются
+несколькими запросами ко всей базе, а рендеринг распределяется по пулу процессов.'''
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.db.models import Count, Max
+from django.test import Client, override_settings
+from django.urls import reverse
+from taggit.models import TaggedItem
+from .feeds import FEED_ITEMS
+from .middleware import CSRF_INPUT_RE
+from .models import Post, Comment, SimilarPost, post_url
+from .sitemaps import section_size
+from .templatetags.blog_tags import SIDEBAR_COUNT
+from .views import POSTS_PER_PAGE
+
+MANIFEST = '.manifest.json'
+
+
+def fingerprint(*parts):
+    return hashlib.md5(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def site_pages():
+    '''все страницы сайта: {url: (путь файла в каталоге сборки, отпечаток)}'''
+    rows = list(Post.published.order_by('-publish', '-id').values_list('id', 'slug', 'publish', 'updated'))
+    updated = {post_id: changed for post_id, _, _, changed in rows}
+
+    tags = defaultdict(list) # id статьи -> [(слаг, название)]
+    tagged = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post))\
+                               .order_by('tag__name').values_list('object_id', 'tag__slug', 'tag__name')
+    for post_id, slug, name in tagged.iterator():
+        tags[post_id].append((slug, name))
+    comments = {row['post']: (row['total'], row['last'])
+                for row in Comment.objects.filter(active=True).order_by().values('post')
+                                          .annotate(total=Count('id'), last=Max('updated'))}
+    similar = defaultdict(list)
+    for post_id, similar_id in SimilarPost.objects.order_by('post', 'rank').values_list('post_id', 'similar_post_id'):
+        similar[post_id].append(similar_id)
+
+    most_commented = Post.published.order_by('-active_comment_count', '-publish')\
+                                   .values_list('id', 'updated')[:SIDEBAR_COUNT]
+    sidebar = fingerprint(len(rows), [(row[0], row[3]) for row in rows[:SIDEBAR_COUNT]], list(most_commented))
+
+    pages = {}
+    for post_id, slug, publish, changed in rows:
+        url = post_url(publish, slug)
+        neighbours = [(similar_id, updated.get(similar_id)) for similar_id in similar[post_id][:4]]
+        pages[url] = (url.lstrip('/') + 'index.html',
+                      fingerprint(changed, tags[post_id], comments.get(post_id), neighbours, sidebar))
+
+    def list_pages(url, post_ids, *extra):
+        '''страницы списка статей; пустой список – одна страница'''
+        chunks = [post_ids[start:start + POSTS_PER_PAGE] for start in range(0, len(post_ids), POSTS_PER_PAGE)] or [[]]
+        for number, chunk in enumerate(chunks, 1):
+            path = url.lstrip('/') + ('index.html' if number == 1 else f'page/{number}/index.html')
+            content = [(post_id, updated[post_id], tags[post_id]) for post_id in chunk]
+            pages[url if number == 1 else f'{url}?page={number}'] = \
+                (path, fingerprint(content, len(chunks), sidebar, *extra))
+
+    def feed_pages(url, post_ids, *extra):
+        '''лента в форматах RSS (url) и Atom (url + atom/)'''
+        content = [(post_id, updated[post_id]) for post_id in post_ids[:FEED_ITEMS]]
+        for feed_url in (url, url + 'atom/'):
+            pages[feed_url] = (feed_url.lstrip('/') + 'index.xml', fingerprint(content, *extra))
+
+    post_ids = [row[0] for row in rows]
+    list_pages(reverse('blog:post_list'), post_ids)
+    feed_pages(reverse('blog:post_feed'), post_ids)
+    tag_posts = defaultdict(list)
+    for post_id in post_ids:
+        for tag in tags[post_id]:
+            tag_posts[tag].append(post_id)
+    for (slug, name), ids in tag_posts.items():
+        list_pages(reverse('blog:post_list_by_tag', args=[slug]), ids, name)
+        feed_pages(reverse('blog:post_feed_by_tag', args=[slug]), ids, name)
+
+    sections = defaultdict(list)
+    for post_id, slug, publish, changed in rows:
+        sections[post_id // section_size()].append((post_id, changed))
+    for section, content in sections.items():
+        pages[reverse('blog_sitemap_section', args=[section])] = (f'sitemap-posts-{section}.xml',
+                                                                  fingerprint(sorted(content)))
+    pages[reverse('blog_sitemap_index')] = ('sitemap.xml', fingerprint(sorted(
+        (section, max(changed for _, changed in content)) for section, content in sections.items())))
+    return pages
+
+
+def prerender(output, host='localhost', jobs=None, force=False, chunk_size=50):
+    '''рендерит измененные страницы в каталог output и удаляет файлы исчезнувших страниц;
+    возвращает (перерендерено, удалено, всего страниц, адреса страниц с ошибками)'''
+    manifest_path = os.path.join(output, MANIFEST)
+    manifest = {}
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    pages = site_pages()
+    stale = [(url, path) for url, (path, digest) in pages.items()
+             if manifest.get(path) != digest or not os.path.exists(os.path.join(output, path))]
+    paths = {path for path, _ in pages.values()}
+    removed = [path for path in manifest if path not in paths]
+    for path in removed:
+        try:
+            os.remove(os.path.join(output, path))
+        except FileNotFoundError:
+            pass
+
+    chunks = [stale[start:start + chunk_size] for start in range(0, len(stale), chunk_size)]
+    if jobs == 1 or len(chunks) <= 1:
+        results = [render_pages(host, output, chunk) for chunk in chunks]
+    else:
+        connections.close_all() # дочерние процессы не должны унаследовать открытые соединения с базой
+        with ProcessPoolExecutor(jobs, initializer=django.setup) as pool:
+            results = list(pool.map(render_pages, [host] * len(chunks), [output] * len(chunks), chunks))
+
+    failed = [url for result in results for url in result]
+    failed_paths = {pages[url][0] for url in failed}
+    manifest = {path: digest for path, digest in pages.values() if path not in failed_paths}
+    os.makedirs(output, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return len(stale) - len(failed), len(removed), len(pages), failed
+
+
+def render_pages(host, output, pages):
+    '''рендерит страницы [(url, путь)] и записывает их; выполняется в процессе пула.
+    Возвращает адреса страниц, которые не удалось отрендерить'''
+    client = Client(HTTP_HOST=host)
+    failed = []
+    # ссылки на страницы списков – по номеру (?page=N), кеш страниц для сборки не нужен
+    with override_settings(ALLOWED_HOSTS=[host], BLOG_PAGINATION='offset', BLOG_PAGE_CACHE_TIMEOUT=0):
+        for url, path in pages:
+            response = client.get(url)
+            if response.status_code != 200:
+                failed.append(url)
+                continue
+            path = os.path.join(output, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(CSRF_INPUT_RE.sub(rb'\1\2', response.content)) # токен сборки посетителям не подходит
+            os.replace(path + '.tmp', path) # nginx никогда не увидит недописанный файл
+    return failed
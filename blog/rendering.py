@@ -0,0 +1,42 @@
+'''Предварительный рендеринг Markdown.
+Вместо того чтобы прогонять фильтр markdown по всему телу статьи на каждом запросе,
+HTML статьи и ее анонс формируются один раз при сохранении и хранятся в полях модели Post.'''
+import threading
+from django.conf import settings
+from django.utils.text import Truncator
+import markdown
+
+EXCERPT_WORDS = 30 # количество слов в анонсе; совпадает с прежним truncatewords_html:30 в list.html
+
+_local = threading.local() # объект Markdown не потокобезопасен, поэтому у каждого потока свой
+
+
+def markdown_extensions():
+    '''список расширений Markdown из настройки BLOG_MARKDOWN_EXTENSIONS;
+    при ее изменении необходимо перерендерить статьи командой render_posts'''
+    return list(getattr(settings, 'BLOG_MARKDOWN_EXTENSIONS', []))
+
+
+def render_markdown(text):
+    '''преобразует Markdown в HTML с текущим набором расширений;
+    построение парсера дороже самого преобразования, поэтому объект Markdown
+    переиспользуется (reset() очищает состояние предыдущего документа)'''
+    extensions = markdown_extensions()
+    converter = getattr(_local, 'converter', None)
+    if converter is None or _local.extensions != extensions:
+        converter = _local.converter = markdown.Markdown(extensions=extensions)
+        _local.extensions = extensions
+    return converter.reset().convert(text)
+
+
+def render_excerpt(html):
+    '''обрезает готовый HTML до EXCERPT_WORDS слов, закрывая незакрытые теги
+    (то же самое делает шаблонный фильтр truncatewords_html)'''
+    return Truncator(html).words(EXCERPT_WORDS, html=True, truncate=' …')
+
+
+def render_post(post):
+    '''заполняет поля body_html и excerpt_html статьи; статья не сохраняется'''
+    post.body_html = render_markdown(post.body)
+    post.excerpt_html = render_excerpt(post.body_html)
+    return post
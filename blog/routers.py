@@ -0,0 +1,122 @@
+'''Маршрутизация запросов к базе данных: чтение данных блога – с реплик, запись – в основную базу.
+Реплики – псевдонимы из DATABASES, перечисленные в BLOG_READ_REPLICAS (пустой список –
+все запросы идут в основную базу, как без маршрутизатора).
+
+Реплика отстает от основной базы, поэтому посетитель, который только что что-то записал
+(комментарий, правка в админке, отправка письма), какое-то время читает из основной базы
+и сразу видит свои изменения (read-your-writes):
+  - в запросе, где была запись, все последующие чтения идут в основную базу;
+  - ReplicaPinMiddleware ставит такому посетителю cookie на BLOG_REPLICA_PIN_SECONDS секунд,
+    и пока она есть, все его запросы читают из основной базы.
+Вне HTTP-запросов (команды, оболочка, фоновые задачи) используется только основная база:
+команды, например импорт, часто читают только что записанные данные.'''
+import asyncio
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICATED_APPS = ('blog', 'taggit') # сессии и пользователи читаются из основной базы
+PIN_COOKIE = 'blog_primary'
+
+current_state = ContextVar('blog_db_routing', default=None)
+
+
+def read_replicas():
+    return getattr(settings, 'BLOG_READ_REPLICAS', [])
+
+
+def pin_seconds():
+    return getattr(settings, 'BLOG_REPLICA_PIN_SECONDS', 10)
+
+
+def reading_from_replica():
+    '''текущий запрос читал данные блога с реплики'''
+    state = current_state.get()
+    return state is not None and state.replica is not None
+
+
+class RoutingState:
+    '''состояние маршрутизации текущего запроса; переходит в потоки sync_to_async вместе с контекстом'''
+    __slots__ = ('replica', 'pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.replica = None   # реплика выбирается один раз на запрос, чтобы чтения были согласованы
+        self.pinned = pinned  # читать из основной базы
+        self.wrote = False    # в запросе были записаны данные блога
+
+
+class ReplicaRouter:
+    '''маршрутизирует только модели REPLICATED_APPS; для остальных решение
+    остается за Django (None – база связанного объекта или основная)'''
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in REPLICATED_APPS:
+            return None
+        state = current_state.get()
+        replicas = read_replicas()
+        if state is None or state.pinned or not replicas:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db # связанные объекты читаем из той же базы, что и сам объект
+        if state.replica is None:
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in REPLICATED_APPS:
+            return None
+        state = current_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS # даже для объектов, прочитанных с реплики
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *read_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True # реплики содержат те же данные, что и основная база
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in read_replicas():
+            return False # схема реплик обновляется репликацией
+        return None
+
+
+class ReplicaPinMiddleware:
+    '''включает маршрутизацию на реплики для запроса и закрепляет за основной базой
+    посетителей, которые недавно записали данные. Должен стоять перед слоями,
+    которые обращаются к данным блога (кеш страниц, обработчики). Под ASGI работает асинхронно'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = current_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_state.reset(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES) # переходит в потоки sync_to_async вместе с контекстом
+        token = current_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_state.reset(token)
+        return self.pin(state, response)
+
+    def pin(self, state, response):
+        if state.wrote and read_replicas():
+            response.set_cookie(PIN_COOKIE, '1', max_age=pin_seconds(), httponly=True, samesite='Lax')
+        return response
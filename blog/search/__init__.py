@@ -0,0 +1,28 @@
+'''Поиск по статьям блога.
+Бэкенд выбирается настройкой BLOG_SEARCH_BACKEND:
+   blog.search.postgres.PostgresSearchBackend – полнотекстовый поиск PostgreSQL;
+   blog.search.memory.InvertedIndexSearchBackend – инвертированный индекс в памяти процесса
+   с ранжированием BM25 (для развертываний без PostgreSQL и нагрузочных тестов).'''
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'blog.search.postgres.PostgresSearchBackend'
+
+_backends = {}
+_lock = threading.Lock()
+
+
+def get_search_backend():
+    '''возвращает объект бэкенда; он создается один раз на процесс'''
+    path = getattr(settings, 'BLOG_SEARCH_BACKEND', DEFAULT_BACKEND)
+    with _lock:
+        if path not in _backends:
+            _backends[path] = import_string(path)()
+        return _backends[path]
+
+
+def reset_search_backends():
+    '''забывает созданные бэкенды (индексы в памяти будут построены заново при следующем поиске)'''
+    with _lock:
+        _backends.clear()
@@ -0,0 +1,16 @@
+class BaseSearchBackend:
+    '''интерфейс поискового бэкенда'''
+
+    def search(self, query):
+        '''опубликованные статьи, найденные по запросу, в порядке релевантности;
+        результат поддерживает len()/count() и срезы, поэтому его можно передать в Paginator'''
+        raise NotImplementedError
+
+    def update_post(self, post):
+        '''статья создана или изменена (в том числе ее теги)'''
+
+    def remove_post(self, post_id):
+        '''статья удалена'''
+
+    def rebuild(self):
+        '''перестраивает индекс по всем статьям (после массовой загрузки в обход сигналов)'''
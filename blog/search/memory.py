@@ -0,0 +1,265 @@
+'''Инвертированный индекс в памяти процесса с ранжированием BM25.
+Не требует PostgreSQL: индекс строится из таблицы статей при первом поиске
+(или загружается из снимка на диске), а затем обновляется по сигналам сохранения
+и удаления статей. Поиск по индексу выполняется без обращений к базе данных,
+из базы загружаются только статьи текущей страницы результатов.
+
+Каждый процесс хранит свой индекс, поэтому изменения, сделанные другими процессами,
+подхватываются периодической синхронизацией по полю Post.updated
+(не чаще одного раза в BLOG_SEARCH_SYNC_INTERVAL секунд); изменение тегов статьи тоже
+обновляет updated (см. signals.py). Удаленные статьи не оставляют строк, поэтому
+синхронизация сравнивает количество опубликованных статей с размером индекса
+и загружает их id только при расхождении.'''
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from taggit.models import TaggedItem
+from ..models import Post
+from .base import BaseSearchBackend
+
+TOKEN_RE = re.compile(r'\w+')
+FIELD_WEIGHTS = {'title': 3, 'tags': 2, 'body': 1} # слово в заголовке весит как три слова в тексте
+MIN_PREFIX = 3 # минимальная длина слова для поиска по началу слова
+SNAPSHOT_VERSION = 1
+
+
+def tokenize(text):
+    '''разбивает текст на слова в нижнем регистре; «ё» приравнивается к «е»'''
+    return [token.replace('ё', 'е') for token in TOKEN_RE.findall(text.lower())]
+
+
+class InvertedIndex:
+    '''словарь "слово -> {id статьи: взвешенная частота}" и длины документов для BM25'''
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = {}  # слово -> {id статьи: частота слова с учетом весов полей}
+        self.lengths = {}   # id статьи -> длина документа с учетом весов полей
+        self.terms = {}     # id статьи -> слова статьи (для удаления из индекса)
+        self.publish = {}   # id статьи -> время публикации (при равной релевантности новые статьи выше)
+        self.total_length = 0
+        self.vocabulary = None # отсортированный список слов для поиска по началу слова
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, post_id, fields, publish):
+        '''добавляет или заменяет статью; fields – словарь {поле: текст}'''
+        counts = Counter()
+        for name, text in fields.items():
+            weight = FIELD_WEIGHTS[name]
+            for token in tokenize(text):
+                counts[token] += weight
+        with self.lock:
+            self.remove(post_id)
+            for term, frequency in counts.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    self.vocabulary = None
+                self.postings[term][post_id] = frequency
+            length = sum(counts.values())
+            self.lengths[post_id] = length
+            self.terms[post_id] = tuple(counts)
+            self.publish[post_id] = publish
+            self.total_length += length
+
+    def remove(self, post_id):
+        with self.lock:
+            terms = self.terms.pop(post_id, None)
+            if terms is None:
+                return
+            for term in terms:
+                postings = self.postings[term]
+                del postings[post_id]
+                if not postings:
+                    del self.postings[term]
+                    self.vocabulary = None
+            self.total_length -= self.lengths.pop(post_id)
+            del self.publish[post_id]
+
+    def search(self, query):
+        '''id статей по убыванию релевантности; если ни одно слово не найдено целиком,
+        слова запроса ищутся как начала слов индекса'''
+        terms = set(tokenize(query))
+        with self.lock:
+            scores = self.score(terms)
+            if not scores:
+                scores = self.score(self.expand(terms))
+            return sorted(scores, key=lambda post_id: (-scores[post_id], -self.publish[post_id], -post_id))
+
+    def score(self, terms):
+        '''сумма оценок BM25 по словам запроса'''
+        scores = defaultdict(float)
+        count = len(self.lengths)
+        if not count:
+            return scores
+        average_length = self.total_length / count or 1
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for post_id, frequency in postings.items():
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[post_id] / average_length)
+                scores[post_id] += idf * frequency * (self.K1 + 1) / (frequency + norm)
+        return scores
+
+    def expand(self, terms):
+        '''слова индекса, начинающиеся с одного из слов запроса'''
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+        expanded = set()
+        for prefix in terms:
+            if len(prefix) < MIN_PREFIX:
+                continue
+            position = bisect_left(self.vocabulary, prefix)
+            while position < len(self.vocabulary) and self.vocabulary[position].startswith(prefix):
+                expanded.add(self.vocabulary[position])
+                position += 1
+        return expanded
+
+    def state(self):
+        with self.lock:
+            return {'postings': self.postings, 'lengths': self.lengths, 'terms': self.terms,
+                    'publish': self.publish, 'total_length': self.total_length}
+
+    @classmethod
+    def from_state(cls, state):
+        index = cls()
+        for name, value in state.items():
+            setattr(index, name, value)
+        return index
+
+
+class RankedPosts:
+    '''результаты поиска для Paginator: статьи загружаются из базы только для запрошенного среза'''
+
+    def __init__(self, post_ids):
+        self.post_ids = post_ids
+
+    def __len__(self):
+        return len(self.post_ids)
+
+    def count(self):
+        return len(self.post_ids)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        post_ids = self.post_ids[index]
+        posts = Post.published.in_bulk(post_ids)
+        return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+class InvertedIndexSearchBackend(BaseSearchBackend):
+    def __init__(self):
+        self.index = None
+        self.synced_at = None  # наибольшее значение Post.updated, учтенное в индексе
+        self.checked_at = 0    # когда (по time.monotonic) последний раз проверялись изменения в базе
+        self.lock = threading.Lock()
+
+    def search(self, query):
+        return RankedPosts(self.get_index().search(query))
+
+    def update_post(self, post):
+        if self.index is None:
+            return # индекс еще не построен – он будет построен из базы при первом поиске
+        if post.status == 'published':
+            self.index.add(post.pk, {'title': post.title, 'body': post.body,
+                                     'tags': ' '.join(post.tags.names())}, post.publish.timestamp())
+        else:
+            self.index.remove(post.pk)
+
+    def remove_post(self, post_id):
+        if self.index is not None:
+            self.index.remove(post_id)
+
+    def get_index(self):
+        '''индекс, синхронизированный с базой; при первом обращении загружается из снимка
+        (с дозагрузкой изменений) или строится заново'''
+        with self.lock:
+            if self.index is None:
+                if not self.load_snapshot():
+                    self.rebuild()
+            elif time.monotonic() - self.checked_at > getattr(settings, 'BLOG_SEARCH_SYNC_INTERVAL', 30):
+                self.sync()
+            return self.index
+
+    def rebuild(self):
+        '''строит индекс по всем опубликованным статьям'''
+        index = InvertedIndex()
+        self.synced_at = None
+        for fields in self.published_posts(Post.published.all()):
+            index.add(*fields)
+        self.index = index
+        self.checked_at = time.monotonic()
+        return index
+
+    def sync(self):
+        '''дозагружает статьи, измененные после synced_at, и удаляет из индекса удаленные статьи'''
+        changed = Post.objects.all()
+        if self.synced_at is not None:
+            changed = changed.filter(updated__gte=self.synced_at)
+        unpublished = set(changed.exclude(status='published').values_list('id', flat=True))
+        for fields in self.published_posts(changed.filter(status='published')):
+            self.index.add(*fields)
+        for post_id in unpublished:
+            self.index.remove(post_id)
+        if len(self.index) != Post.published.count(): # в индексе остались статьи, удаленные другим процессом
+            existing = set(Post.published.values_list('id', flat=True))
+            for post_id in set(self.index.lengths) - existing:
+                self.index.remove(post_id)
+        self.checked_at = time.monotonic()
+
+    def published_posts(self, queryset):
+        '''аргументы для InvertedIndex.add(); теги статей загружаются одним запросом
+        (при синхронизации – только теги измененных статей)'''
+        tags = defaultdict(list)
+        tagged = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post))
+        if self.synced_at is not None:
+            tagged = tagged.filter(object_id__in=queryset.values('id'))
+        for post_id, name in tagged.values_list('object_id', 'tag__name').iterator():
+            tags[post_id].append(name)
+        rows = queryset.values_list('id', 'title', 'body', 'publish', 'updated')
+        for post_id, title, body, publish, updated in rows.iterator():
+            if self.synced_at is None or updated > self.synced_at:
+                self.synced_at = updated
+            yield post_id, {'title': title, 'body': body, 'tags': ' '.join(tags[post_id])}, publish.timestamp()
+
+    def snapshot_path(self):
+        return getattr(settings, 'BLOG_SEARCH_INDEX_PATH', None)
+
+    def save_snapshot(self, path=None):
+        '''сохраняет индекс на диск (через временный файл, чтобы не оставить поврежденный снимок)'''
+        path = path or self.snapshot_path()
+        index = self.get_index()
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as snapshot:
+            pickle.dump({'version': SNAPSHOT_VERSION, 'synced_at': self.synced_at, 'index': index.state()},
+                        snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        return path
+
+    def load_snapshot(self):
+        '''быстрый "теплый" старт: загрузка снимка и дозагрузка изменений после него;
+        снимок создается командой build_search_index и считается доверенным файлом'''
+        path = self.snapshot_path()
+        if not path or not os.path.exists(path):
+            return False
+        with open(path, 'rb') as snapshot:
+            data = pickle.load(snapshot)
+        if data.get('version') != SNAPSHOT_VERSION:
+            return False
+        self.index = InvertedIndex.from_state(data['index'])
+        self.synced_at = data['synced_at']
+        self.sync()
+        return True
@@ -0,0 +1,39 @@
+'''Полнотекстовый поиск средствами PostgreSQL.
+Поисковый вектор хранится в поле Post.search_vector и обновляется при сохранении статьи,
+поэтому при поиске он не вычисляется заново для каждой строки, а выборка идет по GIN-индексу.
+Если полнотекстовый поиск ничего не нашел, используется поиск по сходству триграмм
+заголовка (оператор %, тоже по GIN-индексу с классом операторов gin_trgm_ops).'''
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import F
+from ..models import Post
+from .base import BaseSearchBackend
+
+
+def search_vector():
+    '''вектор с разными весами для полей: заголовок – A (1.0), тело статьи – B (0.4)'''
+    return SearchVector('title', weight='A') + SearchVector('body', weight='B')
+
+
+def update_search_vectors(queryset):
+    '''пересчитывает сохраненные поисковые векторы одним UPDATE на стороне базы данных'''
+    return queryset.update(search_vector=search_vector())
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    '''векторы обновляются обработчиком сигнала update_post_search_vector,
+    поэтому методы обновления отдельных статей здесь не нужны'''
+
+    def rebuild(self):
+        return update_search_vectors(Post.objects.all())
+
+    def search(self, query):
+        search_query = SearchQuery(query)
+        results = Post.published.filter(search_vector=search_query)\
+                                .annotate(rank=SearchRank(F('search_vector'), search_query))\
+                                .order_by('-rank', '-publish')
+        if results.exists():
+            return results
+        # запасной вариант для опечаток и частей слов: сходство триграмм заголовка
+        return Post.published.filter(title__trigram_similar=query)\
+                             .annotate(similarity=TrigramSimilarity('title', query))\
+                             .order_by('-similarity', '-publish')
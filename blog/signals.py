@@ -0,0 +1,177 @@
+'''Обработчики сигналов моделей блога; подключаются в BlogConfig.ready().
+При изменении статей и комментариев увеличивается версия контента,
+и закешированные фрагменты боковой панели перестают использоваться.'''
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+from .archive import recount_days
+from .cache import bump_content_version
+from .models import Post, Comment, PostTag, SimilarPost
+from .similar import recompute_similar_posts, refresh_limit, refresh_similar_posts
+from .tagindex import recount_tags, refresh_tag_index
+from .sitemaps import invalidate_section
+from .feeds import invalidate_feeds, invalidate_post_feeds
+from .search import get_search_backend
+from .search.postgres import update_search_vectors
+from .metrics import install_query_timer
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_content_cache(sender, **kwargs):
+    bump_content_version()
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    '''удаление активного комментария уменьшает счетчик статьи; сигнал отправляется
+    и при удалении через QuerySet (например, в админке), и внутри транзакции удаления'''
+    if instance.active:
+        Post.objects.filter(pk=instance.post_id).update(active_comment_count=F('active_comment_count') - 1)
+
+
+def schedule_similar_refresh(post_ids):
+    '''пересчет похожих статей выполняется после фиксации транзакции,
+    когда статья и ее теги уже сохранены (в админке теги сохраняются после статьи)'''
+    post_ids = set(post_ids)
+    if post_ids:
+        transaction.on_commit(lambda: refresh_similar_posts(post_ids, limit=refresh_limit()))
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def tags_changed(sender, instance, action, using, **kwargs):
+    if isinstance(instance, Post) and action in ('post_add', 'post_remove', 'post_clear'):
+        # изменение тегов – тоже правка статьи: по updated ее находят синхронизация поискового
+        # индекса других процессов (см. search/memory.py) и дата изменения в карте сайта
+        instance.updated = timezone.now()
+        Post.objects.using(using).filter(pk=instance.pk).update(updated=instance.updated)
+        invalidate_section(instance.pk) # update() не отправляет post_save, а lastmod в разделе изменился
+        schedule_similar_refresh([instance.pk])
+        refresh_tag_index([instance.pk]) # в той же транзакции, что и изменение тегов
+        bump_content_version() # теги выводятся на страницах списка и статьи
+        transaction.on_commit(lambda: get_search_backend().update_post(instance)) # теги входят в поисковый индекс
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def tag_feeds_changed(sender, instance, action, pk_set, **kwargs):
+    '''ленты добавленных и снятых тегов; перед очисткой тегов – ленты всех текущих тегов'''
+    if isinstance(instance, Post) and instance.status == 'published' \
+            and action in ('post_add', 'post_remove', 'pre_clear'):
+        invalidate_post_feeds(instance, pk_set or ())
+
+
+@receiver(post_save, sender=Post)
+def invalidate_feeds_on_save(sender, instance, **kwargs):
+    '''в ленты попадают только опубликованные статьи: черновики не затрагивают кеш лент.
+    Подключается до post_visibility_changed, который обновляет _loaded_values'''
+    if instance.status == 'published' or getattr(instance, '_loaded_values', {}).get('status') == 'published':
+        invalidate_post_feeds(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_visibility_changed(sender, instance, created, **kwargs):
+    '''похожие статьи, индекс тегов и счетчики архива зависят только от тегов
+    и от того, опубликована ли статья и когда'''
+    loaded = getattr(instance, '_loaded_values', {})
+    if created or any(loaded.get(field) != getattr(instance, field) for field in ('status', 'publish')):
+        schedule_similar_refresh([instance.pk])
+        if not created: # у новой статьи еще нет тегов – строки индекса появятся при их добавлении
+            refresh_tag_index([instance.pk])
+        days = [] # день, из которого статья ушла, и день, в который попала
+        if loaded.get('status') == 'published' and loaded.get('publish'):
+            days.append(timezone.localdate(loaded['publish']))
+        if instance.status == 'published':
+            days.append(timezone.localdate(instance.publish))
+        recount_days(days)
+    instance._loaded_values = {**loaded, 'status': instance.status, 'publish': instance.publish}
+
+
+@receiver(pre_delete, sender=Post)
+def remember_similar_neighbours(sender, instance, **kwargs):
+    '''статьи, ссылающиеся на удаляемую как на похожую, нужно пересчитать после удаления'''
+    instance._similar_neighbours = list(SimilarPost.objects.filter(similar_post=instance)
+                                                           .values_list('post_id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def refresh_similar_neighbours(sender, instance, **kwargs):
+    '''у соседей изменилась только пара с удаленной статьей: пересчитываются они сами,
+    без поиска статей с общими тегами'''
+    neighbours = getattr(instance, '_similar_neighbours', [])
+    if neighbours:
+        transaction.on_commit(lambda: recompute_similar_posts(neighbours))
+
+
+@receiver(post_delete, sender=Post)
+def recount_archive_day(sender, instance, **kwargs):
+    if instance.status == 'published':
+        recount_days([timezone.localdate(instance.publish)])
+
+
+@receiver(pre_delete, sender=Post)
+def remember_index_tags(sender, instance, **kwargs):
+    '''строки индекса удаляются каскадно вместе со статьей, а счетчики ее тегов нужно пересчитать'''
+    instance._index_tags = set(PostTag.objects.filter(post=instance).values_list('tag_id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def recount_index_tags(sender, instance, **kwargs):
+    recount_tags(getattr(instance, '_index_tags', set())) # строки индекса к этому моменту уже удалены
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_feeds_on_delete(sender, instance, **kwargs):
+    if instance.status == 'published':
+        invalidate_post_feeds(instance, getattr(instance, '_index_tags', set()))
+
+
+@receiver(pre_save, sender=Tag)
+def remember_tag_slug(sender, instance, **kwargs):
+    '''после смены слага лента по старому адресу должна быть удалена из кеша'''
+    instance._feed_slug = Tag.objects.filter(pk=instance.pk).values_list('slug', flat=True).first() \
+        if instance.pk else None
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_feeds(sender, instance, **kwargs):
+    '''название тега выводится в заголовке его ленты; ленты удаленного тега и старого слага удаляются'''
+    invalidate_feeds({instance.slug, getattr(instance, '_feed_slug', None) or instance.slug}, latest=False)
+
+
+@receiver(post_save, sender=Post)
+def update_post_search_vector(sender, instance, using, **kwargs):
+    '''поисковый вектор вычисляется на стороне PostgreSQL сразу после сохранения статьи'''
+    if connections[using].vendor == 'postgresql':
+        update_search_vectors(Post.objects.using(using).filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    '''обновление поискового индекса после фиксации транзакции'''
+    transaction.on_commit(lambda: get_search_backend().update_post(instance))
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    post_id = instance.pk
+    transaction.on_commit(lambda: get_search_backend().remove_post(post_id))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_sitemap(sender, instance, **kwargs):
+    '''в кеше карты сайта устаревает только раздел с этой статьей'''
+    invalidate_section(instance.pk)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    '''время SQL-запросов учитывается в метриках текущего запроса (см. metrics.py)'''
+    install_query_timer(connection)
@@ -0,0 +1,157 @@
+'''Предварительный расчет похожих статей.
+Раньше post_detail на каждом просмотре выполнял JOIN по тегам, агрегацию Count('tags')
+и сортировку. Теперь похожесть (количество общих тегов) считается заранее:
+строится разреженная матрица "статьи × теги" X, и произведение X · Xᵀ дает для каждой
+пары статей число общих тегов. Строки матрицы обрабатываются пачками, для каждой статьи
+сохраняются лучшие результаты в таблицу SimilarPost, откуда post_detail читает их одним
+запросом по индексу.
+
+При изменении тегов или статуса статьи пересчитываются только она и статьи,
+имеющие с ней общие теги (см. refresh_similar_posts и signals.py), причем читаются только
+связи их тегов. У популярного тега таких статей тысячи, поэтому сразу (после фиксации
+транзакции в signals.py) пересчитывается не больше BLOG_SIMILAR_REFRESH_LIMIT статей,
+а остальные ставятся в очередь SimilarRefresh, которую разбирает команда
+build_similar_posts --queued (например, по cron).'''
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from taggit.models import TaggedItem
+from .models import Post, SimilarPost, SimilarRefresh
+
+
+def stored_count():
+    '''сколько похожих статей хранить для каждой статьи (показываются первые 4)'''
+    return getattr(settings, 'BLOG_SIMILAR_POSTS_STORED', 10)
+
+
+def tag_links():
+    '''пары (id статьи, id тега) из таблицы taggit'''
+    return TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post))\
+                             .values_list('object_id', 'tag_id')
+
+
+def tag_matrix(post_ids, links):
+    '''разреженная бинарная матрица "статьи × теги" в формате CSR;
+    строки идут в порядке post_ids, связи с другими статьями отбрасываются'''
+    row_of = {post_id: row for row, post_id in enumerate(post_ids)}
+    rows, tags = [], []
+    for post_id, tag_id in links:
+        row = row_of.get(post_id)
+        if row is not None:
+            rows.append(row)
+            tags.append(tag_id)
+    tag_values, columns = np.unique(np.array(tags, dtype=np.int64), return_inverse=True)
+    data = np.ones(len(rows), dtype=np.int32)
+    return sparse.csr_matrix((data, (np.array(rows, dtype=np.int64), columns.ravel())),
+                             shape=(len(post_ids), len(tag_values)))
+
+
+def top_similar(scores, row, exclude, limit):
+    '''лучшие столбцы строки разреженной матрицы scores, кроме столбца exclude (сама статья):
+    по убыванию числа общих тегов, при равенстве – более новые статьи
+    (столбцы упорядочены по убыванию publish)'''
+    start, end = scores.indptr[row], scores.indptr[row + 1]
+    columns = scores.indices[start:end]
+    values = scores.data[start:end]
+    keep = (columns != exclude) & (values > 0)
+    columns, values = columns[keep], values[keep]
+    order = np.lexsort((columns, -values))[:limit]
+    return columns[order], values[order]
+
+
+def compute(row_ids, candidate_ids, links, batch_size=500):
+    '''считает похожие статьи для row_ids среди candidate_ids и сохраняет результат;
+    candidate_ids должны быть упорядочены по убыванию publish'''
+    matrix = tag_matrix(candidate_ids, links)
+    position = {post_id: index for index, post_id in enumerate(candidate_ids)}
+    rows = [post_id for post_id in row_ids if post_id in position]
+    limit = stored_count()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        batch_rows = [position[post_id] for post_id in batch]
+        scores = (matrix[batch_rows] @ matrix.T).tocsr() # число общих тегов для каждой пары (статья пачки, кандидат)
+        entries = []
+        for index, post_id in enumerate(batch):
+            columns, values = top_similar(scores, index, batch_rows[index], limit)
+            entries.extend(SimilarPost(post_id=post_id, similar_post_id=candidate_ids[column],
+                                       score=int(value), rank=rank)
+                           for rank, (column, value) in enumerate(zip(columns, values)))
+        with transaction.atomic():
+            SimilarPost.objects.filter(post_id__in=batch).delete()
+            SimilarPost.objects.bulk_create(entries)
+    return len(rows)
+
+
+def published_ids():
+    '''id опубликованных статей в порядке убывания даты публикации'''
+    return list(Post.published.order_by('-publish', '-id').values_list('id', flat=True))
+
+
+def refresh_limit():
+    '''сколько статей пересчитывается сразу после изменения; остальные ставятся в очередь'''
+    return getattr(settings, 'BLOG_SIMILAR_REFRESH_LIMIT', 200)
+
+
+def rebuild_similar_posts(batch_size=500):
+    '''полный пересчет таблицы SimilarPost'''
+    SimilarRefresh.objects.all().delete() # полный пересчет покрывает и очередь
+    candidate_ids = published_ids()
+    saved = compute(candidate_ids, candidate_ids, tag_links().iterator(), batch_size)
+    SimilarPost.objects.exclude(post__status='published').delete()
+    return saved
+
+
+def affected_posts(post_ids):
+    '''статьи, на которые влияет изменение тегов или статуса статей post_ids: сами статьи,
+    статьи, уже ссылающиеся на них как на похожие (их оценки могли уменьшиться), и статьи
+    с общими тегами (оценки могли вырасти) – в таком порядке важности. Читаются только
+    связи измененных тегов, а не вся таблица taggit'''
+    post_ids = set(post_ids)
+    changed_tags = tag_links().filter(object_id__in=post_ids).values('tag_id')
+    referencing = set(SimilarPost.objects.filter(similar_post_id__in=post_ids).values_list('post_id', flat=True))
+    sharing = set(tag_links().filter(tag_id__in=changed_tags).values_list('object_id', flat=True).distinct())
+    return sorted(post_ids) + sorted(referencing - post_ids) + sorted(sharing - post_ids - referencing)
+
+
+def recompute_similar_posts(row_ids, batch_size=500):
+    '''пересчитывает похожие статьи для row_ids. Кандидаты – только статьи, у которых есть
+    хотя бы один тег из тегов row_ids: с остальными у них нет общих тегов'''
+    row_ids = set(row_ids)
+    if not row_ids:
+        return 0
+    row_tags = tag_links().filter(object_id__in=row_ids).values('tag_id')
+    links = list(tag_links().filter(tag_id__in=row_tags))
+    candidate_ids = list(Post.published.filter(id__in={post_id for post_id, _ in links} | row_ids)
+                                       .order_by('-publish', '-id').values_list('id', flat=True))
+    SimilarPost.objects.filter(post_id__in=row_ids - set(candidate_ids)).delete() # черновики и удаленные статьи
+    rows = [post_id for post_id in candidate_ids if post_id in row_ids]
+    return compute(rows, candidate_ids, links, batch_size)
+
+
+def refresh_similar_posts(post_ids, batch_size=500, limit=None):
+    '''инкрементальный пересчет после изменения тегов или статуса статей post_ids.
+    Не больше limit затронутых статей пересчитывается сразу (сначала самые важные, см. affected_posts),
+    остальные ставятся в очередь SimilarRefresh; None – пересчитать все сразу'''
+    rows = affected_posts(post_ids)
+    if limit is not None and len(rows) > limit:
+        queue_similar_refresh(rows[limit:])
+        rows = rows[:limit]
+    return recompute_similar_posts(rows, batch_size)
+
+
+def queue_similar_refresh(post_ids):
+    SimilarRefresh.objects.bulk_create([SimilarRefresh(post_id=post_id) for post_id in post_ids],
+                                       batch_size=1000, ignore_conflicts=True)
+
+
+def refresh_queued_posts(batch_size=500):
+    '''разбирает очередь SimilarRefresh пачками по batch_size статей'''
+    total = 0
+    while True:
+        post_ids = list(SimilarRefresh.objects.values_list('post_id', flat=True)[:batch_size])
+        if not post_ids:
+            return total
+        total += recompute_similar_posts(post_ids, batch_size)
+        SimilarRefresh.objects.filter(post_id__in=post_ids).delete()
@@ -1,17 +1,154 @@
-from django.contrib.sitemaps import Sitemap
-from .models import Post
-
-class PostSitemap(Sitemap):
-    '''собственный объект карты сайта; унаследован от Sitemap модуля sitemaps'''
-    changefreq = 'weekly' # частота обновления страниц статей
-    priority = 0.9        # степень их совпадения с тематикой сайта (максимальное значение – 1)
-
-    def items(self):
-        '''Метод items() возвращает QuerySet объектов, которые будут отображаться в карте сайта.
-        По умолчанию Django использует метод get_absolute_url() объектов списка, чтобы получать их URL’ы (определен для класса Post).
-        Чтобы указать URL для каждого объекта нужно добавить метод location в класс карты сайта.'''
-        return Post.published.all()
-
-    def lastmod(self, obj):
-        '''принимает каждый объект из результата вызова items() и возвращает время последней модификации статьи'''
-        return obj.updated
+'''Карта сайта, разбитая на разделы фиксированного размера.
+Стандартный обработчик django.contrib.sitemaps загружает все статьи целиком (вместе с телом)
+и вызывает get_absolute_url() для каждой. Здесь sitemap.xml – индекс разделов, а каждый раздел
+содержит статьи с id из диапазона [n * размер, (n + 1) * размер). Раздел строится итератором
+по трем нужным полям, поэтому память не зависит от количества статей.
+
+Готовый XML раздела хранится в кеше (по умолчанию сжатым gzip) и удаляется только при
+изменении статьи из этого раздела (см. signals.py), остальные разделы остаются в кеше.
+В кеше процесса разделы живут не дольше BLOG_LOCAL_CACHE_TIMEOUT секунд: другие процессы
+их не удаляют (см. cache.invalidation_timeout).
+Сжатый и несжатый ответы – разные представления, поэтому у сжатого ETag с суффиксом -gzip.'''
+import gzip
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.db.models import F, Max
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+from django.utils.xmlutils import SimplerXMLGenerator
+from io import StringIO
+from .cache import invalidation_timeout, may_be_stale
+from .conditional import content_etag, content_last_modified
+from .metrics import record_cache
+from .models import Post, post_url
+
+INDEX_KEY = 'blog:sitemap:index'
+SECTION_KEY = 'blog:sitemap:section:%s'
+CHANGEFREQ = 'weekly' # частота обновления страниц статей
+PRIORITY = '0.9'      # степень их совпадения с тематикой сайта (максимальное значение – 1)
+
+
+def section_size():
+    '''количество id статей в одном разделе (протокол Sitemaps допускает до 50 000 адресов в файле)'''
+    return getattr(settings, 'BLOG_SITEMAP_SECTION_SIZE', 5000)
+
+
+def section_of(post_id):
+    return post_id // section_size()
+
+
+def gzip_enabled():
+    return getattr(settings, 'BLOG_SITEMAP_GZIP', True)
+
+
+def sends_gzip(request):
+    '''ответ будет отдан сжатым gzip без распаковки'''
+    return gzip_enabled() and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def sitemap_etag(request, *args, **kwargs):
+    '''общий валидатор блога (см. conditional.py) с признаком сжатия ответа'''
+    etag = content_etag(request)
+    return f'{etag}-gzip' if etag and sends_gzip(request) else etag
+
+
+sitemap_conditional = condition(etag_func=sitemap_etag, last_modified_func=content_last_modified)
+
+
+def invalidate_section(post_id):
+    '''удаляет из кеша раздел со статьей post_id и индекс разделов'''
+    cache.delete_many([SECTION_KEY % section_of(post_id), INDEX_KEY])
+
+
+def invalidate_all_sections():
+    '''удаляет из кеша все разделы и индекс; для массовых операций в обход сигналов'''
+    last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+    cache.delete_many([SECTION_KEY % section for section in range(section_of(last_id) + 1)] + [INDEX_KEY])
+
+
+@sitemap_conditional
+def sitemap_index(request):
+    '''индекс карты сайта: ссылки на разделы с датой последнего изменения статей в каждом'''
+    return cached_response(request, INDEX_KEY, render_index)
+
+
+@sitemap_conditional
+def sitemap_section(request, section):
+    '''раздел карты сайта со статьями, id которых попадают в диапазон раздела'''
+    return cached_response(request, SECTION_KEY % section, lambda base: render_section(base, section))
+
+
+def cached_response(request, key, render):
+    '''XML из кеша или построенный render(base); вместе с XML хранятся адрес сайта и режим сжатия:
+    при их изменении XML строится заново (режим сжатия учитывается и в ETag, см. sitemap_etag)'''
+    base = f'{request.scheme}://{get_current_site(request).domain}'
+    compressed = gzip_enabled()
+    entry = cache.get(key)
+    missed = entry is None or entry[:2] != (base, compressed)
+    record_cache('sitemap', 'miss' if missed else 'hit')
+    if missed:
+        content = render(base)
+        if content is None:
+            raise Http404('Раздел карты сайта не найден')
+        entry = (base, compressed, gzip.compress(content, 6) if compressed else content)
+        if not may_be_stale(): # данные с отстающей реплики в кеш не попадают
+            cache.set(key, entry, invalidation_timeout()) # хранится до изменения статей раздела
+    payload = entry[2]
+    response = HttpResponse(content_type='application/xml')
+    if compressed:
+        if sends_gzip(request):
+            response['Content-Encoding'] = 'gzip' # отдаем сжатый XML без повторного сжатия
+        else:
+            payload = gzip.decompress(payload)
+        patch_vary_headers(response, ('Accept-Encoding',))
+    response.content = payload
+    return response
+
+
+def render_index(base):
+    size = section_size()
+    sections = Post.published.annotate(section=F('id') / size).order_by()\
+                             .values('section').annotate(lastmod=Max('updated')).order_by('section')
+    xml, stream = xml_writer('sitemapindex')
+    for row in sections.iterator():
+        xml.startElement('sitemap', {})
+        xml.addQuickElement('loc', base + reverse('blog_sitemap_section', args=[row['section']]))
+        xml.addQuickElement('lastmod', row['lastmod'].date().isoformat())
+        xml.endElement('sitemap')
+    return finish(xml, stream, 'sitemapindex')
+
+
+def render_section(base, section):
+    size = section_size()
+    rows = Post.published.filter(id__gte=section * size, id__lt=(section + 1) * size)\
+                         .order_by('id').values_list('publish', 'slug', 'updated')
+    xml, stream = xml_writer('urlset')
+    empty = True
+    for publish, slug, updated in rows.iterator(chunk_size=1000):
+        empty = False
+        xml.startElement('url', {})
+        xml.addQuickElement('loc', base + post_url(publish, slug))
+        xml.addQuickElement('lastmod', updated.date().isoformat())
+        xml.addQuickElement('changefreq', CHANGEFREQ)
+        xml.addQuickElement('priority', PRIORITY)
+        xml.endElement('url')
+    if empty:
+        return None
+    return finish(xml, stream, 'urlset')
+
+
+def xml_writer(root):
+    stream = StringIO()
+    xml = SimplerXMLGenerator(stream, 'utf-8')
+    xml.startDocument()
+    xml.startElement(root, {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'})
+    return xml, stream
+
+
+def finish(xml, stream, root):
+    xml.endElement(root)
+    xml.endDocument()
+    return stream.getvalue().encode('utf-8')
@@ -0,0 +1,151 @@
+'''Статические файлы с хешем содержимого в имени и заранее сжатыми копиями.
+collectstatic сохраняет каждый файл под именем с хешем (css/blog.3f2a9c1b7d4e.css) и записывает
+рядом сжатые копии .gz и .br (пакет brotli указан в requirements.txt; без него создаются
+только копии .gz). Тег {% static %} выдает имена с хешем, поэтому файл по такому адресу
+никогда не меняется и может кешироваться браузером "навсегда" (Cache-Control: immutable):
+повторные посещения не запрашивают файлы вовсе.
+StaticFilesMiddleware отдает сжатую копию в соответствии с Accept-Encoding,
+так что серверы приложения ничего не сжимают на лету.'''
+import asyncio
+import gzip
+import mimetypes
+import os
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError: # установка без brotli: создаются только копии .gz
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.html', '.xml', '.json', '.map', '.ico')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # в порядке предпочтения
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def compress(path):
+    '''записывает рядом с файлом копии .gz и .br, если они меньше оригинала'''
+    with open(path, 'rb') as file:
+        content = file.read()
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))] # mtime=0 – одинаковый результат при каждой сборке
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content)))
+    written = []
+    for extension, compressed in variants:
+        if len(compressed) < len(content):
+            with open(path + extension, 'wb') as file:
+                file.write(compressed)
+            written.append(path + extension)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    '''ManifestStaticFilesStorage, который после расстановки хешей сжимает текстовые файлы'''
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                compress(self.path(name))
+
+    def stored_name(self, name):
+        '''при отсутствии манифеста (collectstatic не выполнялся, например в тестах и разработке)
+        отдается исходное имя файла вместо ошибки при рендеринге шаблона'''
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+def accepted_encodings(request):
+    '''кодировки из Accept-Encoding, которые клиент принимает (q=0 означает отказ)'''
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    '''отдает собранные collectstatic файлы из STATIC_ROOT без обращения к обработчикам.
+    Файлы с хешем в имени кешируются браузером навсегда, остальные – на BLOG_STATIC_MAX_AGE секунд;
+    сжатая копия выбирается по Accept-Encoding. Отключается настройкой BLOG_SERVE_STATIC = False
+    (например, если статику отдает nginx). Должен стоять в начале MIDDLEWARE.
+    Под ASGI работает асинхронно: обращения к файлам выполняются в пуле потоков'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        name = self.static_name(request)
+        response = self.serve(request, name) if name is not None else None
+        return response if response is not None else self.get_response(request)
+
+    async def __acall__(self, request):
+        name = self.static_name(request)
+        response = await sync_to_async(self.serve, thread_sensitive=False)(request, name) if name is not None else None
+        return response if response is not None else await self.get_response(request)
+
+    def static_name(self, request):
+        '''имя файла в STATIC_ROOT или None, если запрос не к статике'''
+        if (request.method in ('GET', 'HEAD') and settings.STATIC_ROOT
+                and request.path_info.startswith(settings.STATIC_URL)
+                and getattr(settings, 'BLOG_SERVE_STATIC', True)):
+            return request.path_info[len(settings.STATIC_URL):]
+        return None
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation: # попытка выйти за пределы STATIC_ROOT
+            return None
+        if not os.path.isfile(path):
+            return None
+        content_type, file_encoding = mimetypes.guess_type(name)
+        if file_encoding or not content_type: # сжатую копию, запрошенную напрямую, отдаем как есть
+            content_type = 'application/octet-stream'
+        accepted = accepted_encodings(request)
+        encoding = next((encoding for encoding, extension in ENCODINGS
+                         if encoding in accepted and os.path.isfile(path + extension)), None)
+        if encoding:
+            path += dict(ENCODINGS)[encoding]
+        stat = os.stat(path)
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"' # у каждой сжатой копии свой ETag
+        response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Content-Length'] = stat.st_size
+            response['Last-Modified'] = http_date(stat.st_mtime)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        if name in self.hashed_names():
+            response['Cache-Control'] = IMMUTABLE
+        else:
+            response['Cache-Control'] = f'public, max-age={getattr(settings, "BLOG_STATIC_MAX_AGE", 60)}'
+        return response
+
+    def hashed_names(self):
+        '''имена файлов с хешем из манифеста collectstatic; множество строится заново,
+        только если хранилище перечитало манифест'''
+        hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+        if getattr(self, '_hashed_files', None) is not hashed_files:
+            self._hashed_files, self._hashed_names = hashed_files, set(hashed_files.values())
+        return self._hashed_names
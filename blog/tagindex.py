@@ -0,0 +1,71 @@
+'''Поддержка индекса тегов PostTag и счетчиков TagStat (см. models.py).
+Строки индекса пересчитываются для отдельных статей при изменении их тегов, статуса
+и даты публикации (signals.py), а счетчики – только для затронутых тегов.
+После массовых операций в обход сигналов (bulk_create, QuerySet.update) индекс
+перестраивается командой build_tag_index.'''
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, Max
+from taggit.models import TaggedItem
+from .models import Post, PostTag, TagStat
+
+
+def post_tags():
+    '''пары (id статьи, id тега) из таблицы taggit'''
+    return TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post))\
+                             .values_list('object_id', 'tag_id')
+
+
+def index_rows(posts, links):
+    '''строки индекса для опубликованных статей posts {id: publish} по парам (статья, тег)'''
+    return [PostTag(tag_id=tag_id, post_id=post_id, publish=posts[post_id])
+            for post_id, tag_id in links if post_id in posts]
+
+
+def refresh_tag_index(post_ids):
+    '''перестраивает строки индекса статей post_ids и счетчики их старых и новых тегов'''
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    with transaction.atomic():
+        stale = PostTag.objects.filter(post_id__in=post_ids)
+        tag_ids = set(stale.values_list('tag_id', flat=True))
+        stale.delete()
+        rows = index_rows(dict(Post.published.filter(id__in=post_ids).values_list('id', 'publish')),
+                          post_tags().filter(object_id__in=post_ids))
+        PostTag.objects.bulk_create(rows)
+        recount_tags(tag_ids | {row.tag_id for row in rows})
+
+
+def recount_tags(tag_ids):
+    '''записывает в TagStat количество опубликованных статей тегов tag_ids
+    (подсчет идет по индексу PostTag, а не по таблице статей)'''
+    tag_ids = set(tag_ids)
+    if not tag_ids:
+        return
+    counts = dict(PostTag.objects.filter(tag_id__in=tag_ids).order_by().values('tag')
+                                 .annotate(total=Count('post')).values_list('tag', 'total'))
+    stats = TagStat.objects.in_bulk(tag_ids)
+    for stat in stats.values():
+        stat.post_count = counts.get(stat.tag_id, 0)
+    TagStat.objects.bulk_update(stats.values(), ['post_count'])
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id, post_count=counts.get(tag_id, 0))
+                                 for tag_id in tag_ids - set(stats)], ignore_conflicts=True)
+
+
+def rebuild_tag_index(batch_size=5000):
+    '''полная перестройка индекса и счетчиков; статьи обрабатываются диапазонами id,
+    поэтому в памяти находится не больше batch_size статей'''
+    last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+    with transaction.atomic():
+        PostTag.objects.all().delete()
+        for start in range(0, last_id, batch_size):
+            posts = dict(Post.published.filter(id__gt=start, id__lte=start + batch_size)
+                                       .values_list('id', 'publish'))
+            links = post_tags().filter(object_id__gt=start, object_id__lte=start + batch_size)
+            PostTag.objects.bulk_create(index_rows(posts, links), batch_size=batch_size)
+        TagStat.objects.all().delete()
+        TagStat.objects.bulk_create([TagStat(tag_id=tag_id, post_count=total) for tag_id, total in
+                                     PostTag.objects.order_by().values('tag').annotate(total=Count('post'))
+                                                    .values_list('tag', 'total')], batch_size=batch_size)
+    return PostTag.objects.count()
@@ -4,9 +4,10 @@
 
 from django import template
 from ..models import Post
-from django.db.models import Count
 from django.utils.safestring import mark_safe
-import markdown
+from ..rendering import render_markdown
+from ..cache import get_or_build, versioned_key
+from ..metrics import timed # время каждого тега записывается в метрики запроса (см. metrics.py)
 
 register = template.Library() # Для регистрации тега каждый модуль с функциями тегов
                               # должен определять переменную register;
@@ -14,7 +15,11 @@ register = template.Library() # Для регистрации тега кажд
                               # и используется для регистрации пользовательских тегов и фильтров
                               # в системе
 
+SIDEBAR_COUNT = 3 # количество статей в блоках боковой панели (задается в blog/base.html)
+
+
 @register.simple_tag
+@timed('total_posts')
 def total_posts(): # тег total_posts в виде функции обернут в декоратор @register.simple_tag
                    # для регистрации нового тега;
                    # Django будет использовать название функции total_posts в качестве названия тега.
@@ -23,18 +28,21 @@ def total_posts(): # тег total_posts в виде функции оберну
                    # @register.simple_tag(name='my_tag')
     '''шаблонный тег: возвращает 
     количество опубликованных в блоге статей'''
-    return Post.published.count()
+    return get_or_build(versioned_key('sidebar', 'total_posts'), # при теплом кеше запрос к базе не выполняется
+                        Post.published.count)
 
 
 @register.inclusion_tag('blog/post/latest_posts.html') # регистрируем тег с помощью декоратора
                                                        # @register.inclusion_tag и указываем
                                                        # шаблон, который будет использоваться для
                                                        # формирования HTML
+@timed('show_latest_posts')
 def show_latest_posts(count=5): # Функция будет принимать один дополнительный аргумент – count,
                                 # определяет количество статей для отображения;
                                 # зададим значение по умолчанию 5;
     '''тег для добавления последних статей блога на боковую панель'''
-    latest_posts = Post.published.order_by('-publish')[:count] # используем count для ограничения результата запроса
+    latest_posts = get_or_build(versioned_key('sidebar', 'latest_posts', count),
+                                lambda: list(sidebar_posts().order_by('-publish')[:count])) # используем count для ограничения результата запроса
     return {'latest_posts': latest_posts} # функция тега возвращает словарь переменных вместо простого значения;
                                           # инклюзивные теги должны возвращать только словари контекста,
                                           # который затем будет использован для формирования HTML-шаблона.
@@ -43,21 +51,26 @@ def show_latest_posts(count=5): # Функция будет принимать 
 
 
 @register.simple_tag
+@timed('get_most_commented_posts')
 def get_most_commented_posts(count=5):
     '''шаблонный тег для отображения статей с наибольшим количеством комментариев'''
-    # формируем QuerySet, используя метод annotate() для добавления к каждой статье количества ее комментариев
-    # Аннотации, указанные с помощью ключевых аргументов, будут использовать ключевое слово в качестве псевдонима для аннотации.
-    # Для анонимных аргументов будет создан псевдоним, основанный на имени агрегатной функции и агрегируемого поля модели.
-    # Только агрегатные выражения, которые ссылаются на одно поле, могут быть анонимными аргументами.
-    # Count используется в качестве функции агрегации, которая вычисляет
-    # количество комментариев total_comments для каждого объекта Post
-    return Post.published.annotate(total_comments=Count('comments'))\
-                         .order_by('-total_comments')[:count] # сортируем QuerySet по созданному полю total_comments в порядке убывания с ограничением count
+    # вместо агрегации Count('comments') по всей таблице комментариев сортируем
+    # по денормализованному счетчику active_comment_count, для которого есть индекс
+    return get_or_build(versioned_key('sidebar', 'most_commented_posts', count),
+                        lambda: list(sidebar_posts().order_by('-active_comment_count', '-publish')[:count]))
+
+
+def sidebar_posts():
+    '''статьи для боковой панели: загружаем только поля, нужные для ссылки,
+    чтобы в кеш не попадали тела статей'''
+    return Post.published.only('id', 'title', 'slug', 'publish')
+
 
 @register.filter(name='markdown') # указали имя фильтра, которое будет использоваться в шаблонах: {{ variable|markdown }}
+@timed('markdown')
 def markdown_format(text): # чтобы избежать коллизий имен нашей функции и установленного Markdown-пакета,
                            # функция названа markdown_format
-    return mark_safe(markdown.markdown(text)) # функция mark_safe помечает результат работы фильтра как HTML-код,
+    return mark_safe(render_markdown(text))   # функция mark_safe помечает результат работы фильтра как HTML-код,
                                               # который нужно учитывать при построении шаблона.
                                               # По умолчанию Django не доверяет любому HTML, получаемому из переменных контекста или фильтров.
                                               # Единственное исключение – фрагменты, помеченные с помощью mark_safe.
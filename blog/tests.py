@@ -1,4 +1,1306 @@
-from django.test import TestCase
+from django.test import Client, TestCase, TransactionTestCase, RequestFactory
 '''этот файл предназначен для создания тестов для приложения'''
+import asyncio
+import gzip
+from io import StringIO
+import json
+from asgiref.sync import async_to_sync
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import mail, signing
+from django.core.mail.backends import locmem
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.cache import cache
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag
+from .admin import CommentAdmin
+from .models import ArchiveDay, Post, Comment, OutboxMessage, PostTag, SimilarRefresh, TagStat
+from .outbox import send_outbox
+from .pagination import CountedPaginator, KeysetPaginator
+from .cache import (LAST_MODIFIED_KEY, bump_content_version, content_version, get_or_build, invalidation_timeout,
+                    versioned_key)
+from .rendering import EXCERPT_WORDS
+from . import async_views
+from .prerender import prerender
+from .benchmark import compare, run_benchmark, seed_blog
+from .importer import import_posts, read_records
+from .export import export_records
+from .feeds import feed_key
+from .loadtest import ASGITarget, LoadPlan, WSGITarget, parse_metrics, parse_mix, registry_snapshot, run_load
+from .staticfiles import brotli
+from .routers import PIN_COOKIE, ReplicaPinMiddleware
+from .similar import rebuild_similar_posts, refresh_similar_posts
+from .sitemaps import section_size
+from .search import reset_search_backends
+from .search.memory import InvertedIndexSearchBackend
+from .tagindex import rebuild_tag_index
+from .archive import rebuild_archive
 
-# Create your tests here.
+
+class QueryBudgetMixin:
+    '''проверка "бюджета" запросов: обработчик не должен выполнять больше запросов, чем задано;
+    при превышении тест падает со списком выполненных SQL-запросов'''
+
+    def assertQueryBudget(self, budget, url):
+        self.client.get(url) # первый запрос прогревает кеш боковой панели
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        executed = len(queries.captured_queries)
+        if executed > budget:
+            sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+            self.fail(f'{url}: выполнено {executed} запросов при бюджете {budget}:\n{sql}')
+        return response
+
+
+def create_posts(author, count, tags_per_post=3):
+    '''создает опубликованные статьи с тегами и комментариями'''
+    posts = []
+    for number in range(count):
+        post = Post.objects.create(title=f'Статья {number}', slug=f'post-{number}', author=author,
+                                   body=f'Текст **статьи** {number}', status='published')
+        post.tags.add(*[f'tag-{tag}' for tag in range(tags_per_post)])
+        for comment in range(2):
+            Comment.objects.create(post=post, name='Читатель', email='reader@example.com', body='Комментарий')
+        posts.append(post)
+    return posts
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0) # измеряются сами обработчики, а не кеш страниц
+class ViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    '''количество запросов на страницу не должно расти с числом статей, тегов и комментариев'''
+    LIST_BUDGET = 2    # статьи с авторами + теги
+    TAG_BUDGET = 3     # тег со счетчиком + строки индекса тега со статьями и авторами + теги
+    DETAIL_BUDGET = 4  # статья с автором + теги + комментарии + похожие статьи
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+
+    def check_budgets(self):
+        post = Post.published.first()
+        self.assertQueryBudget(self.LIST_BUDGET, reverse('blog:post_list'))
+        self.assertQueryBudget(self.TAG_BUDGET, reverse('blog:post_list_by_tag', args=['tag-0']))
+        self.assertQueryBudget(self.DETAIL_BUDGET, post.get_absolute_url())
+
+    def test_budget_with_few_posts(self):
+        create_posts(self.author, 2, tags_per_post=1)
+        self.check_budgets()
+
+    def test_budget_with_many_posts_and_tags(self):
+        create_posts(self.author, 10, tags_per_post=6)
+        self.check_budgets()
+
+    @override_settings(BLOG_PAGINATION='offset')
+    def test_budget_with_offset_pagination(self):
+        create_posts(self.author, 10, tags_per_post=6)
+        # Paginator дополнительно выполняет COUNT(*); для тега количество берется из TagStat
+        self.assertQueryBudget(self.LIST_BUDGET + 1, reverse('blog:post_list'))
+        self.assertQueryBudget(self.TAG_BUDGET, reverse('blog:post_list_by_tag', args=['tag-0']))
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class RenderingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+
+    def test_html_is_stored_on_save(self):
+        post = Post.objects.create(title='Статья', slug='post', author=self.author,
+                                   body='Текст со **ссылкой** [сюда](https://example.com)', status='published')
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p>Текст со <strong>ссылкой</strong> <a href="https://example.com">сюда</a></p>')
+        post.body = 'Другой текст'
+        post.save(update_fields=['body']) # при частичном сохранении HTML тоже обновляется
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p>Другой текст</p>')
+        self.assertContains(self.client.get(post.get_absolute_url()), '<p>Другой текст</p>', html=True)
+
+    def test_excerpt_is_truncated_html(self):
+        words = ' '.join(f'слово{number}' for number in range(40))
+        post = Post.objects.create(title='Статья', slug='post', author=self.author,
+                                   body=f'**{words}**', status='published')
+        self.assertEqual(post.excerpt_html, '<p><strong>' + ' '.join(words.split()[:EXCERPT_WORDS]) + ' …</strong></p>')
+        self.assertContains(self.client.get(reverse('blog:post_list')), 'слово29 …')
+        self.assertNotContains(self.client.get(reverse('blog:post_list')), 'слово30')
+
+    def test_render_posts_invalidates_caches(self):
+        post = Post.objects.create(title='Статья', slug='post', author=self.author,
+                                   body='Старый **текст**', status='published')
+        url = reverse('blog:post_feed')
+        self.assertContains(self.client.get(url), 'Старый')
+        version = content_version()
+        Post.objects.filter(pk=post.pk).update(body='Новый *текст*') # в обход save() и сигналов
+        call_command('render_posts', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p>Новый <em>текст</em></p>')
+        self.assertNotEqual(content_version(), version)
+        self.assertContains(self.client.get(url), 'Новый') # лента не отдается из кеша
+
+
+class CommentCountTests(TestCase):
+    '''денормализованный счетчик active_comment_count должен совпадать с пересчетом по комментариям'''
+
+    def setUp(self):
+        author = User.objects.create_user('author')
+        self.first, self.second = create_posts(author, 2, tags_per_post=1) # по 2 активных комментария
+
+    def assertCounts(self, first, second):
+        self.assertEqual([post.active_comment_count for post in Post.objects.order_by('id')], [first, second])
+        self.assertEqual([post.comments.filter(active=True).count() for post in (self.first, self.second)],
+                         [first, second])
+
+    def comment(self, post, active=True):
+        return Comment.objects.create(post=post, name='Читатель', email='reader@example.com',
+                                      body='Комментарий', active=active)
+
+    def test_save_tracks_creation_and_activity(self):
+        self.comment(self.first, active=False) # скрытый комментарий не учитывается
+        self.assertCounts(2, 2)
+        comment = self.comment(self.first)
+        self.assertCounts(3, 2)
+        comment.active = False
+        comment.save()
+        self.assertCounts(2, 2)
+        comment.save() # повторное сохранение без изменений не меняет счетчик
+        self.assertCounts(2, 2)
+        comment = Comment.objects.get(pk=comment.pk) # загруженный из базы комментарий
+        comment.active = True
+        comment.save()
+        self.assertCounts(3, 2)
+        comment = Comment.objects.only('id', 'body').get(pk=comment.pk) # отложенные поля – точный пересчет
+        comment.body = 'Исправлено'
+        comment.save()
+        self.assertCounts(3, 2)
+
+    def test_moving_comment_to_other_post(self):
+        comment = self.first.comments.first()
+        comment.post = self.second
+        comment.save()
+        self.assertCounts(1, 3)
+        comment.active = False
+        comment.post = self.first
+        comment.save()
+        self.assertCounts(1, 2)
+
+    def test_delete_decrements(self):
+        self.comment(self.first, active=False).delete()
+        self.assertCounts(2, 2)
+        self.first.comments.filter(active=True).first().delete()
+        self.assertCounts(1, 2)
+        Comment.objects.filter(post=self.second).delete() # удаление через QuerySet тоже отправляет сигнал
+        self.assertCounts(1, 0)
+
+    def test_set_active_and_admin_actions(self):
+        self.comment(self.second, active=False)
+        self.assertEqual(Comment.objects.filter(post=self.first).set_active(False), 2)
+        self.assertCounts(0, 2)
+        self.assertEqual(Comment.objects.all().set_active(True), 3) # уже активные не учитываются повторно
+        self.assertCounts(2, 3)
+        model_admin = CommentAdmin(Comment, admin.site)
+        model_admin.deactivate_comments(None, Comment.objects.filter(post=self.second))
+        self.assertCounts(2, 0)
+        model_admin.activate_comments(None, Comment.objects.all())
+        self.assertCounts(2, 3)
+
+    def test_recount_comments(self):
+        Post.objects.update(active_comment_count=7) # правка в обход ORM-счетчиков
+        call_command('recount_comments', batch_size=1, stdout=StringIO())
+        self.assertCounts(2, 2)
+
+
+class SimilarPostsTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.posts = {}
+        for slug, tags in [('a', 'x y z'), ('b', 'x y'), ('c', 'z'), ('d', 'q'), ('e', 'x y z q')]:
+            post = Post.objects.create(title=slug, slug=slug, author=self.author, body='', status='published')
+            post.tags.add(*tags.split())
+            self.posts[slug] = post
+
+    def live_similar(self, post):
+        '''прежний расчет похожих статей во время запроса'''
+        tag_ids = post.tags.values_list('id', flat=True)
+        return list(Post.published.filter(tags__in=tag_ids).exclude(id=post.id)
+                                  .annotate(same_tags=Count('tags')).order_by('-same_tags', '-publish')[:4])
+
+    def test_rebuild_matches_live_query(self):
+        rebuild_similar_posts(batch_size=2)
+        for post in Post.published.all():
+            self.assertEqual(post.get_similar_posts(4), self.live_similar(post))
+
+    def test_refresh_after_tag_change(self):
+        rebuild_similar_posts()
+        self.posts['d'].tags.add('x', 'y', 'z')
+        self.posts['e'].tags.clear()
+        refresh_similar_posts([self.posts['d'].id, self.posts['e'].id])
+        for post in Post.published.all():
+            self.assertEqual(post.get_similar_posts(4), self.live_similar(post))
+
+    def test_refresh_over_limit_is_queued(self):
+        rebuild_similar_posts()
+        self.posts['d'].tags.add('x')
+        self.assertEqual(refresh_similar_posts([self.posts['d'].id], limit=1), 1) # только сама статья
+        self.assertEqual(self.posts['d'].get_similar_posts(4), self.live_similar(self.posts['d']))
+        queued = set(SimilarRefresh.objects.values_list('post_id', flat=True))
+        self.assertEqual(queued, {self.posts[slug].id for slug in 'abe'}) # статьи с тегом x
+        call_command('build_similar_posts', '--queued', stdout=StringIO())
+        self.assertFalse(SimilarRefresh.objects.exists())
+        for post in Post.published.all():
+            self.assertEqual(post.get_similar_posts(4), self.live_similar(post))
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class TagIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.posts = create_posts(User.objects.create_user('author'), 5, tags_per_post=2)
+
+    def counts(self):
+        return dict(TagStat.objects.values_list('tag__name', 'post_count'))
+
+    def test_index_follows_tags_status_and_deletion(self):
+        self.assertEqual(self.counts(), {'tag-0': 5, 'tag-1': 5})
+        self.posts[0].tags.remove('tag-1')
+        self.posts[1].tags.add('новый')
+        self.posts[2].status = 'draft'
+        self.posts[2].save()
+        self.posts[3].delete()
+        self.assertEqual(self.counts(), {'tag-0': 3, 'tag-1': 2, 'новый': 1})
+        self.assertFalse(PostTag.objects.filter(post=self.posts[2]).exists())
+
+        index = sorted(PostTag.objects.values_list('post_id', 'tag_id', 'publish'))
+        rebuild_tag_index(batch_size=2) # полная перестройка дает тот же результат
+        self.assertEqual(sorted(PostTag.objects.values_list('post_id', 'tag_id', 'publish')), index)
+        self.assertEqual(self.counts(), {'tag-0': 3, 'tag-1': 2, 'новый': 1})
+
+    def test_tag_listing_and_cloud(self):
+        self.posts[4].tags.remove('tag-1')
+        url = reverse('blog:post_list_by_tag', args=['tag-1'])
+        response = self.client.get(url)
+        self.assertEqual([post.title for post in response.context['posts']], ['Статья 3', 'Статья 2', 'Статья 1'])
+        response = self.client.get(url, {'cursor': response.context['posts'].next_cursor})
+        self.assertEqual([post.title for post in response.context['posts']], ['Статья 0'])
+        with self.settings(BLOG_PAGINATION='offset'):
+            self.assertEqual(self.client.get(url).context['posts'].paginator.num_pages, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('blog:tag_cloud'))
+        self.assertFalse(any('taggit_taggeditem' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual([(tag['name'], tag['count'], tag['size']) for tag in response.context['tags']],
+                         [('tag-0', 5, 5), ('tag-1', 4, 4)])
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0, TIME_ZONE='Europe/Moscow')
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+        for number, publish in enumerate(['2021-03-01T21:30:00+00:00', '2021-03-02T10:00:00+00:00',
+                                          '2021-04-15T12:00:00+00:00', '2020-12-31T22:00:00+00:00']):
+            Post.objects.create(title=f'Статья {number}', slug=f'post-{number}', author=self.author, body='Текст',
+                                status='published', publish=parse_datetime(publish))
+
+    def counts(self):
+        return {str(day): count for day, count in ArchiveDay.objects.filter(post_count__gt=0)
+                                                                   .values_list('day', 'post_count')}
+
+    def test_detail_uses_local_day_range(self):
+        post = Post.objects.get(slug='post-0') # 1 марта 21:30 UTC – это уже 2 марта по Москве
+        self.assertEqual(post.get_absolute_url(), '/blog/2021/3/2/post-0/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(post.get_absolute_url()).status_code, 200)
+        self.assertNotIn('django_datetime_extract', queries.captured_queries[0]['sql'])
+        self.assertEqual(self.client.get('/blog/2021/3/1/post-0/').status_code, 404)
+        self.assertEqual(self.client.get('/blog/2021/2/30/post-0/').status_code, 404)
+
+    def test_counts_follow_changes(self):
+        self.assertEqual(self.counts(), {'2021-03-02': 2, '2021-04-15': 1, '2021-01-01': 1})
+        post = Post.objects.get(slug='post-2')
+        post.publish = parse_datetime('2021-03-02T12:00:00+00:00')
+        post.save()
+        Post.objects.get(slug='post-1').delete()
+        Post.objects.create(title='Черновик', slug='draft', author=self.author, body='Текст')
+        self.assertEqual(self.counts(), {'2021-03-02': 2, '2021-01-01': 1})
+        expected = self.counts()
+        rebuild_archive(batch_size=2)
+        self.assertEqual(self.counts(), expected)
+
+    def test_archive_pages(self):
+        response = self.client.get(reverse('blog:post_archive'))
+        self.assertEqual([(str(day), count) for day, count in response.context['periods']],
+                         [('2021-01-01', 4)]) # 31 декабря 22:00 UTC – это уже 2021 год по Москве
+        response = self.client.get(reverse('blog:post_archive_year', args=[2021]))
+        self.assertEqual(response.context['total'], 4)
+        self.assertEqual([(day.month, count) for day, count in response.context['periods']], [(4, 1), (3, 2), (1, 1)])
+        response = self.client.get(reverse('blog:post_archive_month', args=[2021, 3]))
+        self.assertEqual([post.title for post in response.context['posts']], ['Статья 1', 'Статья 0'])
+        response = self.client.get(reverse('blog:post_archive_day', args=[2021, 1, 1]))
+        self.assertEqual([post.title for post in response.context['posts']], ['Статья 3'])
+        self.assertEqual(self.client.get('/blog/2021/13/').status_code, 404)
+
+    def test_dates_out_of_range(self):
+        for url in ['/blog/9999/12/31/post-0/', '/blog/9999/12/31/', '/blog/9999/12/', '/blog/9999/',
+                    '/blog/99999999999999999999/', '/blog/99999999999999999999/1/1/post-0/']:
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+
+class InvertedIndexSearchTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.backend = InvertedIndexSearchBackend()
+
+    def create(self, title, body, tags=(), status='published'):
+        post = Post.objects.create(title=title, slug=f'post-{Post.objects.count()}', author=self.author,
+                                   body=body, status=status)
+        post.tags.add(*tags)
+        return post
+
+    def test_ranking(self):
+        django = self.create('Django', 'Веб-фреймворк на Python')
+        python = self.create('Python', 'Язык программирования; Django написан на Python', tags=['python'])
+        self.create('Черновик', 'Python', status='draft')
+        self.assertEqual(list(self.backend.search('python')), [python, django])
+        self.assertEqual(list(self.backend.search('django')), [django, python])
+        self.assertEqual(list(self.backend.search('фреймв')), [django]) # поиск по началу слова
+
+    def test_incremental_updates(self):
+        post = self.create('Заметка', 'Текст')
+        self.assertEqual(list(self.backend.search('заметка')), [post])
+        post.title = 'Статья'
+        post.save()
+        self.backend.update_post(post)
+        self.assertEqual(list(self.backend.search('заметка')), [])
+        self.assertEqual(list(self.backend.search('статья')), [post])
+        self.backend.remove_post(post.pk)
+        self.assertEqual(list(self.backend.search('статья')), [])
+
+    def test_sync_picks_up_changes_from_other_processes(self):
+        first = self.create('Первая', 'Текст')
+        second = self.create('Вторая', 'Текст')
+        self.assertEqual(list(self.backend.search('django')), [])
+        # изменения другого процесса: сигналы обновляют индекс только в нем, этот узнает о них из базы
+        first.tags.add('django') # меняются только теги
+        Post.objects.filter(pk=second.pk).delete()
+        self.backend.checked_at = 0 # интервал синхронизации истек
+        self.assertEqual(list(self.backend.search('django')), [first])
+        self.assertEqual(list(self.backend.search('вторая')), [])
+        self.backend.checked_at = 0
+        with self.assertNumQueries(4): # без изменений id всех статей не загружаются
+            self.backend.get_index()
+
+    def test_snapshot_warm_start(self):
+        first = self.create('Первая', 'Текст')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.pickle')
+            with override_settings(BLOG_SEARCH_INDEX_PATH=path):
+                self.backend.save_snapshot()
+                second = self.create('Вторая', 'Текст') # появилась после снимка
+                backend = InvertedIndexSearchBackend()
+                self.assertEqual(set(backend.search('текст')), {first, second})
+
+    def test_view_paginates_results(self):
+        for number in range(12):
+            self.create(f'Статья {number}', 'Текст')
+        reset_search_backends() # индекс общего бэкенда мог остаться от других тестов
+        with override_settings(BLOG_SEARCH_BACKEND='blog.search.memory.InvertedIndexSearchBackend'):
+            response = self.client.get(reverse('blog:post_search'), {'query': 'статья', 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['results'].paginator.count, 12)
+        self.assertEqual(len(response.context['results']), 2)
+
+
+@override_settings(BLOG_SITEMAP_SECTION_SIZE=2)
+class SitemapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user('author')
+        self.posts = [Post.objects.create(title=f'Статья {number}', slug=f'post-{number}', author=author,
+                                          body='', status='published') for number in range(5)]
+
+    def test_index_lists_sections(self):
+        response = self.client.get('/sitemap.xml')
+        sections = {post.id // 2 for post in self.posts}
+        for section in sections:
+            self.assertContains(response, reverse('blog_sitemap_section', args=[section]))
+
+    def test_section_is_cached_until_its_post_changes(self):
+        post, other = self.posts[0], self.posts[-1]
+        url = reverse('blog_sitemap_section', args=[post.id // 2])
+        other_url = reverse('blog_sitemap_section', args=[other.id // 2])
+        self.client.get(url)
+        self.client.get(other_url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), post.get_absolute_url())
+        post.slug = 'renamed'
+        post.save()
+        self.assertContains(self.client.get(url), '/renamed/')
+        with self.assertNumQueries(0): # раздел с другой статьей остался в кеше
+            self.client.get(other_url)
+
+    def test_tag_edit_updates_lastmod(self):
+        post = self.posts[0]
+        Post.objects.filter(pk=post.pk).update(updated=parse_datetime('2020-01-01T12:00:00+00:00'))
+        cache.clear()
+        url = reverse('blog_sitemap_section', args=[post.id // 2])
+        self.assertContains(self.client.get(url), '<lastmod>2020-01-01</lastmod>')
+        post.tags.add('django')
+        self.assertNotContains(self.client.get(url), '<lastmod>2020-01-01</lastmod>')
+        self.assertContains(self.client.get(url), f'<lastmod>{timezone.now().date().isoformat()}</lastmod>')
+
+    @override_settings(BLOG_LOCAL_CACHE_TIMEOUT=0.3)
+    def test_local_cache_expires(self):
+        url = reverse('blog_sitemap_section', args=[self.posts[0].id // 2])
+        self.client.get(url)
+        Post.objects.filter(pk=self.posts[0].pk).update(slug='other-process') # сигналы не доходят
+        self.assertNotContains(self.client.get(url), 'other-process')
+        time.sleep(0.4)
+        self.assertContains(self.client.get(url), 'other-process')
+
+    def test_gzip_negotiation(self):
+        url = reverse('blog_sitemap_section', args=[self.posts[0].id // 2])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'<urlset', gzip.decompress(response.content))
+
+    def test_etag_depends_on_encoding(self):
+        url = reverse('blog_sitemap_section', args=[self.posts[0].id // 2])
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        plain = self.client.get(url)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertTrue(compressed['ETag'].endswith('-gzip"'))
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                                         HTTP_IF_NONE_MATCH=compressed['ETag']).status_code, 304)
+        # несжатая копия из кеша клиента не подходит для ответа со сжатием, и наоборот
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=plain['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=compressed['ETag']).status_code, 200)
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0) # проверяется кеш лент, а не кеш страниц
+class FeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user('author')
+        self.posts = []
+        for number, tag in enumerate(['django', 'django', 'python']):
+            post = Post.objects.create(title=f'Статья {number}', slug=f'post-{number}', author=author,
+                                       body=f'Текст **статьи** {number}', status='published')
+            post.tags.add(tag)
+            self.posts.append(post)
+        self.draft = Post.objects.create(title='Черновик', slug='draft', author=author, body='', status='draft')
+        self.draft.tags.add('django')
+
+    def test_tag_feeds(self):
+        response = self.client.get(reverse('blog:post_feed_by_tag', args=['django']))
+        self.assertContains(response, '<rss')
+        self.assertContains(response, 'Статья 0')
+        self.assertNotContains(response, 'Статья 2')
+        self.assertNotContains(response, 'Черновик')
+        response = self.client.get(reverse('blog:post_feed_by_tag_atom', args=['python']))
+        self.assertContains(response, 'http://www.w3.org/2005/Atom')
+        self.assertContains(response, 'Статья 2')
+        self.assertEqual(self.client.get(reverse('blog:post_feed_by_tag', args=['missing'])).status_code, 404)
+
+    def test_feed_is_cached_until_its_post_changes(self):
+        django_url = reverse('blog:post_feed_by_tag', args=['django'])
+        python_url = reverse('blog:post_feed_by_tag', args=['python'])
+        for url in [reverse('blog:post_feed'), django_url, python_url]:
+            self.client.get(url)
+        with self.assertNumQueries(1): # только проверка, что тег существует
+            self.assertContains(self.client.get(django_url), 'Статья 1')
+        self.draft.title = 'Новый черновик'
+        self.draft.save()
+        with self.assertNumQueries(1): # черновики в ленты не попадают
+            self.client.get(django_url)
+        self.posts[1].title = 'Обновленная статья'
+        self.posts[1].save()
+        self.assertContains(self.client.get(django_url), 'Обновленная статья')
+        self.assertContains(self.client.get(reverse('blog:post_feed')), 'Обновленная статья')
+        with self.assertNumQueries(1): # лента другого тега осталась в кеше
+            self.client.get(python_url)
+        self.posts[2].tags.remove('python')
+        self.assertNotContains(self.client.get(python_url), 'Статья 2')
+
+    def test_renamed_and_deleted_tags(self):
+        old_url = reverse('blog:post_feed_by_tag', args=['django'])
+        self.assertContains(self.client.get(old_url), 'Статья 0')
+        tag = Tag.objects.get(slug='django')
+        tag.slug, tag.name = 'dj', 'Dj'
+        tag.save()
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+        self.assertContains(self.client.get(reverse('blog:post_feed_by_tag', args=['dj'])), 'Мой блог: Dj')
+        python_url = reverse('blog:post_feed_by_tag', args=['python'])
+        self.client.get(python_url)
+        Tag.objects.filter(slug='python').delete() # QuerySet.delete() тоже отправляет post_delete
+        self.assertEqual(self.client.get(python_url).status_code, 404)
+        self.assertIsNone(cache.get(feed_key('rss', 'python')))
+
+    @override_settings(BLOG_LOCAL_CACHE_TIMEOUT=0.3)
+    def test_local_cache_expires(self):
+        url = reverse('blog:post_feed')
+        self.client.get(url)
+        Post.objects.filter(pk=self.posts[0].pk).update(title='Правка другого процесса') # сигналы не доходят
+        self.assertNotContains(self.client.get(url), 'Правка другого процесса')
+        time.sleep(0.4)
+        self.assertContains(self.client.get(url), 'Правка другого процесса')
+
+    def test_full_content(self):
+        self.posts[2].body = 'слово ' * 40 + '\n\nКонец статьи'
+        self.posts[2].save()
+        url = reverse('blog:post_feed')
+        self.assertNotContains(self.client.get(url), 'Конец статьи') # анонс – первые 30 слов
+        with override_settings(BLOG_FEED_FULL_CONTENT=True): # смена режима перестраивает ленту в кеше
+            self.assertContains(self.client.get(url), '&lt;p&gt;Конец статьи&lt;/p&gt;')
+
+
+class GetOrBuildTests(TestCase):
+    '''защита от набега в get_or_build (кеш в памяти процесса из настроек проекта)'''
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def builder(self, value, delay=0):
+        def build():
+            self.calls.append(value)
+            time.sleep(delay)
+            return value
+        return build
+
+    def test_single_builder_on_cold_key(self):
+        key = versioned_key('test', 'cold')
+        barrier = threading.Barrier(5)
+        results = []
+
+        def request():
+            barrier.wait() # все потоки обращаются к холодному ключу одновременно
+            results.append(get_or_build(key, self.builder('значение', delay=0.3)))
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, ['значение']) # остальные дождались результата первого
+        self.assertEqual(results, ['значение'] * 5)
+        self.assertIsNone(cache.get(key + ':lock'))
+
+    def test_stale_value_served_while_refreshing(self):
+        key = versioned_key('test', 'stale')
+        cache.set(key, (time.time() - 1, 'старое'), 60) # значение устарело
+        cache.add(key + ':lock', 1, 10) # и его уже обновляет другой процесс
+        self.assertEqual(get_or_build(key, self.builder('новое')), 'старое')
+        self.assertEqual(self.calls, [])
+        cache.delete(key + ':lock') # блокировка снята – значение обновляется
+        self.assertEqual(get_or_build(key, self.builder('новое')), 'новое')
+        self.assertEqual(get_or_build(key, self.builder('еще новее')), 'новое') # свежее значение из кеша
+        self.assertEqual(self.calls, ['новое'])
+
+    def test_version_bump_invalidates(self):
+        self.assertEqual(get_or_build(versioned_key('test', 'version'), self.builder('первое')), 'первое')
+        self.assertEqual(get_or_build(versioned_key('test', 'version'), self.builder('второе')), 'первое')
+        bump_content_version()
+        self.assertEqual(get_or_build(versioned_key('test', 'version'), self.builder('второе')), 'второе')
+        self.assertEqual(self.calls, ['первое', 'второе'])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='Статья', slug='post', author=author, body='', status='published')
+
+    def test_not_modified_until_content_changes(self):
+        self.client.get(self.post.get_absolute_url()) # страница с формой выдает CSRF-cookie, которая входит в ETag
+        for url in [reverse('blog:post_list'), self.post.get_absolute_url(), reverse('blog:post_feed'),
+                    reverse('blog_sitemap_index')]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.status_code, 304)
+            cached = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(cached.status_code, 304)
+
+        etag = self.client.get(self.post.get_absolute_url())['ETag']
+        Comment.objects.create(post=self.post, name='Читатель', email='reader@example.com', body='Текст')
+        response = self.client.get(self.post.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_csrf_cookie_changes_etag(self):
+        url = self.post.get_absolute_url()
+        response = self.client.get(url)
+        self.assertIn('csrftoken', response.cookies)
+        response = self.client.get(url) # ETag для посетителя с полученной cookie
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.client.cookies['csrftoken'] = 'x' * 64 # cookie сменилась, токен в закешированной форме устарел
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'csrfmiddlewaretoken') # форма с токеном для новой cookie
+
+    def test_last_modified_survives_cache_eviction(self):
+        cache.clear()
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertIn('Last-Modified', response)
+
+    def test_validator_never_goes_back_after_delete_and_eviction(self):
+        now = timezone.now()
+        newest = Post.objects.create(title='Новая статья', slug='newest', author=self.post.author,
+                                     body='', status='published')
+        Post.objects.filter(pk=self.post.pk).update(updated=now - timedelta(hours=3))
+        Post.objects.filter(pk=newest.pk).update(updated=now - timedelta(hours=1))
+        cache.set(LAST_MODIFIED_KEY, now - timedelta(hours=1), None)
+        url = reverse('blog:post_feed')
+        last_modified = self.client.get(url)['Last-Modified']
+        newest.delete()
+        cache.delete(LAST_MODIFIED_KEY) # ключ вытеснен из кеша
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Новая статья')
+
+
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', password='secret')
+        self.post = create_posts(self.author, 1)[0]
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for url in [reverse('blog:post_list'), self.post.get_absolute_url()]:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, self.post.title)
+
+        # новый комментарий меняет версию контента, и страница строится заново
+        Comment.objects.create(post=self.post, name='Читатель', email='reader@example.com', body='Новый отзыв')
+        self.assertContains(self.client.get(self.post.get_absolute_url()), 'Новый отзыв')
+
+    def test_csrf_token_is_personal(self):
+        url = self.post.get_absolute_url()
+        self.client.get(url) # страница попадает в кеш с токеном другого посетителя
+        client = self.client_class(enforce_csrf_checks=True)
+        response = client.get(url)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        self.assertIn('csrftoken', response.cookies)
+        response = client.post(url, {'csrfmiddlewaretoken': token, 'name': 'Читатель',
+                                     'email': 'reader@example.com', 'body': 'Текст'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.post.comments.count(), 3)
+
+    @override_settings(BLOG_LOCAL_CACHE_TIMEOUT=0.3)
+    def test_local_cache_expires_changes_from_other_processes(self):
+        cache.clear() # версия контента, записанная в setUp, – с обычным сроком жизни
+        url = self.post.get_absolute_url()
+        self.client.get(url)
+        # правка, сделанная другим процессом: его версия контента в этот кеш процесса не попадает
+        Post.objects.filter(pk=self.post.pk).update(title='Заголовок из другого процесса')
+        self.assertNotContains(self.client.get(url), 'Заголовок из другого процесса')
+        time.sleep(0.4)
+        self.assertContains(self.client.get(url), 'Заголовок из другого процесса')
+
+    def test_shared_cache_keeps_version_without_timeout(self):
+        self.assertEqual(invalidation_timeout(), 60)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertIsNone(invalidation_timeout())
+
+    def test_authenticated_users_bypass_cache(self):
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        self.client.login(username='author', password='secret')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries.captured_queries)
+
+
+class PaginatorTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user('author')
+        publish = timezone.now()
+        # у статей 1–3 одинаковое время публикации, и одна из групп равных попадает на границу страниц
+        for number, hours in enumerate([0, 1, 1, 1, 2, 3, 4]):
+            Post.objects.create(title=f'Статья {number}', slug=f'post-{number}', author=author, body='Текст',
+                                status='published', publish=publish - timedelta(hours=hours))
+        self.expected = list(Post.published.order_by('-publish', '-id').values_list('id', flat=True))
+
+    def test_keyset_round_trip_with_ties(self):
+        paginator = KeysetPaginator(Post.published.all(), 2)
+        page = paginator.page()
+        pages = [page]
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append(page)
+        self.assertEqual([[post.id for post in page] for page in pages],
+                         [self.expected[start:start + 2] for start in range(0, 7, 2)])
+        self.assertEqual([page.number for page in pages], [1, 2, 3, 4])
+        self.assertEqual([page.start_index() for page in pages], [1, 3, 5, 7])
+        self.assertFalse(pages[0].has_previous())
+
+        backwards = [page]
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            backwards.append(page)
+        self.assertEqual([[post.id for post in page] for page in reversed(backwards)],
+                         [[post.id for post in page] for page in pages])
+        self.assertEqual([page.number for page in backwards], [4, 3, 2, 1]) # номер страницы хранится в курсоре
+        self.assertTrue(backwards[-1].has_next())
+
+    def test_tampered_cursor_opens_first_page(self):
+        paginator = KeysetPaginator(Post.published.all(), 2)
+        cursor = paginator.page().next_cursor
+        for tampered in [cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'), 'garbage', signing.dumps([['x'], True, 5])]:
+            page = paginator.page(tampered)
+            self.assertEqual(page.number, 1)
+            self.assertEqual([post.id for post in page], self.expected[:2])
+            self.assertFalse(page.has_previous())
+
+    def test_counted_paginator_uses_known_count(self):
+        paginator = CountedPaginator(Post.published.order_by('-publish', '-id'), 2, count=7)
+        with self.assertNumQueries(0):
+            self.assertEqual(paginator.num_pages, 4)
+        self.assertEqual([post.id for post in paginator.page(4)], self.expected[6:])
+
+
+@override_settings(BLOG_COMMENTS_PER_PAGE=3)
+class CommentPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.post = create_posts(User.objects.create_user('author'), 1)[0] # два комментария
+        for number in range(3, 8):
+            Comment.objects.create(post=self.post, name=f'Читатель {number}', email='reader@example.com', body='Текст')
+
+    def test_comments_are_loaded_page_by_page(self):
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual(len(response.context['comments']), 3)
+        self.assertNotContains(response, 'Читатель 4,')
+        url = response.context['next_comments_url']
+        pages = []
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page['html'])
+            url = page['next']
+        self.assertEqual(len(pages), 2)
+        self.assertIn('4. Читатель 4,', pages[0]) # нумерация продолжается
+        self.assertIn('7. Читатель 7,', pages[1])
+
+    @override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+    def test_detail_queries_do_not_depend_on_comment_count(self):
+        url = self.post.get_absolute_url()
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        for number in range(20):
+            Comment.objects.create(post=self.post, name='Читатель', email='reader@example.com', body='Текст')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url)
+        self.assertEqual(len(before), len(after))
+
+
+async def slow_view(request):
+    await asyncio.sleep(0.3) # например, ожидание внешнего сервиса
+    return HttpResponse('ok')
+
+
+class SlowURLConf:
+    urlpatterns = [path('slow/', slow_view)]
+
+
+class AsyncViewsTests(TransactionTestCase):
+    '''асинхронные обработчики выполняют запросы в других потоках,
+    поэтому данные должны быть зафиксированы (TransactionTestCase)'''
+
+    def setUp(self):
+        cache.clear()
+        self.post = create_posts(User.objects.create_user('author'), 4)[0]
+        rebuild_similar_posts()
+
+    def get(self, view, url, *args, **headers):
+        return async_to_sync(view)(RequestFactory().get(url, **headers), *args)
+
+    def test_pages_render_like_sync_views(self):
+        detail = self.get(async_views.post_detail, self.post.get_absolute_url(), self.post.publish.year,
+                          self.post.publish.month, self.post.publish.day, self.post.slug)
+        self.assertContains(detail, self.post.title)
+        self.assertContains(detail, 'Комментарий')
+        self.assertContains(detail, 'tag-1')
+        self.assertContains(detail, 'Рекомендованные статьи')
+        listing = self.get(async_views.post_list, '/blog/')
+        self.assertContains(listing, 'Статья 3')
+        self.assertContains(self.get(async_views.post_list, '/blog/tag/tag-0/', 'tag-0'), 'Статья 3')
+        self.assertContains(self.get(async_views.post_search, '/blog/search/?query=статья'), 'Статья 3')
+
+        response = self.get(async_views.post_list, '/blog/', HTTP_IF_NONE_MATCH=listing['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(ROOT_URLCONF=SlowURLConf)
+    def test_middleware_does_not_serialize_requests(self):
+        '''с синхронным промежуточным слоем Django выполнял бы всю цепочку в одном потоке,
+        и пять запросов заняли бы не меньше 1,5 секунды'''
+        target = ASGITarget('testserver')
+
+        async def requests():
+            return await asyncio.gather(*[target.request('GET', '/slow/', b'', []) for _ in range(5)])
+        started = time.perf_counter()
+        responses = async_to_sync(requests)()
+        self.assertEqual([status for status, _, _ in responses], [200] * 5)
+        self.assertLess(time.perf_counter() - started, 1.0)
+
+
+class PrerenderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.posts = create_posts(User.objects.create_user('author'), 8, tags_per_post=1)
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+
+    def read(self, path):
+        with open(os.path.join(self.output, path), encoding='utf-8') as file:
+            return file.read()
+
+    def test_incremental_build(self):
+        rendered, removed, total, failed = prerender(self.output, jobs=1)
+        self.assertEqual((rendered, removed, failed), (total, 0, []))
+        detail = self.posts[0].get_absolute_url().lstrip('/') + 'index.html'
+        self.assertIn('Статья 0', self.read(detail))
+        self.assertIn('Статья 7', self.read('blog/index.html'))
+        self.assertIn('Статья 4', self.read('blog/page/2/index.html'))
+        self.assertIn('<rss', self.read('blog/feed/index.xml'))
+        self.assertIn('<sitemapindex', self.read('sitemap.xml'))
+        self.assertEqual(prerender(self.output, jobs=1)[0], 0) # ничего не изменилось
+
+        # старая статья не попадает в боковую панель, поэтому остальные страницы не перерендериваются
+        self.posts[0].title = 'Обновленная статья'
+        self.posts[0].save()
+        rendered, _, total, _ = prerender(self.output, jobs=1)
+        self.assertLess(rendered, total)
+        self.assertIn('Обновленная статья', self.read(detail))
+
+        self.posts[0].delete()
+        self.assertEqual(prerender(self.output, jobs=1)[1], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.output, detail)))
+
+    def test_forms_get_visitor_token(self):
+        prerender(self.output, jobs=1)
+        html = self.read(self.posts[0].get_absolute_url().lstrip('/') + 'index.html')
+        self.assertIn('name="csrfmiddlewaretoken" value=""', html) # токен сборки не записан
+        client = Client(enforce_csrf_checks=True) # посетитель статической страницы без CSRF-cookie
+        token = client.get(reverse('blog:csrf_token')).json()['token']
+        response = client.post(self.posts[0].get_absolute_url(), {'name': 'Читатель', 'email': 'reader@example.com',
+                                                                   'body': 'Со статической страницы',
+                                                                   'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Comment.objects.filter(body='Со статической страницы').exists())
+
+
+class BenchmarkTests(TestCase):
+    def test_seed_and_measure(self):
+        seed_blog(30, 60, 8)
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertEqual(Comment.objects.count(), 60)
+        self.assertTrue(Post.objects.filter(body_html__contains='<strong>').exists())
+        results = run_benchmark([30, 40], repeat=2)
+        self.assertEqual([run['posts'] for run in results['runs']], [30, 40])
+        detail = results['runs'][0]['views']['post_detail']
+        self.assertLessEqual(detail['queries'], ViewQueryBudgetTests.DETAIL_BUDGET)
+        self.assertLessEqual(detail['p50'], detail['p99'])
+
+        worse = {'runs': [{'posts': 30, 'views': {'post_detail': dict(detail, queries=detail['queries'] + 1)}}]}
+        self.assertTrue(compare(results, worse)[0][-1])
+        self.assertFalse(compare(results, results)[0][-1])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.post = create_posts(User.objects.create_user('author'), 1)[0]
+
+    @override_settings(BLOG_SERVER_TIMING=True, BLOG_PAGE_CACHE_TIMEOUT=0)
+    def test_request_metrics(self):
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('total_posts;dur=', response['Server-Timing'])
+        metrics = self.client.get(reverse('blog_metrics')).content.decode()
+        self.assertIn('blog_request_duration_seconds_count{view="blog:post_detail"}', metrics)
+        self.assertIn('blog_db_queries_total{view="blog:post_detail"}', metrics)
+        self.assertIn('blog_section_calls_total{view="blog:post_detail",section="show_latest_posts"}', metrics)
+        self.assertIn('blog_cache_requests_total{cache="sidebar:total_posts",result="miss"}', metrics)
+
+    def test_endpoint_is_restricted(self):
+        response = self.client.get(reverse('blog_metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as file:
+            file.write(content)
+
+    def test_import_markdown_and_jsonl(self):
+        Post.objects.create(title='Заметка', slug='zametka', author=self.author, body='Текст',
+                            publish=parse_datetime('2021-03-01T12:00:00+00:00'))
+        self.write('first.md', '---\ntitle: Первая статья\npublish: 2021-03-01 10:00\ntags: [django, python]\n---\n'
+                               'Текст **первой** статьи')
+        records = [{'title': 'Заметка', 'body': f'Текст {number}', 'publish': '2021-03-01T09:00:00',
+                    'tags': ['python'] if number % 2 else ['новости']} for number in range(5)]
+        records.append({'title': 'Без текста'})
+        self.write('posts.jsonl', '\n'.join(json.dumps(record, ensure_ascii=False) for record in records))
+
+        created, skipped = import_posts(read_records([self.directory]), self.author, batch_size=2)
+        self.assertEqual((created, skipped), (6, 1))
+        first = Post.published.get(slug='first')
+        self.assertIn('<strong>первой</strong>', first.body_html)
+        self.assertEqual(sorted(first.tags.names()), ['django', 'python'])
+        slugs = sorted(Post.objects.filter(title='Заметка').values_list('slug', flat=True))
+        self.assertEqual(slugs, ['zametka', 'zametka-2', 'zametka-3', 'zametka-4', 'zametka-5', 'zametka-6'])
+        self.assertEqual(Post.objects.filter(tags__name='python').count(), 3)
+        self.assertTrue(Post.objects.filter(tags__slug='novosti').exists())
+
+    def test_suffixes_inside_batch_and_existing_posts(self):
+        Post.objects.create(title='Foo', slug='foo', author=self.author, body='Текст',
+                            publish=parse_datetime('2021-03-01T23:30:00+00:00'))
+        Post.objects.create(title='Foo', slug='foo-3', author=self.author, body='Текст',
+                            publish=parse_datetime('2021-03-02T00:30:00+00:00')) # другой день – не мешает
+        records = [{'title': 'Foo', 'slug': 'foo-2', 'body': 'Текст', 'publish': '2021-03-01T10:00:00'},
+                   {'title': 'Foo', 'body': 'Текст', 'publish': '2021-03-01T11:00:00'},
+                   {'title': 'Foo', 'body': 'Текст', 'publish': '2021-03-01T12:00:00'}]
+        self.assertEqual(import_posts(records, self.author), (3, 0))
+        self.assertEqual(sorted(Post.objects.filter(publish__date='2021-03-01').values_list('slug', flat=True)),
+                         ['foo', 'foo-2', 'foo-3', 'foo-4'])
+
+    def test_malformed_jsonl_lines_are_reported(self):
+        self.write('posts.jsonl', '{"title": "Первая", "body": "Текст"}\n{"title": "Обрыв\n'
+                                  '["список"]\n{"title": "Вторая", "body": "Текст"}\n')
+        errors = []
+        created, skipped = import_posts(read_records([self.directory]), self.author,
+                                        on_error=lambda number, error: errors.append(number))
+        self.assertEqual((created, skipped, errors), (2, 2, [2, 3]))
+
+    def test_many_publish_days_in_one_batch(self):
+        start = parse_datetime('2000-01-01T10:00:00+00:00')
+        Post.objects.create(title='Foo', slug='foo', author=self.author, body='Текст', publish=start)
+        records = [{'title': 'Foo', 'body': 'Текст', 'publish': (start + timedelta(days=day)).isoformat()}
+                   for day in range(1200)] # одно условие на весь диапазон дней, а не по условию на день
+        self.assertEqual(import_posts(records, self.author), (1200, 0))
+        self.assertEqual(Post.objects.filter(slug='foo-2').count(), 1)
+        self.assertEqual(Post.objects.filter(slug='foo').count(), 1200)
+
+    def test_invalid_status_is_reported(self):
+        errors = []
+        records = [{'title': 'Статья', 'body': 'Текст', 'status': 'archived'},
+                   {'title': 'Черновик', 'body': 'Текст', 'status': 'draft'}]
+        created, skipped = import_posts(records, self.author, on_error=lambda number, error: errors.append(number))
+        self.assertEqual((created, skipped, errors), (1, 1, [1]))
+        self.assertEqual(Post.objects.get().status, 'draft')
+        self.assertEqual(import_posts([{'title': 'Статья', 'body': 'Текст'}], self.author, status='hidden'), (0, 1))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.old = Post.objects.create(title='Старая', slug='old', author=self.author, body='Текст', status='published')
+        self.old.tags.add('django')
+        self.new = Post.objects.create(title='Новая', slug='new', author=self.author, body='Текст')
+        Comment.objects.create(post=self.old, name='Читатель', email='reader@example.com', body='Спасибо')
+
+    def test_records_contain_tags_and_comments(self):
+        records = list(export_records(chunk_size=1))
+        self.assertEqual([record['slug'] for record in records], ['old', 'new'])
+        self.assertEqual(records[0]['tags'], ['django'])
+        self.assertEqual(records[0]['author'], 'author')
+        self.assertEqual([comment['body'] for comment in records[0]['comments']], ['Спасибо'])
+        self.assertEqual(records[1]['comments'], [])
+
+    def test_incremental_export_includes_posts_with_new_comments(self):
+        since = max(Post.objects.latest('updated').updated, Comment.objects.latest('updated').updated)
+        self.assertEqual(list(export_records(since)), [])
+        Post.objects.filter(pk=self.old.pk).update(updated=since) # комментарий изменился, а статья – нет
+        Comment.objects.create(post=self.old, name='Читатель', email='reader@example.com', body='Еще раз')
+        self.assertEqual([record['slug'] for record in export_records(since)], ['old'])
+
+    def test_streaming_endpoint(self):
+        url = reverse('blog:post_export')
+        self.assertEqual(self.client.get(url).status_code, 302) # только для персонала
+        self.client.login(username='staff', password='secret')
+        response = self.client.get(url, {'gzip': 1})
+        self.assertTrue(response.streaming)
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['slug'] for line in lines], ['old', 'new'])
+        self.assertEqual(self.client.get(url, {'since': 'вчера'}).status_code, 400)
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class LoadTestTests(TransactionTestCase):
+    '''посетители-потоки (wsgi) работают со своими соединениями с базой, поэтому нужны
+    зафиксированные данные, а не транзакция TestCase'''
+
+    def setUp(self):
+        cache.clear()
+        create_posts(User.objects.create_user('author'), 5, tags_per_post=1)
+        rebuild_tag_index()
+
+    def test_wsgi_reads(self):
+        plan = LoadPlan(parse_mix('list=1,detail=1,tag=1,search=1'))
+        report = run_load(WSGITarget('testserver'), plan, concurrency=3, requests=30)
+        self.assertEqual(report['requests'], 30)
+        self.assertEqual(report['statuses'], {200: 30})
+        self.assertEqual(sum(result['requests'] for result in report['kinds'].values()), 30)
+        self.assertIn('p99', report['latency'])
+        self.assertGreater(report['db']['queries'], 0)
+        self.assertIn('blog:post_detail', report['db']['queries_per_request'])
+
+    def test_asgi_posts_with_csrf(self):
+        plan = LoadPlan(parse_mix('comment=1,share=1'))
+        report = run_load(ASGITarget('testserver'), plan, concurrency=2, requests=10)
+        self.assertEqual(report['errors'], 0) # без CSRF-токена ответы были бы 403
+        self.assertEqual(Comment.objects.filter(name='Нагрузка').count(), report['kinds']['comment']['requests'])
+        self.assertEqual(OutboxMessage.objects.count(), report['kinds']['share']['requests'])
+
+    def test_metrics_parsing(self):
+        self.client.get(reverse('blog:post_list'))
+        snapshot = registry_snapshot()
+        self.assertEqual(parse_metrics(self.client.get(reverse('blog_metrics')).content.decode())['queries'],
+                         snapshot['queries'])
+        with self.assertRaises(ValueError):
+            parse_mix('list=1,unknown=1')
+
+
+@override_settings(BLOG_READ_REPLICAS=['replica'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.factory = RequestFactory()
+
+    def handle(self, request, view):
+        '''выполняет view внутри ReplicaPinMiddleware; возвращает (ответ, базы, из которых читались данные)'''
+        databases = []
+
+        def get_response(request):
+            databases.append(Post.objects.all().db) # база для чтения определяется маршрутизатором
+            view()
+            databases.append(Post.objects.all().db)
+            return HttpResponse()
+        return ReplicaPinMiddleware(get_response)(request), databases
+
+    def test_reads_go_to_replica_until_write(self):
+        response, databases = self.handle(self.factory.post('/'), lambda: Post.objects.create(
+            title='Статья', slug='post', author=self.author, body='Текст'))
+        self.assertEqual(databases, ['replica', 'default']) # после записи чтения идут в основную базу
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+
+        self.factory.cookies[PIN_COOKIE] = '1'
+        response, databases = self.handle(self.factory.get('/'), lambda: None)
+        self.assertEqual(databases, ['default', 'default']) # посетитель закреплен за основной базой
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_outside_requests_and_other_apps_use_primary(self):
+        self.assertEqual(Post.objects.all().db, 'default')
+        databases = []
+        self.handle(self.factory.get('/'), lambda: databases.append(User.objects.all().db))
+        self.assertEqual(databases, ['default'])
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class ReplicaDatabaseTests(TransactionTestCase):
+    '''две базы SQLite: основная (тестовая) и "реплика" во временном файле,
+    в которую изменения попадают только при явном копировании'''
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3',
+                                            'NAME': os.path.join(directory, 'replica.sqlite3')}
+        connections.ensure_defaults('replica')
+        connections.prepare_test_settings('replica')
+        self.addCleanup(self.remove_replica)
+        call_command('migrate', database='replica', verbosity=0)
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='Статья', slug='post', author=author, body='Текст', status='published')
+        self.replicate(User, Post)
+
+    def remove_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def replicate(self, *models):
+        for model in models:
+            model.objects.using('replica').bulk_create(model.objects.using('default').all())
+
+    def test_writer_reads_own_comment_while_replica_lags(self):
+        url = self.post.get_absolute_url()
+        with self.settings(BLOG_READ_REPLICAS=['replica']):
+            Post.objects.using('replica').filter(pk=self.post.pk).update(title='Статья с реплики')
+            self.assertContains(self.client.get(url), 'Статья с реплики') # чтение идет с реплики
+
+            writer = Client()
+            response = writer.post(url, {'name': 'Читатель', 'email': 'reader@example.com', 'body': 'Мой комментарий'})
+            self.assertIn(PIN_COOKIE, response.cookies)
+            self.assertContains(writer.get(url), 'Мой комментарий') # закреплен за основной базой
+            self.assertNotContains(Client().get(url), 'Мой комментарий') # остальные читают с отстающей реплики
+
+            self.replicate(Comment)
+            self.assertContains(Client().get(url), 'Мой комментарий')
+
+    def test_sitemap_from_lagging_replica_is_not_cached(self):
+        with self.settings(BLOG_READ_REPLICAS=['replica']):
+            self.client.get('/sitemap.xml') # индекс закеширован
+            post = Post.objects.create(title='Новая статья', slug='new', author=self.post.author,
+                                       body='Текст', status='published') # индекс удален из кеша
+            url = reverse('blog_sitemap_section', args=[post.id // section_size()])
+            self.assertNotContains(self.client.get(url), post.get_absolute_url()) # реплика еще отстает
+            Post.objects.using('replica').bulk_create(Post.objects.using('default').filter(pk=post.pk))
+            self.assertContains(self.client.get(url), post.get_absolute_url())
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(STATIC_ROOT=directory, BLOG_PAGE_CACHE_TIMEOUT=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.url = staticfiles_storage.url('css/blog.css')
+        with open(os.path.join(os.path.dirname(__file__), 'static', 'css', 'blog.css'), 'rb') as file:
+            self.content = file.read()
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_pages_link_hashed_files(self):
+        self.assertRegex(self.url, r'^/static/css/blog\.[0-9a-f]{12}\.css$')
+        self.assertContains(self.get(reverse('blog:post_list')), self.url)
+
+    def test_precompressed_variant_is_negotiated(self):
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.content)
+
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(self.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    @unittest.skipUnless(brotli, 'пакет brotli не установлен')
+    def test_brotli_is_preferred(self):
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(b''.join(response.streaming_content)), self.content)
+
+    def test_unhashed_and_missing_files(self):
+        self.assertEqual(self.get('/static/css/blog.css')['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self.get('/static/css/missing.css').status_code, 404)
+        self.assertEqual(self.get('/static/../manage.py').status_code, 404)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('SMTP-сервер недоступен')
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    '''ведет себя как SMTP-бэкенд: send_messages() без открытого соединения открывает
+    и закрывает собственное; считает открытия и закрытия соединения'''
+    fail_on = ()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.connected = False
+        self.opened = self.closed = self.sent = 0
+
+    def open(self):
+        if self.connected:
+            return False
+        self.connected = True
+        self.opened += 1
+        return True
+
+    def close(self):
+        if self.connected:
+            self.connected = False
+            self.closed += 1
+
+    def send_messages(self, email_messages):
+        new_connection = self.open()
+        try:
+            self.sent += 1
+            if self.sent in self.fail_on:
+                raise ConnectionResetError('соединение разорвано')
+            return super().send_messages(email_messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user('author')
+        self.post = create_posts(author, 1)[0]
+
+    def share(self):
+        return self.client.post(reverse('blog:post_share', args=[self.post.id]),
+                                {'name': 'Читатель', 'email': 'reader@example.com', 'to': 'friend@example.com'})
+
+    def test_share_only_queues_message(self):
+        self.assertContains(self.share(), 'успешно')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(send_outbox(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['friend@example.com'])
+        self.assertIsNotNone(OutboxMessage.objects.get().sent_at)
+        self.assertEqual(send_outbox(), (0, 0)) # отправленные письма не отправляются повторно
+
+    def test_failed_messages_are_retried_with_backoff(self):
+        self.share()
+        with override_settings(EMAIL_BACKEND='blog.tests.FailingEmailBackend'):
+            self.assertEqual(send_outbox(), (0, 1))
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('ConnectionRefusedError', message.last_error)
+        self.assertEqual(send_outbox(), (0, 0)) # время следующей попытки еще не наступило
+        OutboxMessage.objects.update(next_attempt=message.created)
+        self.assertEqual(send_outbox(), (1, 0))
+
+    def test_one_connection_for_all_messages(self):
+        for _ in range(3):
+            self.share()
+        connection = CountingEmailBackend()
+        self.assertEqual(send_outbox(connection=connection), (3, 0))
+        self.assertEqual((connection.opened, connection.closed), (1, 1))
+
+        OutboxMessage.objects.update(sent_at=None)
+        connection = CountingEmailBackend()
+        connection.fail_on = (2,) # после ошибки соединение открывается заново
+        self.assertEqual(send_outbox(connection=connection), (2, 1))
+        self.assertEqual((connection.opened, connection.closed), (2, 2))
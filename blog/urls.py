@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path, re_path
-from . import views
-from .feeds import LatestPostsFeed
+from . import views, async_views
+from .feeds import LatestPostsFeed, AtomLatestPostsFeed, TagPostsFeed, AtomTagPostsFeed
+from .conditional import conditional_content
 '''
     Шаблоны URL’ов позволяют сопоставить адреса с обработчиками.
 Шаблон представляет собой комбинацию:
@@ -22,16 +24,30 @@ app_name = 'blog' # определили пространство имен пр
                   # это позволяет сгруппировать адреса для приложения блога и 
                   # использовать их названия для доступа к ним
 
+# под ASGI обработчики чтения можно заменить асинхронными (см. async_views.py)
+read_views = async_views if getattr(settings, 'BLOG_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
-    path('', views.post_list, name='post_list'), # вызовет post_list без дополнительных аргументов
-    path('tag/<slug:tag_slug>/', views.post_list, name='post_list_by_tag'), # будет передавать аргумент tag_slug
+    path('', read_views.post_list, name='post_list'), # вызовет post_list без дополнительных аргументов
+    path('tag/<slug:tag_slug>/', read_views.post_list, name='post_list_by_tag'), # будет передавать аргумент tag_slug
                                                                             # используем преобразователь slug, для того чтобы ограничить
                                                                             # возможные символы URL’а в качестве тега (могут быть использованы
                                                                             # только прописные буквы, числа, нижние подчеркивания и дефисы)
-    path('<int:year>/<int:month>/<int:day>/<slug:post>/', views.post_detail, name='post_detail'),
+    path('tags/', views.tag_cloud, name='tag_cloud'), # облако тегов по материализованным счетчикам
+    path('archive/', views.post_archive, name='post_archive'), # архив: годы, месяцы и дни с количеством статей
+    path('<int:year>/', views.post_archive, name='post_archive_year'),
+    path('<int:year>/<int:month>/', views.post_archive, name='post_archive_month'),
+    path('<int:year>/<int:month>/<int:day>/', views.post_archive, name='post_archive_day'),
+    path('<int:year>/<int:month>/<int:day>/<slug:post>/', read_views.post_detail, name='post_detail'),
     path('<int:post_id>/share', views.post_share, name='post_share'),
-    path('feed/', LatestPostsFeed(), name='post_feed'),
-    path('search/', views.post_search, name='post_search'),
+    path('<int:post_id>/comments/', views.post_comments, name='post_comments'), # следующие страницы комментариев (JSON)
+    path('feed/', conditional_content(LatestPostsFeed()), name='post_feed'), # агрегаторы получают 304, если статьи не менялись
+    path('feed/atom/', conditional_content(AtomLatestPostsFeed()), name='post_feed_atom'),
+    path('tag/<slug:tag_slug>/feed/', conditional_content(TagPostsFeed()), name='post_feed_by_tag'), # ленты статей с тегом
+    path('tag/<slug:tag_slug>/feed/atom/', conditional_content(AtomTagPostsFeed()), name='post_feed_by_tag_atom'),
+    path('search/', read_views.post_search, name='post_search'),
+    path('export/', views.post_export, name='post_export'), # потоковая выгрузка для персонала (см. export.py)
+    path('csrf/', views.csrf_token, name='csrf_token'), # токен для форм статических страниц (см. prerender.py)
 ]
 
 # Примечание
@@ -16,73 +16,167 @@
 многократно используемых обработчиков (их часто называют примеся-
 ми, или миксинами).
 '''
+import math
 from django.shortcuts import render, get_object_or_404
-from .models import Post, Comment
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import never_cache
+from django.utils.http import urlencode
+from django.conf import settings
+from .models import Post, Comment, OutboxMessage, PostTag, TagStat
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from .pagination import CountedPaginator, KeysetPaginator
 from django.views.generic import ListView
 from .forms import EmailPostForm, CommentForm, SearchForm
-from django.core.mail import send_mail
 from taggit.models import Tag
-from django.db.models import Count # функция агрегации Count из Django;
-                                   # позволяет выполнять агрегирующий запрос
-                                   # для подсчета количества тегов на уровне
-                                   # базы данных. Cодержит еще функции:
-                                   #  Avg – среднее значение;
-                                   #  Max – максимальное значение;
-                                   #  Min – минимальное значение;
-                                   #  Count – количество объектов.
-from django.contrib.postgres.search import SearchVector # класс для полнотекстового поиска по нескольким полям
-from django.contrib.postgres.search import SearchQuery, SearchRank # Класс SearchQuery предназначен для преобразования фраз в объект поискового запроса;
-                                                                   # по умолчанию все фразы пропускаются через алгоритм стемминга, который помогает получить больше совпадений.
-                                                                   # Класс SearchRank сортирует результаты на основе того, как часто встречаются фразы поиска и как близко друг к другу они находятся
-from django.contrib.postgres.search import TrigramSimilarity # для поиска текста по сходству триграмм;
-                                                             # Чтобы использовать триграммы в PostgerSQL, необходимо подключить расширение pg_trgm;
-                                                             # Требовалось выполнить команду для входа в консоль PostgreSQL: "psql blog";
-                                                             # затем установить расширение pg_trgm, выполнив следующую команду: "CREATE EXTENSION pg_trgm;"
+from .conditional import conditional_content # ответ 304 Not Modified, если контент не менялся (см. conditional.py)
+from .archive import day_counts, period_counts, period_range
+from .export import export_lines, gzip_stream, parse_since # потоковая выгрузка статей (см. export.py)
+from .search import get_search_backend # поисковый бэкенд выбирается настройкой BLOG_SEARCH_BACKEND (см. search/__init__.py)
 
+POSTS_PER_PAGE = 3 # количество статей на странице списка
+TAG_CLOUD_SIZE = 100 # количество тегов в облаке
+
+
+def use_keyset_pagination(request):
+    '''курсорная навигация используется, если в запросе передан cursor или
+    она включена настройкой BLOG_PAGINATION = 'keyset' (старые ссылки ?page=N продолжают работать)'''
+    if 'cursor' in request.GET:
+        return True
+    return getattr(settings, 'BLOG_PAGINATION', 'offset') == 'keyset' and 'page' not in request.GET
+
+
+def comment_page(post_id, cursor=None):
+    '''страница активных комментариев статьи по курсору (created, id);
+    номер страницы в курсоре позволяет продолжить нумерацию комментариев'''
+    comments = Comment.objects.filter(post_id=post_id, active=True)
+    per_page = getattr(settings, 'BLOG_COMMENTS_PER_PAGE', 20)
+    return KeysetPaginator(comments, per_page, ordering=('created', 'id')).page(cursor)
+
+
+def next_comments_url(post_id, comments):
+    '''адрес следующей страницы комментариев или None'''
+    if not comments.has_next():
+        return None
+    return f"{reverse('blog:post_comments', args=[post_id])}?{urlencode({'cursor': comments.next_cursor})}"
+
+
+def paginate_posts(request, object_list, ordering=('-publish', '-id'), count=None):
+    '''страница статей по курсору или по номеру (см. use_keyset_pagination);
+    count – заранее известное количество строк (тогда COUNT(*) не выполняется)'''
+    if use_keyset_pagination(request):
+        # постраничный вывод по курсору (publish, id): глубокие страницы стоят столько же, сколько первая
+        return KeysetPaginator(object_list, POSTS_PER_PAGE, ordering).page(request.GET.get('cursor'))
+    if count is None:
+        paginator = Paginator(object_list, POSTS_PER_PAGE) # по 3 статьи на странице
+    else:
+        paginator = CountedPaginator(object_list.order_by(*ordering), POSTS_PER_PAGE, count)
+    try:
+        return paginator.page(request.GET.get('page'))
+    except PageNotAnInteger: # Страница не является целым числом; присвиваем 1
+        return paginator.page(1)
+    except EmptyPage: # Выход за пределы интервала; присвиваем последнюю страницу
+        return paginator.page(paginator.num_pages)
+
+
+def paginate_tag_posts(request, tag):
+    '''страница статей тега: строки выбираются из индекса PostTag (tag, publish, post) без JOIN
+    с обобщенной таблицей taggit и без сортировки, статьи присоединяются к строкам страницы по id.
+    Количество для номеров страниц берется из TagStat (тег загружается с select_related('blog_stat'))'''
+    rows = PostTag.objects.filter(tag=tag, post__status='published')\
+                          .select_related('post__author').prefetch_related('post__tags')
+    try:
+        count = tag.blog_stat.post_count
+    except TagStat.DoesNotExist: # у тега нет опубликованных статей
+        count = 0
+    page = paginate_posts(request, rows, ordering=('-publish', '-post_id'), count=count)
+    page.object_list = [row.post for row in page.object_list]
+    return page
+
+
+def published_on(year, month, day, slug):
+    '''условия поиска статьи по адресу /год/месяц/день/слаг/: вместо publish__year/__month/__day,
+    которые не используют индекс, – полуоткрытый диапазон дня в текущей временной зоне,
+    то есть один поиск по индексу (slug, publish) независимо от размера таблицы'''
+    try:
+        start, end = period_range(year, month, day)
+    except ValueError: # несуществующая дата, например 2021/02/30
+        raise Http404
+    return {'slug': slug, 'publish__gte': start, 'publish__lt': end}
+
+
+def search_page(query, page):
+    '''страница результатов поиска: опубликованные статьи в порядке релевантности
+    (полнотекстовый поиск PostgreSQL или инвертированный индекс в памяти процесса с ранжированием BM25)'''
+    return Paginator(get_search_backend().search(query), 10).get_page(page)
+
+
+@conditional_content
 def post_list(request, tag_slug=None): # Принимаем необязательный аргумент tag_slug, который по умолчанию равен None.
                                        # Этот параметр будет задаваться в URL’е
-    object_list = Post.published.all() # используем переопределенный QuerySet модели вместо получения всех объектов;
-                                       # находим все опубликованные статьи
+    object_list = Post.published.for_list() # используем переопределенный QuerySet модели вместо получения всех объектов;
+                                            # находим все опубликованные статьи вместе с авторами и тегами
     tag = None
 
     if tag_slug: # если указан слаг тега, получаем соответствующий объект модели Tag с помощью метода get_object_or_404()
-        tag = get_object_or_404(Tag, slug=tag_slug)
-        object_list = object_list.filter(tags__in=[tag]) # фильтруем изначальный список статей и оставляем только те,
-                                                         # которые связаны с полученным тегом.
-                                                         # Так как это связь «многие ко многим», необходимо фильтровать статьи
-                                                         # по вхождению тегов в список тегов
+        tag = get_object_or_404(Tag.objects.select_related('blog_stat'), slug=tag_slug)
+        posts = paginate_tag_posts(request, tag) # статьи тега выбираются из индекса PostTag (см. models.py)
+    else:
+        posts = paginate_posts(request, object_list)
 
-    paginator = Paginator(object_list, 3) # по 3 статьи на странице
     page = request.GET.get('page')
+    context = {'page': page, 'posts': posts, 'tag': tag}
+    return render (request, 'blog/post/list.html', context=context)
+
 
+@conditional_content
+def post_archive(request, year=None, month=None, day=None):
+    '''архив: без параметров – список лет, для года – месяцы, для месяца – дни (с количеством статей)
+    и статьи периода. Количества берутся из ArchiveDay, статьи – по диапазону publish (см. archive.py)'''
+    if year is None:
+        context = {'periods': period_counts(day_counts(), 'year'), 'period': None}
+        return render(request, 'blog/post/archive.html', context=context)
     try:
-        posts = paginator.page(page)
-    except PageNotAnInteger: # Страница не является целым числом; присвиваем 1
-        posts = paginator.page(1)
-    except EmptyPage: # Выход за пределы интервала; присвиваем последнюю страницу
-        posts = paginator.page(paginator.num_pages)
+        start, end = period_range(year, month, day)
+    except ValueError:
+        raise Http404
+    counts = day_counts(start, end)
+    total = sum(count for _, count in counts)
+    object_list = Post.published.for_list().filter(publish__gte=start, publish__lt=end)
+    context = {'period': 'day' if day else 'month' if month else 'year', 'start': start, 'total': total,
+               'periods': [] if day else period_counts(counts, 'day' if month else 'month'),
+               'posts': paginate_posts(request, object_list, count=total)}
+    return render(request, 'blog/post/archive.html', context=context)
 
-    context = {'page': page, 'posts': posts, 'tag': tag}
-    return render (request, 'blog/post/list.html', context=context)
+
+@conditional_content
+def tag_cloud(request):
+    '''облако тегов: самые популярные теги в алфавитном порядке, размер шрифта зависит от количества статей;
+    читаются только материализованные счетчики TagStat (без агрегации по статьям)'''
+    stats = list(TagStat.objects.filter(post_count__gt=0).select_related('tag')
+                                .order_by('-post_count', 'tag__name')[:TAG_CLOUD_SIZE])
+    largest = max((stat.post_count for stat in stats), default=1)
+    tags = [{'name': stat.tag.name, 'slug': stat.tag.slug, 'count': stat.post_count,
+             'size': 1 + round(4 * math.log(stat.post_count) / math.log(largest)) if largest > 1 else 1}
+            for stat in sorted(stats, key=lambda stat: stat.tag.name.lower())]
+    return render(request, 'blog/post/tags.html', context={'tags': tags})
 
 
+@conditional_content
 def post_detail(request, year, month, day, post): 
     '''принимает аргументы для получения статьи по указанным слагу и дате,
     чтобы гарантированно получить статью по комбинации этих полей,
     поскольку слаг должен быть уникальным для статей, созданных в один день'''
-    post = get_object_or_404(Post, # используем get_object_or_404() для поиска нужной статьи;
-                                   # возвращает объект, который подходит по указанным параметрам,
-                                   # или вызывает исключение HTTP 404 (объект не найден), если не найдет ни одной статьи
-                             slug=post,
-                             status='published',
-                             publish__year=year,
-                             publish__month=month,
-                             publish__day=day)
-    # Список активных комментариев для этой статьи
-    comments = post.comments.filter(active=True) # добавили QuerySet для получения всех активных комментариев,
-                                                 # используя объект статьи post и менеджер связанных объектов comments, 
-                                                 # определенный в модели Comment в аргументе related_name.
+    post = get_object_or_404(Post.published.for_detail(), # используем get_object_or_404() для поиска нужной статьи;
+                                                          # возвращает объект, который подходит по указанным параметрам,
+                                                          # или вызывает исключение HTTP 404 (объект не найден), если не найдет ни одной статьи;
+                                                          # автор, теги и активные комментарии загружаются заранее
+                             **published_on(year, month, day, post))
+    # Первая страница активных комментариев; остальные страницы подгружаются через post_comments
+    comments = comment_page(post.id)
     new_comment = None # используется, когда новый комментарий будет успешно создан
     if request.method == 'POST':
         # Пользователь отправил комментарий
@@ -99,23 +193,27 @@ def post_detail(request, year, month, day, post):
             new_comment.post = post # указываем в комментарии ссылку на объект статьи
             # Сохраняем комментарий в базе данных
             new_comment.save() # сохраняем комментарий в базу данных
+            if new_comment.active and not comments.has_next():
+                comments.object_list.append(new_comment) # новый комментарий – последний, показываем его, если видна последняя страница
     else:
         comment_form = CommentForm() # используем для инициализации формы при GET-запросе
-    # Формирование списка похожих статей
-    post_tags_ids = post.tags.values_list('id', flat=True) # получает все ID тегов текущей статьи;
-                                                           # Метод QuerySet’а values_list() возвращает кортежи со значениями заданного поля. 
-                                                           # Мы указали flat=True, чтобы получить «плоский» список вида [1, 2, 3, ...]
-    similar_posts = Post.published.filter(tags__in=post_tags_ids).exclude(id=post.id) # получает все статьи, содержащие хоть один тег из полученных ранее, исключая текущую статью;
-    similar_posts = similar_posts.annotate(same_tags=Count('tags')).order_by('-same_tags', '-publish')[:4] # использует функцию агрегации Count 
-                                                           # для формирования вычисляемого поля same_tags, 
-                                                           # которое содержит определенное количество совпадающих тегов;
-                                                           # сортирует список опубликованных статей в убывающем порядке по количеству 
-                                                           # совпадающих тегов для отображения первыми максимально похожих статей и 
-                                                           # делает срез результата для отображения только четырех статей.
-    context = {'post': post, 'comments': comments, 'new_comment': new_comment,
-               'comment_form': comment_form, 'similar_posts': similar_posts}
+    # Похожие статьи (с наибольшим количеством общих тегов) рассчитываются заранее
+    # командой build_similar_posts и при изменении тегов, здесь только читаются из таблицы SimilarPost
+    similar_posts = post.get_similar_posts(4)
+    context = {'post': post, 'comments': comments, 'next_comments_url': next_comments_url(post.id, comments),
+               'new_comment': new_comment, 'comment_form': comment_form, 'similar_posts': similar_posts}
     return render(request, 'blog/post/detail.html', context=context)
 
+
+@conditional_content
+def post_comments(request, post_id):
+    '''следующая страница комментариев в формате JSON: HTML-фрагмент и адрес следующей страницы;
+    страница статьи содержит только первую страницу комментариев, остальные подгружаются скриптом'''
+    get_object_or_404(Post.published.only('id'), id=post_id)
+    comments = comment_page(post_id, request.GET.get('cursor'))
+    html = render_to_string('blog/post/comments.html', {'comments': comments}, request=request)
+    return JsonResponse({'html': html, 'next': next_comments_url(post_id, comments)})
+
 def post_share(request, post_id):
     '''получение статьи по идентификатору'''
     post = get_object_or_404(Post, id=post_id, status='published') # получения статьи с указанным идентификатором; убеждаемся, что статья опубликована; иначе - 404
@@ -140,10 +238,9 @@ def post_share(request, post_id):
                                                                            # в request.build_absolute_uri() передается результат выполнения get_absolute_url()
             subject = f"{cd['name']} ({cd['email']}) рекомендует Вам прочитать статью {post.title}"              # тема сообщения
             message = f"Для чтения статьи: {post.title} \n\nперейдите по ссылке: {post_url}\n\nкомментарий {cd['name']}: {cd['comments']}" # текст сообщения
-            send_mail(subject, message, 'admin', [cd['to']]) # Функция send_mail() принимает в качестве обязательных аргументов тему, сообщение, отправителя и список получателей. 
-                                                             # Указав дополнительный параметр fail_silently=False, мы говорим, чтобы при сбое в отправке сообщения было сгенерировано исключение. 
-                                                             # Если в результате выполнения вы увидите 1, ваше письмо успешно отправлено.
-                                                             # В данном случае отправили e-mail по адресам, указанным в поле to формы.
+            # письмо не отправляется сразу, а ставится в очередь: обработчик не ждет SMTP-сервер
+            # и не падает при его недоступности; отправкой занимается команда send_outbox (см. outbox.py)
+            OutboxMessage.objects.create(subject=subject, body=message, from_email='admin', recipients=[cd['to']])
             sent = True
     else:
         form = EmailPostForm() # Когда обработчик выполняется первый раз с GET-запросом, 
@@ -162,12 +259,39 @@ def post_search(request):
         form = SearchForm(request.GET) # Когда запрос отправлен, мы инициализируем объект формы с параметрами из request.GET, 
         if form.is_valid(): # проверяем корректность введенных данных
             query = form.cleaned_data['query']
-            search_vector = SearchVector('title', weight='A') + SearchVector('body', weight='B') # формируем запрос c разным весом для полей: title и body;
-                                                                                                 # По умолчанию используются веса D, C, B и A, которые соответствуют числам 0.1, 0.2, 0.4 и 1. 
-                                                                                                 # для вектора по полю title применили вес 1.0, для вектора по полю body - 0.4.
-            search_query = SearchQuery(query)
-            results = Post.objects.annotate(similarity=TrigramSimilarity('title', query)).filter(similarity__gt=0.3).order_by('-similarity')
+            results = search_page(query, request.GET.get('page'))
 
     context = {'form': form, 'query': query, 'results': results}
     return render(request, 'blog/post/search.html', context=context)
 
+
+
+@staff_member_required
+def post_export(request):
+    '''выгрузка статей с тегами и комментариями в JSONL (только для персонала).
+    Ответ формируется потоком по мере чтения базы, поэтому не держит выгрузку в памяти;
+    ?since=2021-03-01T00:00 – только изменения после указанного момента, ?gzip=1 – сжатие gzip'''
+    since = request.GET.get('since')
+    if since:
+        try:
+            since = parse_since(since)
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+    content = export_lines(since or None)
+    if request.GET.get('gzip'):
+        response = StreamingHttpResponse(gzip_stream(content), content_type='application/gzip')
+        filename = 'blog.jsonl.gz'
+    else:
+        response = StreamingHttpResponse(content, content_type='application/x-ndjson; charset=utf-8')
+        filename = 'blog.jsonl'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+@never_cache
+def csrf_token(request):
+    '''CSRF-токен для форм статических копий страниц (см. prerender.py): в них токен не записывается,
+    и скрипт страницы запрашивает его здесь; вместе с ответом посетитель получает CSRF-cookie.
+    never_cache – ответ не попадает в кеш страниц и в кеши по пути к посетителю'''
+    return JsonResponse({'token': get_token(request)})
@@ -68,12 +68,17 @@ INSTALLED_APPS = [  # список активных приложений на с
     'django.contrib.staticfiles',   # подсистема для управления статическим содержимым сайта
 ]
 
-MIDDLEWARE = [ # список подключенных промежуточных слоев
+MIDDLEWARE = [ # список подключенных промежуточных слоев; под ASGI все они должны поддерживать async
+              # (слои блога и Django 3.1 поддерживают), иначе запросы выполняются в одном потоке по очереди
+    'blog.metrics.MetricsMiddleware', # первым, чтобы учитывать время остальных слоев
+    'blog.routers.ReplicaPinMiddleware', # до слоев и обработчиков, читающих данные блога
     'django.middleware.security.SecurityMiddleware',
+    'blog.staticfiles.StaticFilesMiddleware', # отдает собранную статику до остальных слоев
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'blog.middleware.AnonymousPageCacheMiddleware', # должен стоять после CsrfViewMiddleware и AuthenticationMiddleware
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -106,6 +111,25 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
 DATABASES = local_settings.DATABASES
+# чтение данных блога с реплик (см. blog/routers.py): реплики описываются в local_settings.DATABASES
+# и перечисляются в local_settings.READ_REPLICAS, например для двух баз SQLite:
+#     DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'primary.sqlite3'},
+#                  'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica.sqlite3',
+#                              'TEST': {'MIRROR': 'default'}}}
+#     READ_REPLICAS = ['replica']
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = { # кеш в памяти процесса; для нескольких процессов нужен общий кеш (Memcached или Redis):
+           # с кешем процесса остальные процессы видят изменения контента с задержкой до BLOG_LOCAL_CACHE_TIMEOUT
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mysite',
+    }
+}
 
 
 # Password validation
@@ -149,6 +173,43 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles' # сюда collectstatic собирает файлы с хешем в имени и их сжатые копии
+STATICFILES_STORAGE = 'blog.staticfiles.CompressedManifestStaticFilesStorage' # см. blog/staticfiles.py
+
+# blog settings
+BLOG_MARKDOWN_EXTENSIONS = [] # расширения Markdown для рендеринга статей;
+                              # после изменения списка выполните: python manage.py render_posts
+BLOG_PAGINATION = 'keyset'    # 'keyset' - навигация по курсору (publish, id) без COUNT(*) и OFFSET;
+                              # 'offset' - стандартный Paginator с номерами страниц
+BLOG_ASYNC_VIEWS = False      # True - асинхронные обработчики списка, статьи и поиска (для запуска под ASGI)
+BLOG_COMMENTS_PER_PAGE = 20   # количество комментариев на странице статьи и в каждой подгружаемой странице
+BLOG_CACHE_TIMEOUT = 300      # время жизни (в секундах) закешированных фрагментов боковой панели
+BLOG_SIMILAR_REFRESH_LIMIT = 200 # сколько статей пересчитывать сразу при изменении тегов (остальные –
+                                # в очереди, которую разбирает build_similar_posts --queued)
+BLOG_LOCAL_CACHE_TIMEOUT = 60  # при кеше в памяти процесса – сколько секунд другие процессы могут отдавать
+                              # устаревшие страницы, ленты и карту сайта (с общим кешем не используется)
+BLOG_PAGE_CACHE_TIMEOUT = 600 # время жизни (в секундах) страниц блога, закешированных для анонимных
+                              # посетителей (ключ содержит версию контента); 0 отключает кеш страниц
+
+# поисковый бэкенд: полнотекстовый поиск PostgreSQL или (без PostgreSQL) инвертированный индекс в памяти
+if DATABASES['default']['ENGINE'].endswith('postgresql'):
+    BLOG_SEARCH_BACKEND = 'blog.search.postgres.PostgresSearchBackend'
+else:
+    BLOG_SEARCH_BACKEND = 'blog.search.memory.InvertedIndexSearchBackend'
+BLOG_SEARCH_INDEX_PATH = None   # файл снимка индекса в памяти для быстрого старта (создается командой build_search_index)
+BLOG_SEARCH_SYNC_INTERVAL = 30  # как часто (в секундах) индекс в памяти подхватывает изменения других процессов
+BLOG_SITEMAP_SECTION_SIZE = 5000 # количество id статей в одном разделе карты сайта
+BLOG_SITEMAP_GZIP = True         # хранить разделы карты сайта в кеше сжатыми и отдавать их с Content-Encoding: gzip
+BLOG_FEED_FULL_CONTENT = False   # выводить в лентах RSS/Atom весь HTML статьи вместо анонса
+BLOG_OUTBOX_RETRY_DELAY = 60     # задержка (в секундах) после первой неудачной отправки письма, далее удваивается
+BLOG_SERVER_TIMING = False       # добавлять к ответам заголовок Server-Timing с разбивкой времени запроса
+BLOG_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1'] # адреса, с которых доступны метрики /metrics (None – с любых)
+BLOG_OUTBOX_MAX_ATTEMPTS = 8     # после стольких неудачных попыток письмо остается в очереди неотправленным
+BLOG_READ_REPLICAS = getattr(local_settings, 'READ_REPLICAS', []) # псевдонимы баз-реплик для чтения данных блога
+BLOG_SERVE_STATIC = True         # отдавать файлы из STATIC_ROOT средствами Django (False – если их отдает веб-сервер)
+BLOG_STATIC_MAX_AGE = 60         # время кеширования (в секундах) статических файлов без хеша в имени
+BLOG_REPLICA_PIN_SECONDS = 10    # сколько секунд после записи посетитель читает из основной базы
+                                 # (должно превышать обычное отставание реплик)
 
 # email settings
 EMAIL_HOST = local_settings.EMAIL_HOST
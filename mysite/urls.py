@@ -16,14 +16,13 @@ Including another URLconf
 
 from django.urls import path, include
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap # подключили необходимые модули
-from blog.sitemaps import PostSitemap             # для карты сайта
-
-sitemaps = {'posts': PostSitemap,}                # определили словарь карт сайта
+from blog.sitemaps import sitemap_index, sitemap_section # карта сайта, разбитая на кешируемые разделы
+from blog.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('blog/', include('blog.urls', namespace='blog')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, # шаблон URL’а, который соответствует адресуsitemap.xml и обработчику sitemap
-         name='django.contrib.sitemaps.views.sitemap')
+    path('sitemap.xml', sitemap_index, name='blog_sitemap_index'), # индекс карты сайта со ссылками на разделы
+    path('sitemap-posts-<int:section>.xml', sitemap_section, name='blog_sitemap_section'),
+    path('metrics', metrics_view, name='blog_metrics'), # метрики производительности для Prometheus
 ]